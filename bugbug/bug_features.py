@@ -7,8 +7,6 @@ import re
 import sys
 from collections import defaultdict
 from datetime import datetime, timezone
-from functools import partial
-from multiprocessing.pool import Pool
 
 import pandas as pd
 from dateutil import parser
@@ -16,7 +14,7 @@ from libmozdata import versions
 from libmozdata.bugzilla import Bugzilla
 from sklearn.base import BaseEstimator, TransformerMixin
 
-from bugbug import bug_snapshot, bugzilla, repository, utils
+from bugbug import bug_snapshot, bugzilla, feature_cache, repository, utils
 
 utils.setup_libmozdata()
 
@@ -620,6 +618,23 @@ def get_author_ids():
     return author_ids
 
 
+# The extractor and the author IDs used by the worker processes.
+_worker_extractor: "BugExtractor | None" = None
+_worker_author_ids: set[str] | None = None
+
+
+def _init_worker(extractor: "BugExtractor", author_ids: set[str] | None) -> None:
+    global _worker_extractor, _worker_author_ids
+    _worker_extractor = extractor
+    _worker_author_ids = author_ids
+
+
+def _extract_in_worker(item):
+    assert _worker_extractor is not None
+    bug, reporter_experience = item
+    return _worker_extractor.extract(bug, reporter_experience, _worker_author_ids)
+
+
 class BugExtractor(BaseEstimator, TransformerMixin):
     def __init__(
         self,
@@ -629,6 +644,8 @@ class BugExtractor(BaseEstimator, TransformerMixin):
         rollback_when=None,
         commit_data=False,
         merge_data=True,
+        n_jobs=1,
+        chunk_size=256,
     ):
         assert len(set(type(fe) for fe in feature_extractors)) == len(
             feature_extractors
@@ -643,6 +660,14 @@ class BugExtractor(BaseEstimator, TransformerMixin):
         self.rollback_when = rollback_when
         self.commit_data = commit_data
         self.merge_data = merge_data
+        self.n_jobs = n_jobs
+        self.chunk_size = chunk_size
+
+    def __getstate__(self):
+        state = super().__getstate__()
+        # The feature cache is only attached for the duration of a training.
+        state.pop("feature_cache", None)
+        return state
 
     def fit(self, x, y=None):
         for feature in self.feature_extractors:
@@ -651,64 +676,97 @@ class BugExtractor(BaseEstimator, TransformerMixin):
 
         return self
 
-    def transform(self, bugs):
-        bugs_iter = iter(bugs())
+    def get_cache_fingerprint(self) -> str | None:
+        # With commit data, the features also depend on the commits and on
+        # their authors, which are not part of the cache key.
+        if self.commit_data:
+            return None
 
-        reporter_experience_map = defaultdict(int)
-        author_ids = get_author_ids() if self.commit_data else None
+        return feature_cache.get_fingerprint(
+            self.feature_extractors,
+            self.cleanup_functions,
+            self.rollback,
+            self.rollback_when,
+            self.merge_data,
+        )
 
-        def apply_transform(bug):
-            data = {}
+    def extract(self, bug, reporter_experience, author_ids):
+        if self.rollback:
+            bug = bug_snapshot.rollback(bug, when=self.rollback_when)
 
-            for feature_extractor in self.feature_extractors:
-                res = feature_extractor(
-                    bug,
-                    reporter_experience=reporter_experience_map[bug["creator"]],
-                    author_ids=author_ids,
-                )
+        data = {}
 
-                if hasattr(feature_extractor, "name"):
-                    feature_extractor_name = feature_extractor.name
-                else:
-                    feature_extractor_name = feature_extractor.__class__.__name__
+        for feature_extractor in self.feature_extractors:
+            res = feature_extractor(
+                bug,
+                reporter_experience=reporter_experience,
+                author_ids=author_ids,
+            )
 
-                if res is None:
-                    continue
+            if hasattr(feature_extractor, "name"):
+                feature_extractor_name = feature_extractor.name
+            else:
+                feature_extractor_name = feature_extractor.__class__.__name__
 
-                if isinstance(res, (list, set)):
-                    for item in res:
-                        data[sys.intern(f"{item} in {feature_extractor_name}")] = True
-                    continue
+            if res is None:
+                continue
 
-                data[feature_extractor_name] = res
-
-            reporter_experience_map[bug["creator"]] += 1
-
-            summary = bug["summary"]
-            comments = [c["text"] for c in bug["comments"]]
-            for cleanup_function in self.cleanup_functions:
-                summary = cleanup_function(summary)
-                comments = [cleanup_function(comment) for comment in comments]
-
-            return {
-                "data": data,
-                "title": summary,
-                "first_comment": "" if len(comments) == 0 else comments[0],
-                "comments": " ".join(comments),
-            }
-
-        def apply_rollback(bugs_iter):
-            with Pool() as p:
-                yield from p.imap(
-                    partial(bug_snapshot.rollback, when=self.rollback_when),
-                    bugs_iter,
-                    chunksize=1024,
-                )
+            if isinstance(res, (list, set)):
+                for item in res:
+                    data[sys.intern(f"{item} in {feature_extractor_name}")] = True
+                continue
 
-        if self.rollback:
-            bugs_iter = apply_rollback(bugs_iter)
+            data[feature_extractor_name] = res
+
+        summary = bug["summary"]
+        comments = [c["text"] for c in bug["comments"]]
+        for cleanup_function in self.cleanup_functions:
+            summary = cleanup_function(summary)
+            comments = [cleanup_function(comment) for comment in comments]
 
-        return pd.DataFrame(apply_transform(bug) for bug in bugs_iter)
+        return {
+            "data": data,
+            "title": summary,
+            "first_comment": "" if len(comments) == 0 else comments[0],
+            "comments": " ".join(comments),
+        }
+
+    def transform(self, bugs):
+        return pd.DataFrame(self.iter_transform(bugs))
+
+    def iter_transform(self, bugs):
+        author_ids = get_author_ids() if self.commit_data else None
+
+        # The reporter experience depends on the bugs that come before, so it is
+        # computed in order here rather than in the workers.
+        def with_reporter_experience():
+            reporter_experience_map = defaultdict(int)
+            for bug in bugs():
+                yield bug, reporter_experience_map[bug["creator"]]
+                reporter_experience_map[bug["creator"]] += 1
+
+        # Models loaded from older pickles don't have these attributes.
+        n_jobs = getattr(self, "n_jobs", 1)
+        chunk_size = getattr(self, "chunk_size", 256)
+
+        # Rolling back bugs is slow, so it always happens in a pool of processes.
+        if self.rollback and n_jobs == 1:
+            n_jobs = None
+
+        return utils.map_rows(
+            _extract_in_worker,
+            with_reporter_experience(),
+            get_key=lambda item: (
+                item[0]["id"],
+                item[0]["last_change_time"],
+                item[1],
+            ),
+            cache=getattr(self, "feature_cache", None),
+            n_jobs=n_jobs,
+            chunk_size=chunk_size,
+            initializer=_init_worker,
+            initargs=(self, author_ids),
+        )
 
 
 class IsPerformanceBug(SingleBugFeature):
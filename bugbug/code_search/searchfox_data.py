@@ -4,11 +4,18 @@
 # You can obtain one at http://mozilla.org/MPL/2.0/.
 
 import collections
-import glob
+import hashlib
 import json
+import logging
 import os
 import re
+import shutil
 import sys
+import tempfile
+import threading
+from typing import Iterator
+
+import orjson
 
 from bugbug.code_search import searchfox_download
 from bugbug.code_search.function_search import (
@@ -16,126 +23,313 @@ from bugbug.code_search.function_search import (
     FunctionSearch,
     register_function_search,
 )
+from bugbug.code_search.searchfox_download import CPP_EXTENSIONS
+from bugbug.utils import LMDBDict
 
+logger = logging.getLogger(__name__)
 
-def find_symbol_definition_for_line(path, line, searchfox_path):
-    searchfox_origfile_path = os.path.join(searchfox_path, path)
-    assert os.path.exists(searchfox_origfile_path), (
-        f"{searchfox_origfile_path} doesn't exist"
-    )
 
-    ret_obj = None
-    with open(searchfox_origfile_path, "r") as fd:
-        for line_content in fd:
-            obj = json.loads(line_content)
-            lineno = int(obj["loc"].split(":")[0])
+# Bump when the format of the index changes, so that it's rebuilt.
+SYMBOL_INDEX_VERSION = b"2"
+SYMBOL_INDEX_DIR = ".symbol_index"
+# Maximum number of symbol indexes kept open at the same time.
+MAX_OPEN_SYMBOL_INDEXES = 4
+
+HEADER_FILE, CPP_FILE, MM_FILE = range(3)
+
+_SYMBOL_PREFIX = b"s\0"
+_PRETTY_PREFIX = b"p\0"
+_FILE_PREFIX = b"f\0"
+_VERSION_KEY = b"m\0version"
+
+
+def _digest(value: str) -> bytes:
+    # Symbols, names and paths can be longer than the maximum size of LMDB keys,
+    # so keys contain a fixed-size digest of them instead.
+    return hashlib.sha1(value.encode("utf-8")).digest()
+
+
+def _get_file_kind(path: str) -> int | None:
+    ext = os.path.splitext(path)[1]
+    if ext == ".h":
+        return HEADER_FILE
+    if ext.startswith(".c"):
+        return CPP_FILE
+    if ext == ".mm":
+        return MM_FILE
+    return None
+
+
+def _get_pretty_suffixes(pretty: str) -> set[str]:
+    # Pretty names look like "function mozilla::gfx::CreateDataSourceSurface",
+    # index "CreateDataSourceSurface", "gfx::CreateDataSourceSurface" and
+    # "mozilla::gfx::CreateDataSourceSurface".
+    name = pretty.split(" ", 1)[-1]
+    parts = name.split("::")
+    return {"::".join(parts[i:]) for i in range(len(parts))}
+
+
+class SymbolIndex:
+    """An on-disk index of the definitions contained in a searchfox dump.
+
+    The index is built once per dump, in a directory alongside the analysis
+    files, and maps symbols and components of pretty names to the definitions
+    of the symbols, and files to the definitions they contain sorted by line.
+    Lookups are range scans on a B+tree, so they don't depend on the size of
+    the dump.
+    """
+
+    def __init__(self, searchfox_path: str) -> None:
+        self.searchfox_path = searchfox_path
+        index_path = os.path.join(searchfox_path, SYMBOL_INDEX_DIR)
+
+        if not self._is_built(index_path):
+            self._build(index_path)
+
+        self.db = LMDBDict(index_path, readonly=True)
+
+    def close(self) -> None:
+        self.db.close()
+
+    @staticmethod
+    def _is_built(index_path: str) -> bool:
+        if not os.path.exists(index_path):
+            return False
+
+        db = LMDBDict(index_path, readonly=True)
+        try:
+            return _VERSION_KEY in db and db[_VERSION_KEY] == SYMBOL_INDEX_VERSION
+        finally:
+            db.close()
+
+    def _build(self, index_path: str) -> None:
+        logger.info("Building the symbol index of %s", self.searchfox_path)
+
+        # Build the index in a temporary directory, so that a partial index is
+        # never used, even when multiple processes build it at the same time.
+        tmp_index_path = tempfile.mkdtemp(
+            prefix=f"{SYMBOL_INDEX_DIR}.", dir=self.searchfox_path
+        )
+        db = LMDBDict(tmp_index_path)
+        try:
+            for i, path in enumerate(self._iter_files()):
+                self._index_file(db, path)
+                if i % 1000 == 999:
+                    db.commit()
+
+            db[_VERSION_KEY] = SYMBOL_INDEX_VERSION
+        finally:
+            db.close()
+
+        shutil.rmtree(index_path, ignore_errors=True)
+        try:
+            os.rename(tmp_index_path, index_path)
+        except OSError:
+            # Another process built the index in the meantime.
+            shutil.rmtree(tmp_index_path)
+
+    def _iter_files(self) -> Iterator[str]:
+        for root, dirs, files in os.walk(self.searchfox_path):
+            dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+            for name in sorted(files):
+                if _get_file_kind(name) is not None or any(
+                    name.endswith(ext) for ext in CPP_EXTENSIONS
+                ):
+                    yield os.path.relpath(os.path.join(root, name), self.searchfox_path)
+
+    def _index_file(self, db: LMDBDict, path: str) -> None:
+        kind = _get_file_kind(path)
+        path_digest = _digest(path)
+
+        with open(os.path.join(self.searchfox_path, path), "r") as fd:
+            for line in fd:
+                # Skip parsing the lines which can't be definitions.
+                if '"syntax"' not in line or "def" not in line:
+                    continue
+
+                obj = json.loads(line)
+                if "syntax" not in obj:
+                    continue
 
-            if line >= lineno and "syntax" in obj:
                 syntax = obj["syntax"].split(",")
-                if "def" in syntax and "function" in syntax:
-                    ret_obj = {}
-                    ret_obj["file"] = path
-                    ret_obj["target_line"] = int(obj["loc"].split(":")[0])
-
-                    if "nestingRange" in obj:
-                        ret_obj["target_end_line"] = int(
-                            obj["nestingRange"].split("-")[-1].split(":")[0]
-                        )
-                    else:
-                        ret_obj["target_end_line"] = None
+                if "def" not in syntax:
+                    continue
+
+                lineno, col = obj["loc"].split(":")
+                syms = [sym for sym in obj.get("sym", "").split(",") if sym]
+                record = {
+                    "name": obj.get("pretty"),
+                    "syms": syms,
+                    "file": path,
+                    "kind": kind,
+                    "syntax": syntax,
+                    "target_line": int(lineno),
+                    "target_end_line": (
+                        int(obj["nestingRange"].split("-")[-1].split(":")[0])
+                        if "nestingRange" in obj
+                        else None
+                    ),
+                }
+                value = orjson.dumps(record)
+                position = b"%08d:%08d" % (int(lineno), int(col.split("-")[0]))
+
+                if "function" in syntax:
+                    db[_FILE_PREFIX + path_digest + position] = value
+
+                if kind is None:
+                    continue
+
+                suffix = path_digest + position
+                for sym in syms:
+                    db[_SYMBOL_PREFIX + _digest(sym) + suffix] = value
+                if "pretty" in obj:
+                    for name in _get_pretty_suffixes(obj["pretty"]):
+                        db[_PRETTY_PREFIX + _digest(name) + suffix] = value
+
+    def _scan(self, prefix: bytes) -> Iterator[dict]:
+        cursor = self.db.txn.cursor()
+        if not cursor.set_range(prefix):
+            return
+
+        for key, value in cursor:
+            if not bytes(key).startswith(prefix):
+                break
+            yield orjson.loads(value)
+
+    def find_definitions(
+        self,
+        target_sym: str,
+        target_sym_is_pretty: bool = False,
+        headers_first: bool = False,
+        target_sym_type_restriction: str | None = None,
+    ) -> list[dict]:
+        """Find the definitions of a symbol, or of a (partially) qualified name.
+
+        The definitions are sorted by file, headers first or last.
+        """
+        if target_sym_is_pretty:
+            prefix = _PRETTY_PREFIX
+
+            def matches(record):
+                return target_sym in _get_pretty_suffixes(record["name"])
+        else:
+            prefix = _SYMBOL_PREFIX
+
+            def matches(record):
+                return target_sym in record["syms"]
+
+        records = [
+            record
+            for record in self._scan(prefix + _digest(target_sym))
+            if matches(record)
+            and (
+                target_sym_type_restriction is None
+                or target_sym_type_restriction in record["syntax"]
+            )
+        ]
+
+        kind_order = (
+            (HEADER_FILE, CPP_FILE, MM_FILE)
+            if headers_first
+            else (CPP_FILE, MM_FILE, HEADER_FILE)
+        )
+        records.sort(
+            key=lambda record: (
+                kind_order.index(record["kind"]),
+                record["file"],
+                record["target_line"],
+            )
+        )
 
-    return ret_obj
+        return records
 
+    def find_function_for_line(self, path: str, line: int) -> dict | None:
+        """Find the last function defined at or before a line of a file."""
+        prefix = _FILE_PREFIX + _digest(path)
 
-def find_symbol_definition(
-    searchfox_path,
-    target_symbols=None,
-    target_sym_is_pretty=False,
-    headers_first=False,
-    target_sym_type_restriction=None,
-):
-    searchfox_files = []
-    searchfox_header_files = glob.glob(
-        os.path.join(searchfox_path, "**/*.h"), recursive=True
-    )
-    searchfox_cpp_files = glob.glob(
-        os.path.join(searchfox_path, "**/*.c*"), recursive=True
-    )
-    searchfox_mm_files = glob.glob(
-        os.path.join(searchfox_path, "**/*.mm"), recursive=True
-    )
+        cursor = self.db.txn.cursor()
+        # Position the cursor after the definitions starting at the line.
+        if cursor.set_range(prefix + b"%08d:" % (line + 1)):
+            if not cursor.prev():
+                return None
+        elif not cursor.last():
+            return None
 
-    if headers_first:
-        searchfox_files.extend(searchfox_header_files)
-        searchfox_files.extend(searchfox_cpp_files)
-        searchfox_files.extend(searchfox_mm_files)
-    else:
-        searchfox_files.extend(searchfox_cpp_files)
-        searchfox_files.extend(searchfox_mm_files)
-        searchfox_files.extend(searchfox_header_files)
+        if not bytes(cursor.key()).startswith(prefix):
+            return None
 
-    ret = collections.defaultdict(list)
-    target_symbols_left = target_symbols
+        record = orjson.loads(cursor.value())
+        return record if record["file"] == path else None
 
-    for searchfox_file in searchfox_files:
-        if not target_symbols_left:
-            break
 
-        with open(searchfox_file, "r") as fd:
-            data = fd.read()
+_symbol_indexes: collections.OrderedDict[str, SymbolIndex] = collections.OrderedDict()
+_symbol_indexes_lock = threading.Lock()
 
-            has_interesting_symbol = False
-            for target_sym in target_symbols_left:
-                if target_sym in data:
-                    has_interesting_symbol = True
-                    break
 
-            if not has_interesting_symbol:
-                continue
+def get_symbol_index(searchfox_path: str) -> SymbolIndex:
+    """Get the symbol index of a searchfox dump, building it if needed."""
+    searchfox_path = os.path.normpath(searchfox_path)
 
-            data = data.splitlines()
-            for line in data:
-                sym_found = None
-                for target_sym in target_symbols_left:
-                    if target_sym in line:
-                        obj = json.loads(line)
-                        if "syntax" in obj:
-                            syntax = obj["syntax"].split(",")
-                            if "def" in syntax and (
-                                target_sym_type_restriction is None
-                                or target_sym_type_restriction in syntax
-                            ):
-                                if (
-                                    not target_sym_is_pretty
-                                    or target_sym in obj["pretty"]
-                                ):
-                                    sym_found = target_sym
-                                    ret_obj = {}
-                                    ret_obj["name"] = obj["pretty"]
-                                    ret_obj["file"] = searchfox_file
-                                    ret_obj["target_line"] = int(
-                                        obj["loc"].split(":")[0]
-                                    )
+    with _symbol_indexes_lock:
+        if searchfox_path in _symbol_indexes:
+            _symbol_indexes.move_to_end(searchfox_path)
+            return _symbol_indexes[searchfox_path]
 
-                                    if "nestingRange" in obj:
-                                        ret_obj["target_end_line"] = int(
-                                            obj["nestingRange"]
-                                            .split("-")[-1]
-                                            .split(":")[0]
-                                        )
-                                    else:
-                                        ret_obj["target_end_line"] = None
+        index = SymbolIndex(searchfox_path)
+        _symbol_indexes[searchfox_path] = index
 
-                                    ret[target_sym].append(ret_obj)
+        while len(_symbol_indexes) > MAX_OPEN_SYMBOL_INDEXES:
+            _, old_index = _symbol_indexes.popitem(last=False)
+            old_index.close()
 
-                                    if not target_sym_is_pretty:
-                                        break
+        return index
 
-                if not target_sym_is_pretty and sym_found is not None:
-                    target_symbols_left.remove(sym_found)
 
-                if not target_symbols_left:
-                    break
+def find_symbol_definition_for_line(path, line, searchfox_path):
+    record = get_symbol_index(searchfox_path).find_function_for_line(path, line)
+    if record is None:
+        return None
+
+    return {
+        "name": record["name"],
+        "file": path,
+        "target_line": record["target_line"],
+        "target_end_line": record["target_end_line"],
+    }
+
+
+def find_symbol_definition(
+    searchfox_path,
+    target_symbols=None,
+    target_sym_is_pretty=False,
+    headers_first=False,
+    target_sym_type_restriction=None,
+):
+    index = get_symbol_index(searchfox_path)
+
+    ret = collections.defaultdict(list)
+    for target_sym in target_symbols or []:
+        records = index.find_definitions(
+            target_sym,
+            target_sym_is_pretty,
+            headers_first,
+            target_sym_type_restriction,
+        )
+        # Only the first definition of symbols is interesting, the others are
+        # the same definition seen from other translation units.
+        if not target_sym_is_pretty:
+            records = records[:1]
+
+        for record in records:
+            ret[target_sym].append(
+                {
+                    "name": record["name"],
+                    "file": os.path.join(searchfox_path, record["file"]),
+                    "target_line": record["target_line"],
+                    "target_end_line": record["target_end_line"],
+                }
+            )
+
     return ret
 
 
@@ -360,20 +554,6 @@ def extract_function_approx(
     return ret_context
 
 
-CPP_EXTENSIONS = [
-    ".c",
-    ".cpp",
-    ".cc",
-    ".cxx",
-    ".h",
-    ".hh",
-    ".hpp",
-    ".hxx",
-    ".mm",
-    ".m",
-]
-
-
 class FunctionSearchSearchfoxData(FunctionSearch):
     def get_function_by_line(
         self, commit_hash: str, path: str, line: int
@@ -388,7 +568,8 @@ class FunctionSearchSearchfoxData(FunctionSearch):
 
         result = []
 
-        definitions = [find_symbol_definition_for_line(path, line, searchfox_path)]
+        definition = find_symbol_definition_for_line(path, line, searchfox_path)
+        definitions = [definition] if definition is not None else []
 
         for definition in definitions:
             definition_path = definition["file"].replace(searchfox_path, "")
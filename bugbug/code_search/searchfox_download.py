@@ -3,20 +3,122 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this file,
 # You can obtain one at http://mozilla.org/MPL/2.0/.
 
+import concurrent.futures
+import logging
 import os
-import subprocess
+import shutil
 import sys
+import tempfile
+import zipfile
+
+import orjson
 
 from bugbug.utils import get_session, get_user_agent
 
+logger = logging.getLogger(__name__)
+
 SEARCHFOX_STORAGE_DATA = "searchfox_data"
 
+CPP_EXTENSIONS = [
+    ".c",
+    ".cpp",
+    ".cc",
+    ".cxx",
+    ".h",
+    ".hh",
+    ".hpp",
+    ".hxx",
+    ".mm",
+    ".m",
+]
+
+# Fields of the analysis records which are used by the lookups, the others are
+# dropped during the extraction.
+KEPT_FIELDS = ("loc", "syntax", "pretty", "sym", "nestingRange")
+
+DOWNLOAD_CHUNK_SIZE = 2**20
+# Number of files extracted by a task of the extraction processes.
+EXTRACT_BATCH_SIZE = 500
+
 
 class SearchfoxDataNotAvailable(Exception):
     pass
 
 
+def _filter_record(line: bytes) -> bytes | None:
+    # Only the records with syntax information (uses and definitions of
+    # symbols) are used, skip parsing the others.
+    if b'"syntax"' not in line:
+        return None
+
+    obj = orjson.loads(line)
+    if "syntax" not in obj:
+        return None
+
+    return (
+        orjson.dumps({field: obj[field] for field in KEPT_FIELDS if field in obj})
+        + b"\n"
+    )
+
+
+def _extract_members(zip_path: str, target_path: str, names: list[str]) -> None:
+    with zipfile.ZipFile(zip_path) as zf:
+        for name in names:
+            path = os.path.join(target_path, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+            with (
+                zf.open(name) as src,
+                open(path, "wb", buffering=DOWNLOAD_CHUNK_SIZE) as dst,
+            ):
+                for line in src:
+                    record = _filter_record(line)
+                    if record is not None:
+                        dst.write(record)
+
+
+def extract(zip_path: str, target_path: str, processes: int | None = None) -> None:
+    """Extract the analysis of C/C++ files from a searchfox index archive.
+
+    The records are filtered while they are decompressed, so that only the
+    records and fields used by the lookups are written to disk. The files are
+    decompressed in parallel by multiple processes.
+    """
+    with zipfile.ZipFile(zip_path) as zf:
+        names = [
+            info.filename
+            for info in zf.infolist()
+            if not info.is_dir()
+            and os.path.splitext(info.filename)[1] in CPP_EXTENSIONS
+            # Skip paths which would be outside of the target directory.
+            and not os.path.isabs(info.filename)
+            and ".." not in info.filename.split("/")
+        ]
+
+    os.makedirs(target_path, exist_ok=True)
+
+    batches = [
+        names[i : i + EXTRACT_BATCH_SIZE]
+        for i in range(0, len(names), EXTRACT_BATCH_SIZE)
+    ]
+
+    if processes == 1 or len(batches) <= 1:
+        for batch in batches:
+            _extract_members(zip_path, target_path, batch)
+        return
+
+    with concurrent.futures.ProcessPoolExecutor(processes) as executor:
+        futures = [
+            executor.submit(_extract_members, zip_path, target_path, batch)
+            for batch in batches
+        ]
+        for future in concurrent.futures.as_completed(futures):
+            future.result()
+
+
 def fetch(commit_hash: str) -> str:
+    os.makedirs(SEARCHFOX_STORAGE_DATA, exist_ok=True)
+
     folders = os.listdir(SEARCHFOX_STORAGE_DATA)
     for folder in folders:
         if folder.startswith(commit_hash):
@@ -72,33 +174,26 @@ def fetch(commit_hash: str) -> str:
         if not targetZipRequest.ok:
             raise SearchfoxDataNotAvailable("Searchfox data no longer available")
 
-        zip_path = os.path.join(SEARCHFOX_STORAGE_DATA, targetZipBasename)
-
-        os.makedirs(zip_path)
-
-        with open(
-            os.path.join(SEARCHFOX_STORAGE_DATA, targetZipBasename, "searchfox.zip"),
-            "wb",
-        ) as f:
-            for chunk in targetZipRequest.iter_content(chunk_size=1024):
-                if chunk:
+        # Download and extract the data in a temporary directory, which isn't
+        # returned by the lookups above until it's complete.
+        tmp_path = tempfile.mkdtemp(prefix=".", dir=SEARCHFOX_STORAGE_DATA)
+        try:
+            zip_path = os.path.join(tmp_path, "searchfox.zip")
+            with open(zip_path, "wb") as f:
+                for chunk in targetZipRequest.iter_content(
+                    chunk_size=DOWNLOAD_CHUNK_SIZE
+                ):
                     f.write(chunk)
 
-        # TODO: This uses unzip, we might want to use Python instead. However, the archive
-        # is a highly-compressed 300 MB file, that needs to be decompressed efficiently.
-        subprocess.check_call(["unzip", "searchfox.zip"], cwd=zip_path)
-
-        # TODO: When using only specific parts of searchfox data, such as syntax data,
-        # it can be beneficial to filter the remaining data out just once.
-
-        # for (path, dirs, files) in os.walk(SEARCHFOX_STORAGE_DATA):
-        #    for file in files:
-        #        fp_file = os.path.join(path, file)
-        #        with open(fp_file, 'r') as fd:
-        #            lines = fd.readlines()
-        #        lines = [x for x in lines if '"syntax"' in x]
-        #        with open(fp_file, 'w') as fd:
-        #            fd.writelines(lines)
+            target_path = os.path.join(tmp_path, "data")
+            extract(zip_path, target_path)
+            logger.info("Extracted the searchfox data of %s", rev)
+
+            os.rename(
+                target_path, os.path.join(SEARCHFOX_STORAGE_DATA, targetZipBasename)
+            )
+        finally:
+            shutil.rmtree(tmp_path, ignore_errors=True)
 
     folders = os.listdir(SEARCHFOX_STORAGE_DATA)
     for folder in folders:
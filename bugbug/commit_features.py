@@ -9,7 +9,7 @@ from typing import Sequence
 import pandas as pd
 from sklearn.base import BaseEstimator, TransformerMixin
 
-from bugbug import repository
+from bugbug import feature_cache, repository, utils
 
 EXPERIENCE_TIMESPAN = 90
 EXPERIENCE_TIMESPAN_TEXT = f"{EXPERIENCE_TIMESPAN}_days"
@@ -1007,8 +1007,22 @@ def merge_commits(commits: Sequence[repository.CommitDict]) -> repository.Commit
     )
 
 
+# The extractor used by the worker processes.
+_worker_extractor: "CommitExtractor | None" = None
+
+
+def _init_worker(extractor: "CommitExtractor") -> None:
+    global _worker_extractor
+    _worker_extractor = extractor
+
+
+def _extract_in_worker(commit):
+    assert _worker_extractor is not None
+    return _worker_extractor.extract(commit)
+
+
 class CommitExtractor(BaseEstimator, TransformerMixin):
-    def __init__(self, feature_extractors, cleanup_functions):
+    def __init__(self, feature_extractors, cleanup_functions, n_jobs=1, chunk_size=256):
         assert len(
             set(
                 fe.name if hasattr(fe, "name") else type(fe)
@@ -1021,6 +1035,14 @@ class CommitExtractor(BaseEstimator, TransformerMixin):
             cleanup_functions
         ), "Duplicate Cleanup Functions"
         self.cleanup_functions = cleanup_functions
+        self.n_jobs = n_jobs
+        self.chunk_size = chunk_size
+
+    def __getstate__(self):
+        state = super().__getstate__()
+        # The feature cache is only attached for the duration of a training.
+        state.pop("feature_cache", None)
+        return state
 
     def fit(self, x, y=None):
         for feature in self.feature_extractors:
@@ -1029,55 +1051,85 @@ class CommitExtractor(BaseEstimator, TransformerMixin):
 
         return self
 
+    def get_cache_fingerprint(self) -> str | None:
+        # Test scheduling features depend on the test job, which is not part of
+        # the cache key.
+        if any(
+            "test_scheduling_features" in feature_extractor.__module__
+            for feature_extractor in self.feature_extractors
+        ):
+            return None
+
+        return feature_cache.get_fingerprint(
+            self.feature_extractors, self.cleanup_functions
+        )
+
     def transform(self, commits):
-        results = []
+        return pd.DataFrame(self.iter_transform(commits))
 
-        for commit in commits():
-            data = {}
-            result = {"data": data}
+    def iter_transform(self, commits):
+        def get_key(commit):
+            return (
+                commit["node"],
+                commit["bug"]["last_change_time"] if commit.get("bug") else None,
+            )
 
-            for feature_extractor in self.feature_extractors:
-                if "bug_features" in feature_extractor.__module__:
-                    if not commit["bug"]:
-                        continue
+        # Models loaded from older pickles don't have these attributes.
+        return utils.map_rows(
+            _extract_in_worker,
+            commits(),
+            get_key=get_key,
+            cache=getattr(self, "feature_cache", None),
+            n_jobs=getattr(self, "n_jobs", 1),
+            chunk_size=getattr(self, "chunk_size", 256),
+            initializer=_init_worker,
+            initargs=(self,),
+        )
 
-                    res = feature_extractor(commit["bug"])
-                elif "test_scheduling_features" in feature_extractor.__module__:
-                    res = feature_extractor(commit["test_job"], commit=commit)
-                else:
-                    res = feature_extractor(commit)
+    def extract(self, commit):
+        data = {}
+        result = {"data": data}
 
-                if res is None:
+        for feature_extractor in self.feature_extractors:
+            if "bug_features" in feature_extractor.__module__:
+                if not commit["bug"]:
                     continue
 
-                if hasattr(feature_extractor, "name"):
-                    feature_extractor_name = feature_extractor.name
-                else:
-                    feature_extractor_name = feature_extractor.__class__.__name__
+                res = feature_extractor(commit["bug"])
+            elif "test_scheduling_features" in feature_extractor.__module__:
+                res = feature_extractor(commit["test_job"], commit=commit)
+            else:
+                res = feature_extractor(commit)
 
-                # FIXME: This is a workaround to pass the value to the
-                # union transformer independently. This will be dropped when we
-                # resolve https://github.com/mozilla/bugbug/issues/3876
-                if isinstance(feature_extractor, (Files, FilesPathComponents)):
-                    result[sys.intern(feature_extractor_name)] = res
-                    continue
+            if res is None:
+                continue
 
-                if isinstance(res, dict):
-                    for key, value in res.items():
-                        data[sys.intern(key)] = value
-                    continue
+            if hasattr(feature_extractor, "name"):
+                feature_extractor_name = feature_extractor.name
+            else:
+                feature_extractor_name = feature_extractor.__class__.__name__
 
-                if isinstance(res, list):
-                    for item in res:
-                        data[sys.intern(f"{item} in {feature_extractor_name}")] = True
-                    continue
+            # FIXME: This is a workaround to pass the value to the
+            # union transformer independently. This will be dropped when we
+            # resolve https://github.com/mozilla/bugbug/issues/3876
+            if isinstance(feature_extractor, (Files, FilesPathComponents)):
+                result[sys.intern(feature_extractor_name)] = res
+                continue
+
+            if isinstance(res, dict):
+                for key, value in res.items():
+                    data[sys.intern(key)] = value
+                continue
 
-                data[sys.intern(feature_extractor_name)] = res
+            if isinstance(res, list):
+                for item in res:
+                    data[sys.intern(f"{item} in {feature_extractor_name}")] = True
+                continue
 
-            if "desc" in commit:
-                for cleanup_function in self.cleanup_functions:
-                    result["desc"] = cleanup_function(commit["desc"])
+            data[sys.intern(feature_extractor_name)] = res
 
-            results.append(result)
+        if "desc" in commit:
+            for cleanup_function in self.cleanup_functions:
+                result["desc"] = cleanup_function(commit["desc"])
 
-        return pd.DataFrame(results)
+        return result
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import glob
+import hashlib
+import inspect
+import json
+import logging
+import os
+import pickle
+import re
+import shutil
+import sys
+import time
+from contextlib import contextmanager
+from typing import Any, Iterator
+
+from sklearn.pipeline import Pipeline
+
+from bugbug import get_bugbug_version
+from bugbug.utils import LMDBDict
+
+logger = logging.getLogger(__name__)
+
+# Bump this when the format of the cached rows changes.
+FEATURE_CACHE_VERSION = 1
+
+FEATURE_CACHE_DIR = os.path.join("data", "feature_cache")
+
+# Caches which weren't used for this long are removed.
+FEATURE_CACHE_MAX_AGE = 7 * 24 * 60 * 60
+
+
+def _describe(obj: Any, modules: set[str]) -> Any:
+    if obj is None or isinstance(obj, (bool, int, float, str)):
+        return obj
+
+    if isinstance(obj, (list, tuple)):
+        return [_describe(o, modules) for o in obj]
+
+    if isinstance(obj, (set, frozenset)):
+        return sorted((_describe(o, modules) for o in obj), key=repr)
+
+    if isinstance(obj, dict):
+        return sorted(
+            ((repr(key), _describe(value, modules)) for key, value in obj.items()),
+            key=lambda item: item[0],
+        )
+
+    if isinstance(obj, re.Pattern):
+        return obj.pattern
+
+    # Functions and classes.
+    if hasattr(obj, "__qualname__"):
+        modules.add(obj.__module__)
+        return f"{obj.__module__}.{obj.__qualname__}"
+
+    if hasattr(obj, "__dict__"):
+        modules.add(type(obj).__module__)
+        return [
+            f"{type(obj).__module__}.{type(obj).__qualname__}",
+            _describe(vars(obj), modules),
+        ]
+
+    return repr(obj)
+
+
+def _get_source(module_name: str) -> str | None:
+    # The code of the extractors (and of the helpers they use) can change
+    # without the bugbug version changing, e.g. during development.
+    if module_name.split(".")[0] != "bugbug" or module_name not in sys.modules:
+        return None
+
+    try:
+        return inspect.getsource(sys.modules[module_name])
+    except (OSError, TypeError):
+        return None
+
+
+def get_fingerprint(*objs: Any) -> str:
+    """Compute a fingerprint of the given extractors and of their configuration.
+
+    The fingerprint is stable across runs, and changes whenever the extractors,
+    their parameters, the code of the bugbug modules defining them or the
+    bugbug version change.
+    """
+    modules: set[str] = set()
+    description = _describe(objs, modules)
+    sources = [(name, _get_source(name)) for name in sorted(modules)]
+    description = json.dumps(
+        [FEATURE_CACHE_VERSION, get_bugbug_version(), description, sources],
+        default=repr,
+    )
+    return hashlib.sha256(description.encode("utf-8")).hexdigest()
+
+
+class FeatureCache:
+    """Persistent cache of the rows extracted from items by an extractor."""
+
+    def __init__(self, name: str, fingerprint: str) -> None:
+        self.path = os.path.join(FEATURE_CACHE_DIR, f"{name}_{fingerprint[:16]}")
+
+        # Caches for other fingerprints are likely never used again, unless
+        # they are used by a concurrent training with another configuration.
+        for path in glob.glob(os.path.join(FEATURE_CACHE_DIR, f"{name}_*")):
+            if (
+                path != self.path
+                and time.time() - os.path.getmtime(path) > FEATURE_CACHE_MAX_AGE
+            ):
+                logger.info("Removing stale feature cache %s", path)
+                shutil.rmtree(path, ignore_errors=True)
+
+        os.makedirs(self.path, exist_ok=True)
+        # Record when the cache was last used.
+        os.utime(self.path)
+        self.db = LMDBDict(self.path)
+
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(key: tuple) -> bytes:
+        return "\0".join(str(k) for k in key).encode("utf-8")
+
+    def get(self, key: tuple) -> dict[str, Any] | None:
+        try:
+            row = pickle.loads(self.db[self._key(key)])
+        except KeyError:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return row
+
+    def put(self, key: tuple, row: dict[str, Any]) -> None:
+        self.db[self._key(key)] = pickle.dumps(row, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def close(self) -> None:
+        logger.info(
+            "Feature cache %s: %d hits, %d misses", self.path, self.hits, self.misses
+        )
+        self.db.close()
+
+
+@contextmanager
+def enabled(pipeline: Pipeline, name: str) -> Iterator[None]:
+    """Let the extractors in the pipeline reuse the rows cached by previous runs.
+
+    Only extractors which support caching (i.e. which define a
+    `get_cache_fingerprint` method returning a fingerprint) are affected.
+    """
+    caches = []
+    for step_name, step in pipeline.steps:
+        if not hasattr(step, "get_cache_fingerprint"):
+            continue
+
+        fingerprint = step.get_cache_fingerprint()
+        if fingerprint is None:
+            continue
+
+        step.feature_cache = FeatureCache(f"{name}_{step_name}", fingerprint)
+        caches.append(step)
+
+    try:
+        yield
+    finally:
+        # The cache must not end up in the pickled model.
+        for step in caches:
+            step.feature_cache.close()
+            del step.feature_cache
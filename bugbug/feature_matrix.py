@@ -0,0 +1,385 @@
+# -*- coding: utf-8 -*-
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Build training matrices incrementally from a stream of extracted rows.
+
+Instead of materializing a DataFrame of all the extracted rows (with their
+feature dicts) and vectorizing it at once, the rows are vectorized in chunks
+into CSR arrays, growing the vocabularies as new features appear. Once all the
+rows have been seen, the vocabularies are finalized the same way scikit-learn
+would (only from the rows the model is trained on), and the vectorizers of the
+model's column transformer are fitted accordingly.
+"""
+
+import itertools
+import logging
+from numbers import Integral
+from typing import Any, Callable, Iterable
+
+import numpy as np
+import pandas as pd
+import scipy.sparse
+from sklearn.compose import ColumnTransformer
+from sklearn.feature_extraction import DictVectorizer, FeatureHasher
+from sklearn.feature_extraction.text import (
+    CountVectorizer,
+    TfidfTransformer,
+    TfidfVectorizer,
+)
+from sklearn.frozen import FrozenEstimator
+
+from bugbug import utils
+
+logger = logging.getLogger(__name__)
+
+# Number of rows vectorized at once.
+CHUNK_SIZE = 4096
+
+# Number of features of the hashed columns.
+HASHED_FEATURES = 2**20
+
+
+class UnsupportedTransformerError(ValueError):
+    def __init__(self, name: str, transformer: Any) -> None:
+        super().__init__(
+            f"Can't vectorize column {name} incrementally with {transformer!r}"
+        )
+
+
+class _CSRBuilder:
+    """Accumulate the rows of a CSR matrix whose width can grow."""
+
+    def __init__(self, dtype) -> None:
+        self.dtype = dtype
+        self.indices: list[np.ndarray] = []
+        self.data: list[np.ndarray] = []
+        self.indptr = [np.zeros(1, dtype=np.int64)]
+        self.nnz = 0
+
+    def append(self, X: scipy.sparse.csr_matrix, columns: np.ndarray) -> None:
+        self.indices.append(columns[X.indices].astype(np.int64))
+        self.data.append(X.data.astype(self.dtype))
+        self.indptr.append(X.indptr[1:].astype(np.int64) + self.nnz)
+        self.nnz += X.nnz
+
+    def build(self, n_features: int) -> scipy.sparse.csr_matrix:
+        indptr = np.concatenate(self.indptr)
+        return scipy.sparse.csr_matrix(
+            (
+                np.concatenate(self.data) if self.data else np.zeros(0, self.dtype),
+                np.concatenate(self.indices) if self.indices else np.zeros(0, np.int64),
+                indptr,
+            ),
+            shape=(len(indptr) - 1, n_features),
+        )
+
+
+class _IncrementalDictVectorizer:
+    def __init__(self, vectorizer: DictVectorizer) -> None:
+        self.vectorizer = vectorizer
+        self.vocabulary: dict[str, int] = {}
+        self.builder = _CSRBuilder(vectorizer.dtype)
+
+    def partial_transform(self, values: list[Any]) -> None:
+        # Let a throwaway vectorizer decide how the values become features, so
+        # that they are exactly the same as with a regular fit.
+        chunk_vectorizer = DictVectorizer(
+            dtype=self.vectorizer.dtype,
+            separator=self.vectorizer.separator,
+            sort=False,
+        )
+        X = chunk_vectorizer.fit_transform(values).tocsr()
+        columns = np.array(
+            [
+                self.vocabulary.setdefault(feature, len(self.vocabulary))
+                for feature in chunk_vectorizer.feature_names_
+            ],
+            dtype=np.int64,
+        )
+        self.builder.append(X, columns)
+
+    def finalize(self, fit_rows: np.ndarray | None) -> scipy.sparse.csr_matrix:
+        X = self.builder.build(len(self.vocabulary))
+
+        # Only keep the features seen in the rows the vectorizer is fitted on.
+        X_fit = X if fit_rows is None else X[fit_rows]
+        seen = np.zeros(X.shape[1], dtype=bool)
+        seen[X_fit.indices] = True
+
+        self.vectorizer.feature_names_ = [
+            feature for feature, i in self.vocabulary.items() if seen[i]
+        ]
+        if self.vectorizer.sort:
+            self.vectorizer.feature_names_.sort()
+        self.vectorizer.vocabulary_ = {
+            feature: i for i, feature in enumerate(self.vectorizer.feature_names_)
+        }
+
+        columns = np.array(
+            [self.vocabulary[feature] for feature in self.vectorizer.feature_names_],
+            dtype=np.int64,
+        )
+        return X[:, columns]
+
+
+class _IncrementalCountVectorizer:
+    def __init__(self, vectorizer: CountVectorizer) -> None:
+        if vectorizer.vocabulary is not None:
+            raise UnsupportedTransformerError("text", vectorizer)
+
+        self.vectorizer = vectorizer
+        self.analyze = vectorizer.build_analyzer()
+        self.vocabulary: dict[str, int] = {}
+        self.builder = _CSRBuilder(vectorizer.dtype)
+
+    def partial_transform(self, values: list[Any]) -> None:
+        indices: list[int] = []
+        data: list[int] = []
+        indptr = [0]
+        for doc in values:
+            feature_counter: dict[int, int] = {}
+            for feature in self.analyze(doc):
+                feature_idx = self.vocabulary.setdefault(feature, len(self.vocabulary))
+                feature_counter[feature_idx] = feature_counter.get(feature_idx, 0) + 1
+
+            indices.extend(feature_counter.keys())
+            data.extend(feature_counter.values())
+            indptr.append(len(indices))
+
+        X = scipy.sparse.csr_matrix(
+            (data, indices, indptr), shape=(len(values), len(self.vocabulary))
+        )
+        self.builder.append(X, np.arange(len(self.vocabulary), dtype=np.int64))
+
+    def finalize(self, fit_rows: np.ndarray | None) -> scipy.sparse.csr_matrix:
+        vectorizer = self.vectorizer
+        X = self.builder.build(len(self.vocabulary))
+
+        # Sort the features and drop the too rare or too common ones, like
+        # CountVectorizer.fit_transform does.
+        terms = sorted(self.vocabulary)
+        order = np.empty(len(terms), dtype=np.int64)
+        for new_idx, term in enumerate(terms):
+            order[self.vocabulary[term]] = new_idx
+        X.indices = order[X.indices]
+        X.sort_indices()
+
+        X_fit = X if fit_rows is None else X[fit_rows]
+
+        n_doc = X_fit.shape[0]
+        max_doc_count = float(
+            vectorizer.max_df
+            if isinstance(vectorizer.max_df, Integral)
+            else vectorizer.max_df * n_doc
+        )
+        min_doc_count = float(
+            vectorizer.min_df
+            if isinstance(vectorizer.min_df, Integral)
+            else vectorizer.min_df * n_doc
+        )
+        if max_doc_count < min_doc_count:
+            raise ValueError("max_df corresponds to < documents than min_df")
+
+        # The terms which only appear in the other rows aren't in the vocabulary.
+        dfs = np.bincount(X_fit.indices, minlength=X.shape[1])
+        mask = (dfs > 0) & (dfs <= max_doc_count) & (dfs >= min_doc_count)
+        if vectorizer.max_features is not None and mask.sum() > vectorizer.max_features:
+            tfs = np.asarray(X_fit.sum(axis=0)).ravel()
+            mask_inds = (-tfs[mask]).argsort()[: vectorizer.max_features]
+            new_mask = np.zeros(len(dfs), dtype=bool)
+            new_mask[np.where(mask)[0][mask_inds]] = True
+            mask = new_mask
+
+        kept_indices = np.where(mask)[0]
+        if len(kept_indices) == 0:
+            raise ValueError(
+                "After pruning, no terms remain. Try a lower min_df or a higher max_df."
+            )
+
+        new_indices = np.cumsum(mask) - 1
+        vectorizer.vocabulary_ = {
+            term: int(new_indices[i]) for i, term in enumerate(terms) if mask[i]
+        }
+        vectorizer.fixed_vocabulary_ = False
+
+        X = X[:, kept_indices]
+        if vectorizer.binary:
+            X.data.fill(1)
+
+        if isinstance(vectorizer, TfidfVectorizer):
+            vectorizer._tfidf = TfidfTransformer(
+                norm=vectorizer.norm,
+                use_idf=vectorizer.use_idf,
+                smooth_idf=vectorizer.smooth_idf,
+                sublinear_tf=vectorizer.sublinear_tf,
+            ).fit(X if fit_rows is None else X[fit_rows])
+            X = vectorizer._tfidf.transform(X, copy=False)
+
+        return X
+
+
+class _IncrementalFeatureHasher:
+    def __init__(self, hasher: FeatureHasher) -> None:
+        self.hasher = hasher.fit([])
+        self.builder = _CSRBuilder(hasher.dtype)
+
+    def partial_transform(self, values: list[Any]) -> None:
+        X = self.hasher.transform(values).tocsr()
+        self.builder.append(X, np.arange(X.shape[1], dtype=np.int64))
+
+    def finalize(self, fit_rows: np.ndarray | None) -> scipy.sparse.csr_matrix:
+        return self.builder.build(self.hasher.n_features)
+
+
+def _get_incremental_vectorizer(name: str, transformer: Any) -> Any:
+    if isinstance(transformer, DictVectorizer):
+        return _IncrementalDictVectorizer(transformer)
+    elif isinstance(transformer, CountVectorizer):
+        return _IncrementalCountVectorizer(transformer)
+    elif isinstance(transformer, FeatureHasher):
+        return _IncrementalFeatureHasher(transformer)
+    else:
+        raise UnsupportedTransformerError(name, transformer)
+
+
+def supports_incremental_fit(union: Any) -> bool:
+    """Check whether the column transformer can be fitted by build_matrix."""
+    if not isinstance(union, ColumnTransformer) or union.remainder != "drop":
+        return False
+
+    for name, transformer, column in union.transformers:
+        if transformer == "drop":
+            continue
+
+        if not isinstance(column, str):
+            return False
+
+        try:
+            _get_incremental_vectorizer(name, transformer)
+        except UnsupportedTransformerError:
+            return False
+
+    return True
+
+
+class HashedFeatures(FeatureHasher):
+    """A feature hasher whose features are named after their index.
+
+    This allows explaining the predictions of models using it.
+    """
+
+    def get_feature_names_out(self, input_features=None) -> np.ndarray:
+        return np.asarray([f"hashed_{i}" for i in range(self.n_features)], dtype=object)
+
+
+def hash_columns(
+    union: ColumnTransformer, columns: Iterable[str], n_features: int | None = None
+) -> None:
+    """Replace the vectorizers of the given columns with feature hashers.
+
+    Hashing keeps the number of features (and the memory needed to vectorize
+    them) bounded for very wide feature spaces, such as the files touched by
+    commits, and doesn't need any vocabulary. Only columns of dicts and of
+    lists of tokens can be hashed.
+    """
+    columns = set(columns)
+    transformers = []
+    for name, transformer, column in union.transformers:
+        if column in columns:
+            if isinstance(transformer, DictVectorizer):
+                input_type = "dict"
+            elif (
+                isinstance(transformer, CountVectorizer)
+                and transformer.analyzer is utils.keep_as_is
+            ):
+                input_type = "string"
+            else:
+                raise ValueError(f"Can't hash column {name} of {transformer!r}")
+
+            transformer = HashedFeatures(
+                n_features=n_features or HASHED_FEATURES, input_type=input_type
+            )
+        transformers.append((name, transformer, column))
+
+    union.set_params(transformers=transformers)
+
+
+def build_matrix(
+    rows: Iterable[dict[str, Any]],
+    union: ColumnTransformer,
+    chunk_size: int = CHUNK_SIZE,
+    get_fit_rows: Callable[[int], np.ndarray] | None = None,
+) -> scipy.sparse.csr_matrix:
+    """Vectorize the rows incrementally and fit the column transformer.
+
+    Args:
+        rows: the extracted rows.
+        union: the column transformer to fit (it must support incremental fitting).
+        chunk_size: the number of rows to vectorize at once.
+        get_fit_rows: a function returning, given the number of rows, the
+            indices of the rows to fit the column transformer on (e.g. the
+            training set). By default, it is fitted on all the rows.
+
+    Returns:
+        the CSR matrix, equivalent to the output of union.transform on a
+        DataFrame of all the rows, after fitting it on the given rows.
+    """
+    vectorizers = [
+        (name, column, _get_incremental_vectorizer(name, transformer))
+        for name, transformer, column in union.transformers
+        if transformer != "drop"
+    ]
+
+    first_chunk = None
+    n_rows = 0
+    for chunk in itertools.batched(rows, chunk_size):
+        if first_chunk is None:
+            first_chunk = chunk
+        n_rows += len(chunk)
+
+        for name, column, vectorizer in vectorizers:
+            vectorizer.partial_transform([row[column] for row in chunk])
+
+    assert first_chunk is not None, "No rows to vectorize"
+
+    fit_rows = None
+    if get_fit_rows is not None:
+        fit_rows = np.sort(get_fit_rows(n_rows))
+
+    matrices = [vectorizer.finalize(fit_rows) for _, _, vectorizer in vectorizers]
+    logger.info(
+        "Vectorized %d rows into %d features",
+        matrices[0].shape[0],
+        sum(X.shape[1] for X in matrices),
+    )
+
+    # Let the column transformer know about the already fitted vectorizers.
+    fitted = {
+        name: getattr(vectorizer, "vectorizer", getattr(vectorizer, "hasher", None))
+        for name, _, vectorizer in vectorizers
+    }
+    union.set_params(
+        transformers=[
+            (
+                name,
+                FrozenEstimator(fitted[name]) if name in fitted else transformer,
+                column,
+            )
+            for name, transformer, column in union.transformers
+        ]
+    )
+    union.fit(pd.DataFrame(first_chunk))
+    union.set_params(
+        transformers=[
+            (name, fitted.get(name, transformer), column)
+            for name, transformer, column in union.transformers
+        ]
+    )
+    union.transformers_ = [
+        (name, fitted.get(name, transformer), column)
+        for name, transformer, column in union.transformers_
+    ]
+
+    return scipy.sparse.hstack(matrices, format="csr")
@@ -3,31 +3,29 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this file,
 # You can obtain one at http://mozilla.org/MPL/2.0/.
 
+import importlib
+import itertools
 import logging
 import pickle
 from collections import defaultdict
+from contextlib import ExitStack, contextmanager
 from os import makedirs, path
-from typing import Any
+from typing import Any, Iterator
 
-import matplotlib
 import numpy as np
-import shap
-from imblearn.metrics import (
-    classification_report_imbalanced,
-    geometric_mean_score,
-    make_index_balanced_accuracy,
-    specificity_score,
-)
-from sklearn import metrics
 from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics import precision_recall_fscore_support
-from sklearn.model_selection import cross_validate, train_test_split
 from sklearn.pipeline import Pipeline
 from sklearn.preprocessing import LabelEncoder
-from tabulate import tabulate
 from xgboost import XGBModel
 
-from bugbug import bugzilla, db, repository
+from bugbug import (
+    bugzilla,
+    db,
+    feature_cache,
+    feature_matrix,
+    get_bugbug_version,
+    repository,
+)
 from bugbug.github import Github
 from bugbug.nlp import lemmatizing_tfidf_vectorizer
 from bugbug.utils import split_tuple_generator, to_array
@@ -36,6 +34,27 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+# Attributes that are only needed to train a model, and are left out of the
+# inference artifact.
+TRAINING_ONLY_ATTRIBUTES = (
+    "text_vectorizer",
+    "cross_validation_enabled",
+    "store_dataset",
+    "entire_dataset_training",
+    "feature_cache_enabled",
+    "training_dbs",
+)
+
+INFERENCE_ARTIFACT = "inference.pkl"
+INFERENCE_FORMAT_VERSION = 1
+
+
+def _load_booster(model, model_directory: str) -> None:
+    xgboost_model_path = path.join(model_directory, "xgboost.ubj")
+    if path.exists(xgboost_model_path):
+        model.clf.named_steps["estimator"].load_model(xgboost_model_path)
+
+
 def get_transformer_pipeline(pipeline: Pipeline) -> Pipeline:
     """Create a pipeline that contains only the transformers.
 
@@ -57,6 +76,35 @@ def get_transformer_pipeline(pipeline: Pipeline) -> Pipeline:
     )
 
 
+@contextmanager
+def extraction_parallelism(
+    pipeline: Pipeline, n_jobs: int | None, chunk_size: int
+) -> Iterator[None]:
+    """Temporarily set the number of processes used by the extractors in the pipeline.
+
+    The previous values are restored afterwards, so that they are not stored in
+    the trained model (which is used to classify a few items at a time).
+
+    Args:
+        pipeline: the extraction pipeline.
+        n_jobs: the number of processes (None to use all the physical CPUs).
+        chunk_size: the number of items sent at once to a process.
+    """
+    previous = {}
+    for name, step in pipeline.steps:
+        if hasattr(step, "n_jobs"):
+            previous[name] = (step.n_jobs, step.chunk_size)
+            step.set_params(n_jobs=n_jobs, chunk_size=chunk_size)
+
+    try:
+        yield
+    finally:
+        for name, (prev_n_jobs, prev_chunk_size) in previous.items():
+            pipeline.named_steps[name].set_params(
+                n_jobs=prev_n_jobs, chunk_size=prev_chunk_size
+            )
+
+
 def classification_report_imbalanced_values(
     y_true, y_pred, labels, target_names=None, sample_weight=None, digits=2, alpha=0.1
 ):
@@ -68,6 +116,13 @@ def classification_report_imbalanced_values(
     from version 0.4.3. The original code is living here:
     https://github.com/scikit-learn-contrib/imbalanced-learn/blob/b861b3a8e3414c52f40a953f2e0feca5b32e7460/imblearn/metrics/_classification.py#L790
     """
+    from imblearn.metrics import (
+        geometric_mean_score,
+        make_index_balanced_accuracy,
+        specificity_score,
+    )
+    from sklearn.metrics import precision_recall_fscore_support
+
     labels = np.asarray(labels)
 
     if target_names is None:
@@ -121,6 +176,8 @@ def classification_report_imbalanced_values(
 
 
 def print_labeled_confusion_matrix(confusion_matrix, labels, is_multilabel=False):
+    from tabulate import tabulate
+
     confusion_matrix_table = confusion_matrix.tolist()
 
     # Don't show the Not classified row in the table output
@@ -176,6 +233,9 @@ class Model:
 
         self.entire_dataset_training = False
 
+        # Reuse the features extracted by previous trainings for unchanged items.
+        self.feature_cache_enabled = True
+
         # DBs required for training.
         self.training_dbs: list[str] = []
         # DBs and DB support files required at runtime.
@@ -287,6 +347,8 @@ class Model:
         return important_features
 
     def print_feature_importances(self, important_features, class_probabilities=None):
+        from tabulate import tabulate
+
         feature_names = self.get_human_readable_feature_names()
         # extract importance values from the top features for the predicted class
         # when classifying
@@ -360,7 +422,17 @@ class Model:
 
         return feature_report
 
+    def _supports_streaming(self):
+        return (
+            len(self.extraction_pipeline.steps) == 1
+            and hasattr(self.extraction_pipeline.steps[0][1], "iter_transform")
+            and self.clf.steps[0][0] == "union"
+            and feature_matrix.supports_incremental_fit(self.clf.steps[0][1])
+        )
+
     def train_test_split(self, X, y):
+        from sklearn.model_selection import train_test_split
+
         return train_test_split(X, y, test_size=0.1, random_state=0)
 
     def evaluation(self):
@@ -370,15 +442,79 @@ class Model:
         """Subclasses implement their own function to gather labels."""
         raise NotImplementedError("The model must implement this method")
 
-    def train(self, importance_cutoff=0.15, limit=None):
+    def train(
+        self,
+        importance_cutoff=0.15,
+        limit=None,
+        extraction_jobs=1,
+        extraction_chunk_size=256,
+        streaming=False,
+        hashed_columns=None,
+    ):
+        # These are only needed for training and explaining, and are slow to import.
+        import matplotlib
+        import shap
+        from imblearn.metrics import classification_report_imbalanced
+        from sklearn import metrics
+        from sklearn.model_selection import cross_validate
+
         classes, self.class_names = self.get_labels()
         self.class_names = sort_class_names(self.class_names)
 
+        if hashed_columns:
+            feature_matrix.hash_columns(self.clf.named_steps["union"], hashed_columns)
+
+        if streaming and not self._supports_streaming():
+            logger.warning(
+                "The model doesn't support streaming vectorization, falling back to a DataFrame"
+            )
+            streaming = False
+
+        # When streaming, the rows are vectorized as they are extracted (which fits
+        # the column transformer on the training rows), and the rest of the
+        # pipeline is trained on the resulting matrix.
+        if streaming:
+            clf = type(self.clf)(self.clf.steps[1:])
+        else:
+            clf = self.clf
+
         # Get items and labels, filtering out those for which we have no labels.
         X_gen, y = split_tuple_generator(lambda: self.items_gen(classes))
 
         # Extract features from the items.
-        X = self.extraction_pipeline.transform(X_gen)
+        with ExitStack() as stack:
+            stack.enter_context(
+                extraction_parallelism(
+                    self.extraction_pipeline, extraction_jobs, extraction_chunk_size
+                )
+            )
+            if self.feature_cache_enabled:
+                stack.enter_context(
+                    feature_cache.enabled(
+                        self.extraction_pipeline, self.__class__.__name__.lower()
+                    )
+                )
+
+            if streaming:
+                rows = self.extraction_pipeline.steps[0][1].iter_transform(X_gen)
+                if limit:
+                    rows = itertools.islice(rows, limit)
+
+                def get_train_rows(n_rows):
+                    # The split only depends on the number of rows and their
+                    # labels, so it's the same as the one below.
+                    train_rows, _, _, _ = self.train_test_split(
+                        np.arange(n_rows), np.array(list(y)[:n_rows])
+                    )
+                    return train_rows
+
+                X = feature_matrix.build_matrix(
+                    rows,
+                    self.clf.named_steps["union"],
+                    get_fit_rows=get_train_rows,
+                )
+            else:
+                X = self.extraction_pipeline.transform(X_gen)
 
         # Calculate labels.
         y = np.array(y)
@@ -405,15 +541,23 @@ class Model:
                 scorings += ["precision", "recall"]
 
             scores = cross_validate(
-                self.clf, X_train, self.le.transform(y_train), scoring=scorings, cv=5
+                clf, X_train, self.le.transform(y_train), scoring=scorings, cv=5
             )
 
-            logger.info("Cross Validation scores:")
+            if streaming:
+                # The union was fitted on all the training rows, including the
+                # validation rows of the folds.
+                logger.info(
+                    "Cross Validation scores (streaming, the features were fitted on the validation folds too):"
+                )
+            else:
+                logger.info("Cross Validation scores:")
             for scoring in scorings:
                 score = scores[f"test_{scoring}"]
                 tracking_metrics[f"test_{scoring}"] = {
                     "mean": score.mean(),
                     "std": score.std() * 2,
+                    "streaming": streaming,
                 }
                 logger.info(
                     "%s: f%.4f (+/- %.4f)",
@@ -425,15 +569,23 @@ class Model:
         logger.info("X_train: %s, y_train: %s", X_train.shape, y_train.shape)
         logger.info("X_test: %s, y_test: %s", X_test.shape, y_test.shape)
 
-        self.clf.fit(X_train, self.le.transform(y_train))
-        logger.info("Number of features: %d", self.clf.steps[-1][1].n_features_in_)
+        clf.fit(X_train, self.le.transform(y_train))
+        logger.info("Number of features: %d", clf.steps[-1][1].n_features_in_)
 
         logger.info("Model trained")
 
         feature_names = self.get_human_readable_feature_names()
-        if self.calculate_importance and len(feature_names):
-            explainer = shap.TreeExplainer(self.clf.named_steps["estimator"])
-            _X_train = get_transformer_pipeline(self.clf).transform(X_train)
+        # The hashed columns are too wide to explain the whole training set.
+        if hashed_columns:
+            logger.info("Skipping the feature importance of the hashed columns")
+        elif self.calculate_importance and len(feature_names):
+            explainer = shap.TreeExplainer(clf.named_steps["estimator"])
+            transformer_pipeline = get_transformer_pipeline(clf)
+            # When streaming, X_train has already been transformed by the union.
+            if transformer_pipeline.steps:
+                _X_train = transformer_pipeline.transform(X_train)
+            else:
+                _X_train = X_train
             shap_values = explainer.shap_values(_X_train)
 
             # In the binary case, sometimes shap returns a single shap values matrix.
@@ -472,7 +624,7 @@ class Model:
             tracking_metrics["feature_report"] = feature_report
 
         logger.info("Training Set scores:")
-        y_pred = self.clf.predict(X_train)
+        y_pred = clf.predict(X_train)
         y_pred = self.le.inverse_transform(y_pred)
         if not is_multilabel:
             print(
@@ -483,7 +635,7 @@ class Model:
 
         logger.info("Test Set scores:")
         # Evaluate results on the test set.
-        y_pred = self.clf.predict(X_test)
+        y_pred = clf.predict(X_test)
         y_pred = self.le.inverse_transform(y_pred)
 
         if is_multilabel:
@@ -523,7 +675,7 @@ class Model:
 
         # Evaluate results on the test set for some confidence thresholds.
         for confidence_threshold in confidence_thresholds:
-            y_pred_probas = self.clf.predict_proba(X_test)
+            y_pred_probas = clf.predict_proba(X_test)
             confidence_class_names = self.class_names + ["__NOT_CLASSIFIED__"]
 
             y_pred_filter = []
@@ -594,7 +746,7 @@ class Model:
 
             logger.info("X_train: %s, y_train: %s", X_train.shape, y_train.shape)
 
-            self.clf.fit(X_train, self.le.transform(y_train))
+            clf.fit(X_train, self.le.transform(y_train))
 
         model_directory = self.__class__.__name__.lower()
         makedirs(model_directory, exist_ok=True)
@@ -614,6 +766,8 @@ class Model:
         with open(model_path, "wb") as f:
             pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
 
+        self.save_inference(model_directory)
+
         if self.store_dataset:
             with open(f"{self.__class__.__name__.lower()}_data_X", "wb") as f:
                 pickle.dump(X, f, protocol=pickle.HIGHEST_PROTOCOL)
@@ -623,15 +777,73 @@ class Model:
 
         return tracking_metrics
 
+    def save_inference(self, model_directory):
+        """Save the artifact needed to classify items with the trained model.
+
+        It contains the fitted pipelines (without the training-only steps, such as
+        samplers), the label encoder and some metadata. The booster is saved
+        separately, in the same directory, by train.
+        """
+        state = {
+            name: value
+            for name, value in vars(self).items()
+            if name not in TRAINING_ONLY_ATTRIBUTES
+        }
+
+        if isinstance(self.clf, Pipeline):
+            final_step_name = self.clf.steps[-1][0]
+            state["clf"] = Pipeline(
+                [
+                    (name, step)
+                    for name, step in self.clf.steps
+                    if hasattr(step, "transform") or name == final_step_name
+                ]
+            )
+
+        metadata = {
+            "format": INFERENCE_FORMAT_VERSION,
+            "class": f"{type(self).__module__}.{type(self).__qualname__}",
+            "bugbug_version": get_bugbug_version(),
+            "class_names": getattr(self, "class_names", None),
+        }
+
+        with open(path.join(model_directory, INFERENCE_ARTIFACT), "wb") as f:
+            pickle.dump((metadata, state), f, protocol=pickle.HIGHEST_PROTOCOL)
+
     @staticmethod
     def load(model_directory: str) -> "Model":
         model_path = path.join(model_directory, "model.pkl")
         with open(model_path, "rb") as f:
             model = pickle.load(f)
 
-        xgboost_model_path = path.join(model_directory, "xgboost.ubj")
-        if path.exists(xgboost_model_path):
-            model.clf.named_steps["estimator"].load_model(xgboost_model_path)
+        _load_booster(model, model_directory)
+
+        return model
+
+    @staticmethod
+    def load_for_inference(model_directory: str) -> "Model":
+        """Load a model which can only be used to classify items.
+
+        This is faster than load, and falls back to it for models trained
+        before inference artifacts existed.
+        """
+        inference_path = path.join(model_directory, INFERENCE_ARTIFACT)
+        if not path.exists(inference_path):
+            return Model.load(model_directory)
+
+        with open(inference_path, "rb") as f:
+            metadata, state = pickle.load(f)
+
+        assert metadata["format"] == INFERENCE_FORMAT_VERSION, (
+            f"Unsupported inference artifact format {metadata['format']}"
+        )
+
+        module_name, class_name = metadata["class"].rsplit(".", 1)
+        model_class = getattr(importlib.import_module(module_name), class_name)
+        model = model_class.__new__(model_class)
+        model.__dict__.update(state)
+
+        _load_booster(model, model_directory)
 
         return model
 
@@ -665,6 +877,8 @@ class Model:
         classes = self.overwrite_classes(items, classes, probabilities)
 
         if importances:
+            import shap
+
             pred_class_index = classes.argmax(axis=-1)[0]
             pred_class = self.le.inverse_transform([pred_class_index])[0]
 
@@ -5,12 +5,14 @@
 
 import collections
 import concurrent.futures
+import hashlib
+import heapq
 import logging
 import math
 import multiprocessing as mp
 import pickle
 import statistics
-from functools import reduce
+from functools import lru_cache, reduce
 from typing import Any, Callable, Collection, Iterable, Sequence, Set
 
 import numpy as np
@@ -35,6 +37,9 @@ from bugbug.model import Model
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Maximum number of solved reductions and configuration selections to keep in memory.
+SOLUTIONS_CACHE_SIZE = 1024
+
 
 def get_commit_map(
     revs: Set[test_scheduling.Revision] | None = None,
@@ -173,7 +178,28 @@ def _generate_equivalence_sets(
     return groups
 
 
+# Equivalence sets already loaded in this process, by redundancy confidence and
+# failing together DB version.
+_equivalence_sets: dict[tuple[float, tuple[int, int] | None], dict] = {}
+
+
 def _get_equivalence_sets(min_redundancy_confidence: float):
+    version = test_scheduling.get_failing_together_version("config_group")
+    if (min_redundancy_confidence, version) in _equivalence_sets:
+        return _equivalence_sets[(min_redundancy_confidence, version)]
+
+    equivalence_sets = _load_equivalence_sets(min_redundancy_confidence)
+    if version is not None:
+        # Drop the equivalence sets of older versions of the DB.
+        for key in list(_equivalence_sets):
+            if key[1] != version:
+                del _equivalence_sets[key]
+        _equivalence_sets[(min_redundancy_confidence, version)] = equivalence_sets
+
+    return equivalence_sets
+
+
+def _load_equivalence_sets(min_redundancy_confidence: float):
     try:
         with open(f"equivalence_sets_{min_redundancy_confidence}.pickle", "rb") as fr:
             return pickle.load(fr)
@@ -226,22 +252,71 @@ def _solve_optimization(solver: pywraplp.Solver) -> bool:
     return True
 
 
+def _greedy_cover(
+    equivalence_sets: Sequence[Set[str]], get_cost: Callable[[str], float]
+) -> Set[str]:
+    """Find a cheap, but not necessarily optimal, set of tasks covering all equivalence sets.
+
+    It is used as a starting solution for the solver and as a fallback in case the
+    solver fails.
+    """
+    sets_by_task: dict[str, Set[int]] = collections.defaultdict(set)
+    for i, equivalence_set in enumerate(equivalence_sets):
+        for task in equivalence_set:
+            sets_by_task[task].add(i)
+
+    # Lazy greedy: the number of sets a task covers can only decrease, so we only
+    # need to recompute the ratio of the best candidate.
+    heap = [(-len(sets) / get_cost(task), task) for task, sets in sets_by_task.items()]
+    heapq.heapify(heap)
+
+    uncovered = set(range(len(equivalence_sets)))
+    selected = set()
+    while uncovered and heap:
+        _, task = heapq.heappop(heap)
+        covered = sets_by_task[task] & uncovered
+        if not covered:
+            continue
+
+        ratio = len(covered) / get_cost(task)
+        if heap and ratio < -heap[0][0]:
+            heapq.heappush(heap, (-ratio, task))
+            continue
+
+        selected.add(task)
+        uncovered -= covered
+
+    return selected
+
+
 def reduce_configs(
     tasks: Collection[str],
     min_redundancy_confidence: float,
     assume_redundant: bool = False,
 ) -> Set[str]:
-    failing_together = test_scheduling.get_failing_together_db("label", True)
+    version = test_scheduling.get_failing_together_version("label")
+    args = (frozenset(tasks), min_redundancy_confidence, assume_redundant, version)
+    if version is None:
+        return set(_reduce_configs.__wrapped__(*args))
+
+    return set(_reduce_configs(*args))
 
+
+@lru_cache(maxsize=SOLUTIONS_CACHE_SIZE)
+def _reduce_configs(
+    tasks: frozenset[str],
+    min_redundancy_confidence: float,
+    assume_redundant: bool,
+    version: tuple[int, int] | None,
+) -> frozenset[str]:
     def load_failing_together(task: str) -> dict[str, tuple[float, float]]:
-        key = test_scheduling.failing_together_key(task)
-        return pickle.loads(failing_together[key])
+        return test_scheduling.get_failing_together("label", task)
 
     solver = pywraplp.Solver(
         "select_configs", pywraplp.Solver.CBC_MIXED_INTEGER_PROGRAMMING
     )
 
-    task_vars = {task: solver.BoolVar(task) for task in tasks}
+    task_vars = {task: solver.BoolVar(task) for task in sorted(tasks)}
 
     equivalence_sets = _generate_equivalence_sets(
         tasks, min_redundancy_confidence, load_failing_together, assume_redundant
@@ -269,20 +344,59 @@ def reduce_configs(
     # Choose the best set of tasks that satisfy the constraints with the lowest cost.
     solver.Minimize(sum(_get_cost(task) * task_vars[task] for task in task_vars.keys()))
 
+    greedy_tasks = _greedy_cover(equivalence_sets, _get_cost)
+    solver.SetHint(
+        list(task_vars.values()),
+        [1.0 if task in greedy_tasks else 0.0 for task in task_vars.keys()],
+    )
+
     if _solve_optimization(solver):
-        return {
+        return frozenset(
             task
             for task, task_var in task_vars.items()
             if task_var.solution_value() == 1
-        }
+        )
     else:
-        return set(tasks)
+        return frozenset(greedy_tasks)
 
 
 def select_configs(
     group_confidences: dict[str, float],
     min_redundancy_confidence: float,
     max_configurations: int = 3,
+) -> dict[str, list[str]]:
+    all_groups = group_confidences.keys()
+    high_confidence_groups = frozenset(
+        group for group in all_groups if group_confidences.get(group, 0.0) >= 0.99
+    )
+    groups = frozenset(
+        group for group in all_groups if group not in high_confidence_groups
+    )
+
+    version = test_scheduling.get_failing_together_version("config_group")
+    args = (
+        groups,
+        high_confidence_groups,
+        min_redundancy_confidence,
+        max_configurations,
+        version,
+    )
+    if version is None:
+        configs_by_group = _select_configs.__wrapped__(*args)
+    else:
+        configs_by_group = _select_configs(*args)
+
+    # Copy, as the cached result must not be modified.
+    return {group: list(configs) for group, configs in configs_by_group.items()}
+
+
+@lru_cache(maxsize=SOLUTIONS_CACHE_SIZE)
+def _select_configs(
+    unsorted_groups: frozenset[str],
+    high_confidence_groups: frozenset[str],
+    min_redundancy_confidence: float,
+    max_configurations: int,
+    version: tuple[int, int] | None,
 ) -> dict[str, list[str]]:
     failing_together = test_scheduling.get_failing_together_db("config_group", True)
 
@@ -290,11 +404,7 @@ def select_configs(
     all_configs_by_group = pickle.loads(failing_together[b"$CONFIGS_BY_GROUP$"])
     config_costs = {config: _get_cost(config) for config in all_configs}
 
-    all_groups = group_confidences.keys()
-    high_confidence_groups = {
-        group for group in all_groups if group_confidences.get(group, 0.0) >= 0.99
-    }
-    groups = [group for group in all_groups if group not in high_confidence_groups]
+    groups = sorted(unsorted_groups)
 
     solver = pywraplp.Solver(
         "select_configs", pywraplp.Solver.CBC_MIXED_INTEGER_PROGRAMMING
@@ -321,6 +431,13 @@ def select_configs(
 
     equivalence_sets = _get_equivalence_sets(min_redundancy_confidence)
 
+    # Greedy starting solution: for each group, choose the equivalence sets which
+    # can be covered more cheaply, preferring configs which are already in use.
+    hint_configs = set(committed_configs)
+    hint_config_groups = set()
+    hint_set_variables = set()
+
+    set_variables_by_group = {}
     for group in groups:
         if group not in equivalence_sets:
             logger.warning("No equivalence sets for group %s", group)
@@ -340,6 +457,7 @@ def select_configs(
         set_variables = [
             solver.BoolVar(f"{group}_{j}") for j in range(len(equivalence_sets[group]))
         ]
+        set_variables_by_group[group] = set_variables
 
         for j, equivalence_set in enumerate(equivalence_sets[group]):
             set_variable = set_variables[j]
@@ -362,6 +480,22 @@ def select_configs(
             )
         )
 
+        def cover_cost(config: str) -> int:
+            fixed_cost = 0 if config in hint_configs else 10 * config_costs[config]
+            return fixed_cost + config_costs[config]
+
+        cheapest = sorted(
+            (
+                (min(sorted(equivalence_set), key=cover_cost), j)
+                for j, equivalence_set in enumerate(equivalence_sets[group])
+            ),
+            key=lambda x: (cover_cost(x[0]), x[1]),
+        )
+        for config, j in cheapest[:max_configurations]:
+            hint_configs.add(config)
+            hint_config_groups.add((config, group))
+            hint_set_variables.add((group, j))
+
     for config in all_configs:
         solver.Add(
             sum(
@@ -388,6 +522,20 @@ def select_configs(
         )
     )
 
+    hint_vars = []
+    hint_values = []
+    for config, config_var in config_vars.items():
+        hint_vars.append(config_var)
+        hint_values.append(1.0 if config in hint_configs else 0.0)
+    for config_group, config_group_var in config_group_vars.items():
+        hint_vars.append(config_group_var)
+        hint_values.append(1.0 if config_group in hint_config_groups else 0.0)
+    for group, set_variables in set_variables_by_group.items():
+        for j, set_variable in enumerate(set_variables):
+            hint_vars.append(set_variable)
+            hint_values.append(1.0 if (group, j) in hint_set_variables else 0.0)
+    solver.SetHint(hint_vars, hint_values)
+
     configs_by_group: dict[str, list[str]] = {
         group: list(all_configs_by_group.get(group, all_configs))
         for group in high_confidence_groups
@@ -407,6 +555,46 @@ def select_configs(
     return configs_by_group
 
 
+# Scenarios (minimum number of selected runnables, cap on the number of selected runnables,
+# redundancy confidence to reduce configurations) and confidence thresholds to evaluate.
+EVALUATION_SCENARIOS: list[tuple[int | None, int | None, float | None]] = [
+    (None, None, None),
+    (10, None, None),
+    (None, 300, None),
+    (None, None, 0.9),
+    (None, None, 1.0),
+]
+EVALUATION_CONFIDENCE_THRESHOLDS = [0.5, 0.7, 0.8, 0.85, 0.9, 0.95]
+
+# Number of pushes sent at once to the workers selecting tests during evaluation.
+SELECTION_CHUNK_SIZE = 8
+
+# The model and the past failures DB used by the evaluation workers. They are
+# inherited from the parent process (the workers are forked).
+_select_tests_model: "TestSelectModel | None" = None
+_select_tests_past_failures: test_scheduling.PastFailures | None = None
+
+
+def _init_select_tests_worker() -> None:
+    global _select_tests_past_failures
+
+    assert _select_tests_model is not None
+    _select_tests_model.clf.set_params(estimator__n_jobs=1)
+    _select_tests_past_failures = test_scheduling.PastFailures(
+        _select_tests_model.granularity, True
+    )
+
+
+def _select_tests_worker(
+    args: tuple[str, Sequence[repository.CommitDict], int],
+) -> dict[str, float]:
+    assert _select_tests_model is not None
+    _, commits, push_num = args
+    return _select_tests_model.select_tests(
+        commits, 0.5, push_num, _select_tests_past_failures
+    )
+
+
 class TestSelectModel(Model):
     def __init__(self, lemmatization=False, granularity="label", failures_skip=None):
         Model.__init__(self, lemmatization)
@@ -585,10 +773,12 @@ class TestSelectModel(Model):
         commits: Sequence[repository.CommitDict],
         confidence: float = 0.5,
         push_num: int | None = None,
+        past_failures_data: test_scheduling.PastFailures | None = None,
     ) -> dict[str, float]:
         commit_data = commit_features.merge_commits(commits)
 
-        past_failures_data = test_scheduling.PastFailures(self.granularity, False)
+        if past_failures_data is None:
+            past_failures_data = test_scheduling.PastFailures(self.granularity, False)
 
         if push_num is None:
             push_num = past_failures_data.push_num + 1
@@ -614,7 +804,18 @@ class TestSelectModel(Model):
             for i in selected_indexes
         }
 
-    def evaluation(self) -> None:
+    def _get_selection_cache_path(self, last_push_num: int) -> str:
+        model_hash = hashlib.sha256(pickle.dumps(self.clf))
+        model_hash.update(f"{self.granularity}${last_push_num}".encode("utf-8"))
+        return f"data/test_selection_{self.granularity}_{model_hash.hexdigest()[:16]}.pickle"
+
+    def evaluation(
+        self,
+        scenarios: Sequence[
+            tuple[int | None, int | None, float | None]
+        ] = EVALUATION_SCENARIOS,
+        confidence_thresholds: Sequence[float] = EVALUATION_CONFIDENCE_THRESHOLDS,
+    ) -> None:
         # Get a test set of pushes on which to test the model.
         pushes, train_push_len = self.get_pushes(False)
 
@@ -690,8 +891,18 @@ class TestSelectModel(Model):
         last_push_num = past_failures_data.push_num
         past_failures_data.close()
 
-        # Select tests for all the pushes in the test set.
-        for i, push in enumerate(tqdm(test_pushes.values())):
+        # Select tests for all the pushes in the test set. The selections only depend on the
+        # model and on the past failures data, so they are cached and can be reused to evaluate
+        # other scenarios and thresholds without scoring the pushes again.
+        cache_path = self._get_selection_cache_path(last_push_num)
+        try:
+            with open(cache_path, "rb") as cache_f:
+                selection_cache = pickle.load(cache_f)
+        except FileNotFoundError:
+            selection_cache = {}
+
+        to_select = []
+        for i, (rev, push) in enumerate(test_pushes.items()):
             commits = tuple(
                 commit_map.pop(revision)
                 for revision in push["revs"]
@@ -701,6 +912,10 @@ class TestSelectModel(Model):
                 push["all_possibly_selected"] = {}
                 continue
 
+            if rev in selection_cache:
+                push["all_possibly_selected"] = selection_cache[rev]
+                continue
+
             push_num = last_push_num - (len(test_pushes) - (i + 1))
 
             # Note: we subtract 100 to the push number to make sure we don't use
@@ -719,7 +934,44 @@ class TestSelectModel(Model):
             ) * 100
             push_num = max(push_num, min_push_num)
 
-            push["all_possibly_selected"] = self.select_tests(commits, 0.5, push_num)
+            to_select.append((rev, commits, push_num))
+
+        logger.info(
+            "%d pushes to score, %d selections reused from %s",
+            len(to_select),
+            len(test_pushes) - len(to_select),
+            cache_path,
+        )
+
+        if len(to_select) > 0:
+            global _select_tests_model
+            _select_tests_model = self
+
+            # Each worker opens the past failures DB read-only once, and scores pushes with a
+            # single thread to avoid oversubscription.
+            with concurrent.futures.ProcessPoolExecutor(
+                max_workers=utils.get_physical_cpu_count(),
+                mp_context=mp.get_context("fork"),
+                initializer=_init_select_tests_worker,
+            ) as executor:
+                for rev, selected in zip(
+                    (rev for rev, _, _ in to_select),
+                    tqdm(
+                        executor.map(
+                            _select_tests_worker,
+                            to_select,
+                            chunksize=SELECTION_CHUNK_SIZE,
+                        ),
+                        total=len(to_select),
+                    ),
+                ):
+                    test_pushes[rev]["all_possibly_selected"] = selected
+                    selection_cache[rev] = selected
+
+            _select_tests_model = None
+
+            with open(cache_path, "wb") as cache_out_f:
+                pickle.dump(selection_cache, cache_out_f)
 
         def do_eval(
             executor: concurrent.futures.ProcessPoolExecutor,
@@ -889,20 +1141,13 @@ class TestSelectModel(Model):
             # Fixing https://github.com/mozilla/bugbug/issues/3131
             mp_context=mp.get_context("fork"),
         ) as executor:
-            scenarios = [
-                (None, None, None),
-                (10, None, None),
-                (None, 300, None),
-                (None, None, 0.9),
-                (None, None, 1.0),
-            ]
             for minimum, cap, reduction in scenarios:
                 # Pre-generate equivalence sets, so when we run the config selection in multiple processes
                 # we don't risk concurrent writes to the equivalence sets file.
                 if reduction is not None and self.granularity == "group":
                     _get_equivalence_sets(reduction)
 
-                for confidence_threshold in [0.5, 0.7, 0.8, 0.85, 0.9, 0.95]:
+                for confidence_threshold in confidence_thresholds:
                     do_eval(executor, confidence_threshold, reduction, cap, minimum)
 
     def get_feature_names(self):
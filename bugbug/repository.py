@@ -20,6 +20,7 @@ import shelve
 import subprocess
 import sys
 import threading
+from contextlib import contextmanager
 from datetime import datetime
 from functools import lru_cache
 from typing import Collection, Iterable, Iterator, NewType, Set, Union
@@ -59,6 +60,21 @@ path_to_component = None
 HG = None
 REPO_DIR = None
 
+# Whether the hg command servers, the rust-code-analysis servers and the
+# mapping DBs are kept open across calls to download_commits (see
+# enable_persistent_servers).
+persistent_servers = False
+# Idle hg command servers per repository, with the ID of the process which
+# opened them.
+hg_server_pool: dict[str, list[hglib.client.hgclient]] = collections.defaultdict(list)
+hg_server_pool_pid: int | None = None
+# rust-code-analysis servers per number of threads, shared with the forked
+# processes, with the ID of the process which enabled the persistent servers.
+persistent_code_analysis_servers: dict[
+    int | None, rust_code_analysis_server.RustCodeAnalysisServer
+] = {}
+persistent_code_analysis_servers_pid: int | None = None
+
 EXPERIENCE_TIMESPAN = 90
 EXPERIENCE_TIMESPAN_TEXT = f"{EXPERIENCE_TIMESPAN}_days"
 
@@ -323,9 +339,12 @@ def get_revision_id(commit: CommitDict) -> int | None:
 
 
 def _init_process(repo_dir: str) -> None:
-    global HG, REPO_DIR
+    global HG, REPO_DIR, path_to_component
     REPO_DIR = repo_dir
     HG = hglib.open(REPO_DIR)
+    # A persistent mapping DB opened by the parent process can't be used after
+    # forking, open it again.
+    path_to_component = None
     get_component_mapping()
 
 
@@ -336,6 +355,100 @@ def _init_thread(repo_dir: str) -> None:
         hg_servers.append(hg_server)
 
 
+def enable_persistent_servers() -> None:
+    """Keep the servers and the mapping DBs used to analyze commits open.
+
+    The hg command servers, the rust-code-analysis servers and the read-only
+    component and coverage mapping DBs are then reused across calls to
+    download_commits, instead of being started and opened by each call. This is
+    meant for long-lived processes analyzing a few commits at a time, such as
+    the HTTP service workers.
+    """
+    global persistent_servers, persistent_code_analysis_servers_pid
+    persistent_servers = True
+    persistent_code_analysis_servers_pid = os.getpid()
+
+
+def close_persistent_servers() -> None:
+    global persistent_servers
+    persistent_servers = False
+
+    if hg_server_pool_pid == os.getpid():
+        for hg_servers_of_repo in hg_server_pool.values():
+            for hg_server in hg_servers_of_repo:
+                hg_server.close()
+    hg_server_pool.clear()
+
+    if persistent_code_analysis_servers_pid == os.getpid():
+        for server in persistent_code_analysis_servers.values():
+            server.terminate()
+    persistent_code_analysis_servers.clear()
+
+    if path_to_component is not None:
+        close_component_mapping()
+    if commit_to_coverage is not None:
+        close_coverage_mapping()
+
+
+@contextmanager
+def open_hg(repo_dir: str) -> Iterator[hglib.client.hgclient]:
+    """Open a hg command server, reusing an idle one if servers are persistent."""
+    global hg_server_pool_pid
+
+    if not persistent_servers:
+        with hglib.open(repo_dir) as hg:
+            yield hg
+        return
+
+    # The servers opened by a parent process must not be shared with it.
+    if hg_server_pool_pid != os.getpid():
+        hg_server_pool.clear()
+        hg_server_pool_pid = os.getpid()
+
+    try:
+        hg = hg_server_pool[repo_dir].pop()
+    except IndexError:
+        hg = hglib.open(repo_dir)
+
+    try:
+        yield hg
+    except BaseException:
+        # The server might be in the middle of a command, don't reuse it.
+        hg.close()
+        raise
+
+    hg_server_pool[repo_dir].append(hg)
+
+
+def get_code_analysis_server(
+    thread_num: int | None = None,
+) -> rust_code_analysis_server.RustCodeAnalysisServer:
+    if not persistent_servers:
+        return rust_code_analysis_server.RustCodeAnalysisServer(thread_num)
+
+    server = persistent_code_analysis_servers.get(thread_num)
+    # The server might have been started by a parent process, so we can't
+    # wait on it to know whether it is still running.
+    if server is not None and server.ping():
+        return server
+
+    server = rust_code_analysis_server.RustCodeAnalysisServer(thread_num)
+    # Forked processes (e.g. the work horses of the HTTP service workers) can
+    # exit without cleaning up, so the servers they start are not kept and are
+    # terminated when released.
+    if persistent_code_analysis_servers_pid == os.getpid():
+        persistent_code_analysis_servers[thread_num] = server
+
+    return server
+
+
+def release_code_analysis_server(
+    server: rust_code_analysis_server.RustCodeAnalysisServer,
+) -> None:
+    if server not in persistent_code_analysis_servers.values():
+        server.terminate()
+
+
 # This code was adapted from https://github.com/mozsearch/mozsearch/blob/2e24a308bf66b4c149683bfeb4ceeea3b250009a/router/router.py#L127
 def is_test(path: str) -> bool:
     return (
@@ -1256,7 +1369,10 @@ def download_coverage_mapping() -> None:
 def get_coverage_mapping(readonly: bool = True) -> LMDBDict:
     global commit_to_coverage
     if commit_to_coverage is not None:
-        return commit_to_coverage
+        # A persistent read-only mapping can't be written to.
+        if readonly or not commit_to_coverage.readonly:
+            return commit_to_coverage
+        close_coverage_mapping()
     commit_to_coverage = LMDBDict("data/coverage_mapping.lmdb", readonly=readonly)
     return commit_to_coverage
 
@@ -1289,7 +1405,8 @@ def set_commit_coverage(commits: Iterable[CommitDict]) -> None:
         commit["cov_covered"] = covered
         commit["cov_unknown"] = unknown
 
-    close_coverage_mapping()
+    if not persistent_servers:
+        close_coverage_mapping()
 
 
 def download_component_mapping():
@@ -1312,7 +1429,10 @@ def download_component_mapping():
 def get_component_mapping(readonly=True):
     global path_to_component
     if path_to_component is not None:
-        return path_to_component
+        # A persistent read-only mapping can't be written to.
+        if readonly or not path_to_component.readonly:
+            return path_to_component
+        close_component_mapping()
     path_to_component = LMDBDict("data/component_mapping.lmdb", readonly=readonly)
     return path_to_component
 
@@ -1387,7 +1507,7 @@ def download_commits(
 ) -> tuple[CommitDict, ...]:
     assert revs is not None or rev_start is not None
 
-    with hglib.open(repo_dir) as hg:
+    with open_hg(repo_dir) as hg:
         if revs is None:
             revs = get_revs(hg, rev_start)
 
@@ -1428,7 +1548,7 @@ def download_commits(
         global code_analysis_server
 
         if not use_single_process:
-            code_analysis_server = rust_code_analysis_server.RustCodeAnalysisServer()
+            code_analysis_server = get_code_analysis_server()
 
             with concurrent.futures.ProcessPoolExecutor(
                 initializer=_init_process,
@@ -1440,15 +1560,16 @@ def download_commits(
                 commits_iter = tqdm(commits_iter, total=commits_num)
                 commits = tuple(commits_iter)
         else:
-            code_analysis_server = rust_code_analysis_server.RustCodeAnalysisServer(1)
+            code_analysis_server = get_code_analysis_server(1)
 
             get_component_mapping()
 
             commits = tuple(transform(hg, repo_dir, c) for c in tqdm(commits))
 
-            close_component_mapping()
+            if not persistent_servers:
+                close_component_mapping()
 
-    code_analysis_server.terminate()
+    release_code_analysis_server(code_analysis_server)
 
     calculate_experiences(commits, first_pushdate, save)
 
@@ -1591,7 +1712,7 @@ def pull(repo_dir: str, branch: str, revision: str, update: bool = False) -> Non
             )
 
         if update:
-            with hglib.open(repo_dir) as hg:
+            with open_hg(repo_dir) as hg:
                 hg.update(revision.encode("utf-8"), clean=True)
 
     trigger_pull()
@@ -1599,7 +1720,7 @@ def pull(repo_dir: str, branch: str, revision: str, update: bool = False) -> Non
 
 def import_commits(repo_dir: str, base_rev: str, patch: bytes) -> list[bytes]:
     """Import commits from a git format-patch style patches into a Mercurial repository."""
-    with hglib.open(repo_dir) as hg:
+    with open_hg(repo_dir) as hg:
         logger.info("Applying the patch ...")
         hg.import_(patches=io.BytesIO(patch))
 
@@ -3,23 +3,26 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this file,
 # You can obtain one at http://mozilla.org/MPL/2.0/.
 
+import array
 import collections
+import functools
 import glob
 import itertools
 import logging
+import mmap
 import os
 import pickle
 import re
 import shelve
 import shutil
 import struct
+import sys
 import tomllib
 from datetime import datetime
 from pathlib import Path
 from typing import (
     Any,
     Callable,
-    Deque,
     Generator,
     Iterable,
     Iterator,
@@ -106,6 +109,8 @@ PAST_FAILURES_LOOKBACK_WEEK = 700
 PAST_FAILURES_LOOKBACK_TWO_WEEKS = 1400
 PAST_FAILURES_LOOKBACK_MONTH = 2800
 
+ANDROID_PGO_RE = re.compile(r"android(.+)/pgo")
+
 JOBS_TO_CONSIDER = ("test-", "build-")
 JOBS_TO_IGNORE = (
     "docker-image-",
@@ -133,32 +138,37 @@ class UnexpectedGranularityError(ValueError):
         super().__init__(message)
 
 
+# Maximum number of distinct labels and groups whose canonical form is kept in memory.
+# The same few thousand labels are seen over and over again, push after push.
+RUNNABLE_CACHE_SIZE = 2**16
+
+
+@functools.lru_cache(maxsize=RUNNABLE_CACHE_SIZE)
+def is_relevant_task(task: str) -> bool:
+    return any(task.startswith(j) for j in JOBS_TO_CONSIDER) and not any(
+        j in task for j in JOBS_TO_IGNORE
+    )
+
+
 def filter_runnables(
     runnables: tuple[Runnable, ...], all_runnables: Set[Runnable], granularity: str
 ) -> tuple[Any, ...]:
     if granularity == "label":
         tasks = cast(list[Task], runnables)
         return tuple(
-            task
-            for task in tasks
-            if task in all_runnables
-            and any(task.startswith(j) for j in JOBS_TO_CONSIDER)
-            and not any(j in task for j in JOBS_TO_IGNORE)
+            task for task in tasks if task in all_runnables and is_relevant_task(task)
         )
     else:
         return tuple(runnable for runnable in runnables if runnable in all_runnables)
 
 
+@functools.lru_cache(maxsize=RUNNABLE_CACHE_SIZE)
 def rename_task(task: str) -> str:
     # https://bugzilla.mozilla.org/show_bug.cgi?id=1602863
     task = task.replace("test-linux64", "test-linux1804-64")
 
     # https://bugzilla.mozilla.org/show_bug.cgi?id=1623355
-    task = re.sub(
-        r"android(.+)/pgo",
-        r"android\g<1>-shippable/opt",
-        task,
-    )
+    task = ANDROID_PGO_RE.sub(r"android\g<1>-shippable/opt", task)
 
     # https://bugzilla.mozilla.org/show_bug.cgi?id=1641948
     task = task.replace(
@@ -175,7 +185,13 @@ def rename_task(task: str) -> str:
     # https://bugzilla.mozilla.org/show_bug.cgi?id=1650208
     task = task.replace("-shippable", "")
 
-    return task
+    # Intern the canonical label, as it is stored many times over (in each push).
+    return sys.intern(task)
+
+
+@functools.lru_cache(maxsize=RUNNABLE_CACHE_SIZE)
+def rename_group(group: str) -> str:
+    return sys.intern(group.split(":")[0])
 
 
 # Handle "meaningless" labeling changes ("meaningless" as they shouldn't really affect test scheduling).
@@ -187,14 +203,14 @@ def rename_runnables(
         return tuple(Task(rename_task(task)) for task in tasks)
     elif granularity == "group":
         groups = cast(list[Group], runnables)
-        return tuple(Group(group.split(":")[0]) for group in groups)
+        return tuple(Group(rename_group(group)) for group in groups)
     elif granularity == "config_group":
         config_groups = cast(list[ConfigGroup], runnables)
         return tuple(
             ConfigGroup(
                 (
                     rename_task(config),
-                    Group(group.split(":")[0]),
+                    Group(rename_group(group)),
                 )
             )
             for config, group in config_groups
@@ -203,6 +219,259 @@ def rename_runnables(
         raise UnexpectedGranularityError(granularity)
 
 
+# Binary push data format, generated once from the JSON push data:
+#   header:  magic, format version
+#   pushes:  for each push, the revisions, the fix revision and three arrays of
+#            uint32 runnable IDs (runnables, possible regressions, likely regressions)
+#   table:   the (already renamed) runnables, indexed by their ID
+#   index:   uint64 offset of each push
+#   footer:  push count, offset of the table, offset of the index, magic
+PUSH_DATA_BINARY_MAGIC = b"BBPD"
+PUSH_DATA_BINARY_VERSION = 1
+_PUSH_DATA_HEADER = struct.Struct("<4sI")
+_PUSH_DATA_FOOTER = struct.Struct("<QQQ4s")
+_PUSH_DATA_COUNTS = struct.Struct("<IIII")
+_STR_LEN = struct.Struct("<i")
+
+
+def get_push_data_binary_path(push_data_db: str) -> str:
+    return f"{os.path.splitext(push_data_db)[0]}.bin"
+
+
+def _pack_str(value: str | None) -> bytes:
+    if value is None:
+        return _STR_LEN.pack(-1)
+
+    encoded = value.encode("utf-8")
+    return _STR_LEN.pack(len(encoded)) + encoded
+
+
+def _unpack_str(buf: memoryview, offset: int) -> tuple[str | None, int]:
+    (length,) = _STR_LEN.unpack_from(buf, offset)
+    offset += _STR_LEN.size
+    if length == -1:
+        return None, offset
+
+    return str(buf[offset : offset + length], "utf-8"), offset + length
+
+
+def write_push_data_binary(granularity: str, push_data_db: str, path: str) -> int:
+    """Convert the JSON push data to the binary format.
+
+    Runnables are renamed only once per distinct runnable and are stored as
+    integer IDs referencing a table of unique runnables.
+
+    Args:
+        granularity: The granularity of the push data.
+        push_data_db: The path of the JSON push data DB.
+        path: The path where to write the binary push data.
+
+    Returns:
+        The number of pushes that were written.
+    """
+    ids: dict[Any, int] = {}
+    id_by_runnable: dict[Runnable, int] = {}
+    table: list[Runnable] = []
+
+    def to_id(runnable) -> int:
+        key = tuple(runnable) if isinstance(runnable, list) else runnable
+        try:
+            return ids[key]
+        except KeyError:
+            pass
+
+        renamed = rename_runnables(granularity, (cast(Runnable, key),))[0]
+        if renamed not in id_by_runnable:
+            id_by_runnable[renamed] = len(table)
+            table.append(renamed)
+
+        ids[key] = id_by_runnable[renamed]
+        return ids[key]
+
+    offsets = array.array("Q")
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(
+            _PUSH_DATA_HEADER.pack(PUSH_DATA_BINARY_MAGIC, PUSH_DATA_BINARY_VERSION)
+        )
+
+        for (
+            revisions,
+            fix_revision,
+            push_tasks,
+            possible_regressions,
+            likely_regressions,
+        ) in db.read(push_data_db):
+            offsets.append(f.tell())
+
+            runnable_arrays = [
+                array.array("I", (to_id(runnable) for runnable in runnables))
+                for runnables in (push_tasks, possible_regressions, likely_regressions)
+            ]
+
+            f.write(
+                _PUSH_DATA_COUNTS.pack(
+                    len(revisions), *(len(a) for a in runnable_arrays)
+                )
+            )
+            f.write(b"".join(_pack_str(revision) for revision in revisions))
+            f.write(_pack_str(fix_revision))
+            for a in runnable_arrays:
+                f.write(a.tobytes())
+
+        table_offset = f.tell()
+        f.write(struct.pack("<I", len(table)))
+        for runnable in table:
+            if granularity == "config_group":
+                f.write(_pack_str(runnable[0]) + _pack_str(runnable[1]))
+            else:
+                f.write(_pack_str(cast(str, runnable)))
+
+        index_offset = f.tell()
+        f.write(offsets.tobytes())
+
+        f.write(
+            _PUSH_DATA_FOOTER.pack(
+                len(offsets), table_offset, index_offset, PUSH_DATA_BINARY_MAGIC
+            )
+        )
+
+    os.replace(tmp_path, path)
+
+    return len(offsets)
+
+
+class BinaryPushData:
+    """Reader for the binary push data format, backed by a memory map.
+
+    The runnable ID arrays are read directly from the mapped file, and every
+    runnable is decoded only once.
+    """
+
+    def __init__(self, granularity: str, path: str) -> None:
+        self.granularity = granularity
+
+        with open(path, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, prot=mmap.PROT_READ)
+        self.buf = memoryview(self.mm)
+
+        magic, version = _PUSH_DATA_HEADER.unpack_from(self.buf, 0)
+        if magic != PUSH_DATA_BINARY_MAGIC or version != PUSH_DATA_BINARY_VERSION:
+            self.close()
+            raise ValueError(f"{path} is not a valid binary push data file")
+
+        count, table_offset, index_offset, magic = _PUSH_DATA_FOOTER.unpack_from(
+            self.buf, len(self.buf) - _PUSH_DATA_FOOTER.size
+        )
+        if magic != PUSH_DATA_BINARY_MAGIC:
+            self.close()
+            raise ValueError(f"{path} is truncated")
+
+        self.count = count
+        self.offsets = self.buf[index_offset : index_offset + count * 8].cast("Q")
+
+        (table_len,) = struct.unpack_from("<I", self.buf, table_offset)
+        offset = table_offset + 4
+        runnables: list[Runnable] = []
+        for _ in range(table_len):
+            if granularity == "config_group":
+                config, offset = _unpack_str(self.buf, offset)
+                group, offset = _unpack_str(self.buf, offset)
+                runnables.append(
+                    ConfigGroup((cast(str, config), Group(cast(str, group))))
+                )
+            else:
+                runnable, offset = _unpack_str(self.buf, offset)
+                runnables.append(cast(Runnable, runnable))
+        self.runnables = tuple(runnables)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def iter_ids(
+        self, start: int = 0
+    ) -> Iterator[
+        tuple[tuple[Revision, ...], Revision, memoryview, memoryview, memoryview]
+    ]:
+        """Iterate over the pushes, with runnables as (zero-copy) arrays of IDs."""
+        buf = self.buf
+        for i in range(start, self.count):
+            offset = self.offsets[i]
+            n_revs, *lengths = _PUSH_DATA_COUNTS.unpack_from(buf, offset)
+            offset += _PUSH_DATA_COUNTS.size
+
+            revisions = []
+            for _ in range(n_revs):
+                revision, offset = _unpack_str(buf, offset)
+                revisions.append(revision)
+            fix_revision, offset = _unpack_str(buf, offset)
+
+            arrays = []
+            for length in lengths:
+                arrays.append(buf[offset : offset + length * 4].cast("I"))
+                offset += length * 4
+
+            yield (
+                cast(tuple[Revision, ...], tuple(revisions)),
+                cast(Revision, fix_revision),
+                arrays[0],
+                arrays[1],
+                arrays[2],
+            )
+
+    def iter(
+        self, start: int = 0, allowed: Set[Runnable] | None = None
+    ) -> Iterator[PushResult]:
+        """Iterate over the pushes, optionally keeping only the allowed runnables."""
+        runnables = self.runnables
+        if allowed is None:
+            mask = bytes([1]) * len(runnables)
+        else:
+            mask = bytes(runnable in allowed for runnable in runnables)
+
+        for (
+            revisions,
+            fix_revision,
+            push_tasks,
+            possible_regressions,
+            likely_regressions,
+        ) in self.iter_ids(start):
+            yield cast(
+                PushResult,
+                (
+                    revisions,
+                    fix_revision,
+                    tuple(runnables[i] for i in push_tasks if mask[i]),
+                    tuple(runnables[i] for i in possible_regressions if mask[i]),
+                    tuple(runnables[i] for i in likely_regressions if mask[i]),
+                ),
+            )
+
+    def close(self) -> None:
+        if hasattr(self, "offsets"):
+            self.offsets.release()
+        self.buf.release()
+        self.mm.close()
+
+
+def open_push_data_binary(granularity: str, push_data_db: str) -> BinaryPushData:
+    """Open the binary push data, converting the JSON push data if needed."""
+    path = get_push_data_binary_path(push_data_db)
+
+    if os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(
+        push_data_db
+    ):
+        try:
+            return BinaryPushData(granularity, path)
+        except ValueError:
+            logger.info("Regenerating invalid binary push data at %s", path)
+
+    logger.info("Converting %s to the binary push data format...", push_data_db)
+    write_push_data_binary(granularity, push_data_db, path)
+    return BinaryPushData(granularity, path)
+
+
 def get_push_data(
     granularity: str,
 ) -> tuple[Callable[[], Iterator[PushResult]], int, tuple[Runnable, ...]]:
@@ -215,26 +484,13 @@ def get_push_data(
 
     assert db.download(push_data_db)
 
-    # In the last 28 pushes, we definitely run all possible runnables.
-    push_data_count = 0
-    push_data_queue: Deque[PushResult] = collections.deque(maxlen=28)
-    for elem in db.read(push_data_db):
-        push_data_count += 1
-
-        push_data_queue.append(elem)
+    binary_push_data = open_push_data_binary(granularity, push_data_db)
+    push_data_count = len(binary_push_data)
 
     logger.info("Push data nodes: %d", push_data_count)
 
-    push_data = [
-        (
-            revisions,
-            fix_revision,
-            rename_runnables(granularity, push_tasks),
-            rename_runnables(granularity, possible_regressions),
-            rename_runnables(granularity, likely_regressions),
-        )
-        for revisions, fix_revision, push_tasks, possible_regressions, likely_regressions in push_data_queue
-    ]
+    # In the last 28 pushes, we definitely run all possible runnables.
+    push_data = list(binary_push_data.iter(max(push_data_count - 28, 0)))
 
     if granularity == "config_group":
         all_groups_set = set(
@@ -264,30 +520,7 @@ def get_push_data(
     logger.info("%d runnables run in the last 28 pushes", len(all_runnables_set))
 
     def push_data_iter() -> Iterator[PushResult]:
-        return (
-            (
-                revisions,
-                fix_revision,
-                filter_runnables(
-                    rename_runnables(granularity, push_tasks),
-                    all_runnables_set,
-                    granularity,
-                ),
-                filter_runnables(
-                    rename_runnables(granularity, possible_regressions),
-                    all_runnables_set,
-                    granularity,
-                ),
-                filter_runnables(
-                    rename_runnables(granularity, likely_regressions),
-                    all_runnables_set,
-                    granularity,
-                ),
-            )
-            for revisions, fix_revision, push_tasks, possible_regressions, likely_regressions in db.read(
-                push_data_db
-            )
-        )
+        return binary_push_data.iter(allowed=all_runnables_set)
 
     if granularity == "config_group":
         manifest_combinations = sum(
@@ -330,6 +563,7 @@ class PastFailures:
         else:
             raise UnexpectedGranularityError(granularity)
         self.granularity = granularity
+        self.readonly = readonly
 
         self.db = shelve.Shelf(
             LMDBDict(past_failures_db[: -len(".tar.zst")], readonly=readonly),
@@ -361,18 +595,35 @@ class PastFailures:
             ini_key = f"{key[:-4]}ini"
             try:
                 value = self.db[ini_key]
-                self.db[key] = value
+                if not self.readonly:
+                    self.db[key] = value
             except KeyError:
                 return None
 
         return value
 
+    @property
+    def checkpoint(self) -> dict[str, Any] | None:
+        return self.db.get("checkpoint")
+
+    @checkpoint.setter
+    def checkpoint(self, value: dict[str, Any] | None) -> None:
+        if value is not None:
+            self.db["checkpoint"] = value
+        elif "checkpoint" in self.db:
+            del self.db["checkpoint"]
+
     def set(self, key: str, value: ExpQueue) -> None:
         self.db[key] = value
 
     def sync(self) -> None:
         self.db.sync()
 
+    def commit(self) -> None:
+        """Write the cached entries and durably commit them to the DB."""
+        self.db.sync()
+        cast(LMDBDict, self.db.dict).commit()
+
     def close(self) -> None:
         self.db.close()
 
@@ -389,6 +640,11 @@ def get_failing_together_db_path(granularity: str) -> str:
 
 
 failing_together = {}
+# Number of times the failing together DB was opened, for each granularity.
+failing_together_generation: collections.Counter = collections.Counter()
+
+# Maximum number of unpickled failing together rows to keep in memory.
+FAILING_TOGETHER_CACHE_SIZE = 2048
 
 
 def get_failing_together_db(granularity: str, readonly: bool) -> LMDBDict:
@@ -397,13 +653,59 @@ def get_failing_together_db(granularity: str, readonly: bool) -> LMDBDict:
         failing_together[granularity] = LMDBDict(
             get_failing_together_db_path(granularity), readonly=readonly
         )
+        failing_together_generation[granularity] += 1
     return failing_together[granularity]
 
 
+def get_failing_together_version(granularity: str) -> tuple[int, int] | None:
+    """Return an identifier of the contents of the failing together DB.
+
+    Returns None if the DB is open for writing, as its contents can then change
+    at any time and results derived from it must not be cached.
+    """
+    failing_together_db = get_failing_together_db(granularity, True)
+    if not failing_together_db.readonly:
+        return None
+
+    return (
+        failing_together_generation[granularity],
+        failing_together_db.db.info()["last_txnid"],
+    )
+
+
 def failing_together_key(item: str) -> bytes:
     return item.encode("utf-8")
 
 
+@functools.lru_cache(maxsize=FAILING_TOGETHER_CACHE_SIZE)
+def _load_failing_together(
+    granularity: str, version: tuple[int, int] | None, item: str
+) -> dict[str, Any] | None:
+    try:
+        return pickle.loads(
+            get_failing_together_db(granularity, True)[failing_together_key(item)]
+        )
+    except KeyError:
+        return None
+
+
+def get_failing_together(granularity: str, item: str) -> dict[str, Any]:
+    """Get the failing together stats of a runnable, caching unpickled rows.
+
+    The returned dictionary is shared between callers and must not be modified.
+    """
+    version = get_failing_together_version(granularity)
+    if version is None:
+        value = _load_failing_together.__wrapped__(granularity, version, item)
+    else:
+        value = _load_failing_together(granularity, version, item)
+
+    if value is None:
+        raise KeyError(item)
+
+    return value
+
+
 def remove_failing_together_db(granularity: str) -> None:
     shutil.rmtree(
         get_failing_together_db_path(granularity),
@@ -418,6 +720,7 @@ def close_failing_together_db(granularity: str) -> None:
     )
     failing_together[granularity].close()
     failing_together.pop(granularity)
+    _load_failing_together.cache_clear()
 
 
 def generate_failing_together_probabilities(
@@ -3,6 +3,7 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this file,
 # You can obtain one at http://mozilla.org/MPL/2.0/.
 
+import functools
 import os
 
 from bugbug import repository
@@ -13,29 +14,37 @@ class Name(object):
         return test_job["name"]
 
 
+# Maximum number of distinct task names whose platform, chunk and suite are kept in memory.
+NAME_CACHE_SIZE = 2**16
+
+
+@functools.lru_cache(maxsize=NAME_CACHE_SIZE)
+def get_platform(name):
+    platforms = []
+    for ps in (
+        ("linux",),
+        ("windows", "win"),
+        ("android", "apk", "fenix", "components", "focus", "klar", "samples"),
+        ("macosx",),
+        ("ios",),
+    ):
+        for p in ps:
+            if p in name.split("/")[0]:
+                platforms.append(ps[0])
+                break
+    assert len(platforms) == 1, "Wrong platforms ({}) in {}".format(platforms, name)
+    return platforms[0]
+
+
 class Platform(object):
     def __call__(self, test_job, **kwargs):
-        platforms = []
-        for ps in (
-            ("linux",),
-            ("windows", "win"),
-            ("android", "apk", "fenix", "components", "focus", "klar", "samples"),
-            ("macosx",),
-            ("ios",),
-        ):
-            for p in ps:
-                if p in test_job["name"].split("/")[0]:
-                    platforms.append(ps[0])
-                    break
-        assert len(platforms) == 1, "Wrong platforms ({}) in {}".format(
-            platforms, test_job["name"]
-        )
-        return platforms[0]
+        return get_platform(test_job["name"])
 
 
 NAME_PARTS_TO_SKIP = ("opt", "debug", "e10s", "1proc")
 
 
+@functools.lru_cache(maxsize=NAME_CACHE_SIZE)
 def get_chunk(name):
     if name.startswith("build-signing-"):
         return "build-signing"
@@ -49,6 +58,11 @@ def get_chunk(name):
     return "-".join([p for p in name.split("-") if p not in NAME_PARTS_TO_SKIP])
 
 
+@functools.lru_cache(maxsize=NAME_CACHE_SIZE)
+def get_suite(name):
+    return "-".join(p for p in get_chunk(name).split("-") if not p.isdigit())
+
+
 class Chunk(object):
     def __call__(self, test_job, **kwargs):
         return get_chunk(test_job["name"])
@@ -56,9 +70,7 @@ class Chunk(object):
 
 class Suite(object):
     def __call__(self, test_job, **kwargs):
-        return "-".join(
-            p for p in get_chunk(test_job["name"]).split("-") if not p.isdigit()
-        )
+        return get_suite(test_job["name"])
 
 
 class IsTest(object):
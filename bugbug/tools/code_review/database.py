@@ -6,29 +6,142 @@
 """Database classes for code review comments and feedback."""
 
 import enum
+import hashlib
+import itertools
+import os
 import re
+from collections import OrderedDict
 from dataclasses import asdict, dataclass
 from datetime import datetime
 from logging import getLogger
 from typing import Iterable, Literal
 
+import numpy as np
 from langchain.embeddings import init_embeddings
+from langchain_core.embeddings import Embeddings
 from unidiff import Hunk, PatchSet
 
 from bugbug.tools.core.data_types import InlineComment
 from bugbug.tools.core.platforms.base import Patch
+from bugbug.utils import LMDBDict
 from bugbug.vectordb import PayloadScore, QueryFilter, VectorDB, VectorPoint
 
 logger = getLogger(__name__)
 
+EMBEDDINGS_MODEL = "openai:text-embedding-3-large"
+
+EMBEDDINGS_CACHE_DIR = os.path.join("data", "embeddings_cache")
+
+# Number of embeddings kept when they are only cached in memory.
+EMBEDDINGS_MEMORY_CACHE_SIZE = 10000
+
+
+class CachedEmbeddings:
+    """Embed texts in batches, reusing the embeddings of texts seen before.
+
+    The embeddings are stored by the hash of the model name and of the text,
+    so that they are shared by ingestion and search, and across runs when a
+    cache path is given. Otherwise, only the most recently used embeddings are
+    kept in memory.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        model_name: str,
+        path: str | None = None,
+        batch_size: int = 100,
+        memory_cache_size: int = EMBEDDINGS_MEMORY_CACHE_SIZE,
+    ) -> None:
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.memory_cache_size = memory_cache_size
+
+        self.db: LMDBDict | OrderedDict[bytes, bytes]
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+            self.db = LMDBDict(path)
+        else:
+            self.db = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, text: str) -> bytes:
+        return hashlib.sha256(
+            f"{self.model_name}\0{text}".encode("utf-8", "surrogatepass")
+        ).digest()
+
+    def embed(self, texts: list[str]) -> list[list[float]]:
+        keys = [self._key(text) for text in texts]
+
+        vectors: dict[bytes, list[float]] = {}
+        missing: dict[bytes, str] = {}
+        for key, text in zip(keys, texts):
+            if key in vectors or key in missing:
+                continue
+
+            try:
+                vectors[key] = np.frombuffer(self.db[key], dtype=np.float32).tolist()
+                self.hits += 1
+                if isinstance(self.db, OrderedDict):
+                    self.db.move_to_end(key)
+            except KeyError:
+                missing[key] = text
+                self.misses += 1
+
+        for batch in itertools.batched(missing.items(), self.batch_size):
+            batch_vectors = self.embeddings.embed_documents([text for _, text in batch])
+            for (key, _), vector in zip(batch, batch_vectors):
+                data = np.asarray(vector, dtype=np.float32)
+                self.db[key] = data.tobytes()
+                vectors[key] = data.tolist()
+
+            if isinstance(self.db, LMDBDict):
+                self.db.commit()
+            else:
+                while len(self.db) > self.memory_cache_size:
+                    self.db.popitem(last=False)
+
+        return [vectors[key] for key in keys]
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embed([text])[0]
+
+    def close(self) -> None:
+        logger.info("Embeddings cache: %d hits, %d misses", self.hits, self.misses)
+        if isinstance(self.db, LMDBDict):
+            self.db.close()
+
 
 class ReviewCommentsDB:
     NAV_PATTERN = re.compile(r"\{nav, [^}]+\}")
     WHITESPACE_PATTERN = re.compile(r"[\n\s]+")
 
-    def __init__(self, vector_db: VectorDB) -> None:
+    def __init__(
+        self,
+        vector_db: VectorDB,
+        embeddings_cache_path: str | None = None,
+        embeddings_batch_size: int = 100,
+    ) -> None:
+        """Initialize the review comments DB.
+
+        Args:
+            vector_db: the vector DB storing the comments.
+            embeddings_cache_path: the directory where to persist the
+                embeddings of the hunks, or None to only cache them in memory.
+                The persisted cache can only be used by one instance at a
+                time, as it is kept open for writing.
+            embeddings_batch_size: the number of hunks to embed at once.
+        """
         self.vector_db = vector_db
-        self.embeddings = init_embeddings("openai:text-embedding-3-large")
+        self.embeddings = CachedEmbeddings(
+            init_embeddings(EMBEDDINGS_MODEL),
+            EMBEDDINGS_MODEL,
+            embeddings_cache_path,
+            embeddings_batch_size,
+        )
 
     def clean_comment(self, comment: str):
         # We do not want to keep the LLM note in the comment, it is not useful
@@ -49,24 +162,50 @@ class ReviewCommentsDB:
         logger.info("Will skip %d comments that already exist", len(point_ids))
 
         def vector_points():
-            for hunk, comment in items:
-                if comment.id in point_ids:
-                    continue
-
-                str_hunk = str(hunk)
-                vector = self.embeddings.embed_query(str_hunk)
+            new_items = (
+                (str(hunk), comment)
+                for hunk, comment in items
+                if comment.id not in point_ids
+            )
+            for batch in itertools.batched(new_items, self.embeddings.batch_size):
+                vectors = self.embeddings.embed([str_hunk for str_hunk, _ in batch])
 
-                comment_data = asdict(comment)
-                comment_data["content"] = self.clean_comment(comment.content)
-                payload = {
-                    "hunk": str_hunk,
-                    "comment": comment_data,
-                    "version": 2,
-                }
+                for (str_hunk, comment), vector in zip(batch, vectors):
+                    comment_data = asdict(comment)
+                    comment_data["content"] = self.clean_comment(comment.content)
+                    payload = {
+                        "hunk": str_hunk,
+                        "comment": comment_data,
+                        "version": 2,
+                    }
 
-                yield VectorPoint(id=comment.id, vector=vector, payload=payload)
+                    yield VectorPoint(id=comment.id, vector=vector, payload=payload)
 
         self.vector_db.insert(vector_points())
+        logger.info(
+            "Embeddings cache: %d hits, %d misses",
+            self.embeddings.hits,
+            self.embeddings.misses,
+        )
+
+    @staticmethod
+    def _get_comments_filter(
+        generated: bool | None, created_before: datetime | None
+    ) -> QueryFilter:
+        return QueryFilter(
+            must_match=(
+                {"comment.is_generated": generated} if generated is not None else None
+            ),
+            must_range=(
+                {
+                    "comment.date_created": {
+                        "lt": created_before.timestamp(),
+                    }
+                }
+                if created_before is not None
+                else None
+            ),
+        )
 
     def find_similar_hunk_comments(
         self,
@@ -76,24 +215,7 @@ class ReviewCommentsDB:
     ):
         return self.vector_db.search(
             self.embeddings.embed_query(str(hunk)),
-            filter=(
-                QueryFilter(
-                    must_match=(
-                        {"comment.is_generated": generated}
-                        if generated is not None
-                        else None
-                    ),
-                    must_range=(
-                        {
-                            "comment.date_created": {
-                                "lt": created_before.timestamp(),
-                            }
-                        }
-                        if created_before is not None
-                        else None
-                    ),
-                )
-            ),
+            filter=self._get_comments_filter(generated, created_before),
         )
 
     def find_similar_patch_comments(
@@ -107,22 +229,29 @@ class ReviewCommentsDB:
 
         patch_set = PatchSet.from_string(patch.raw_diff)
 
+        # Embed and search all the hunks at once.
+        vectors = self.embeddings.embed(
+            [
+                str(hunk)
+                for patched_file in patch_set
+                if patched_file.is_modified_file
+                for hunk in patched_file
+            ]
+        )
+        results_per_hunk = self.vector_db.search_many(
+            vectors, filter=self._get_comments_filter(generated, created_before)
+        )
+
         # We want to avoid returning the same comment multiple times. Thus, if
         # a comment matches multiple hunks, we will only consider it once.
         max_score_per_comment: dict = {}
-        for patched_file in patch_set:
-            if not patched_file.is_modified_file:
-                continue
-
-            for hunk in patched_file:
-                for result in self.find_similar_hunk_comments(
-                    hunk, generated, created_before
+        for results in results_per_hunk:
+            for result in results:
+                if result is not None and (
+                    result.id not in max_score_per_comment
+                    or result.score > max_score_per_comment[result.id].score
                 ):
-                    if result is not None and (
-                        result.id not in max_score_per_comment
-                        or result.score > max_score_per_comment[result.id].score
-                    ):
-                        max_score_per_comment[result.id] = result
+                    max_score_per_comment[result.id] = result
 
         return sorted(max_score_per_comment.values())[-limit:]
 
@@ -178,6 +307,41 @@ class SuggestionsFeedbackDB:
             for point in self.vector_db.search(self.embeddings.embed_query(comment))
         )
 
+    def find_similar_rejected_suggestions_many(
+        self, comments: list[str], limit: int, excluded_ids: Iterable[int] = ()
+    ) -> list[list[SuggestionFeedback]]:
+        """Find the rejected suggestions similar to each of the comments.
+
+        The suggestions found for a comment are excluded from the results of
+        the following comments, as if each comment was searched in turn with
+        the suggestions found so far in `excluded_ids`.
+        """
+        seen_ids = set(excluded_ids)
+        # A comment can have at most `limit` results for each of the previous
+        # comments excluded.
+        # The suggestions are stored and searched with query embeddings, which
+        # can differ from document embeddings depending on the model.
+        results_per_comment = self.vector_db.search_many(
+            [self.embeddings.embed_query(comment) for comment in comments],
+            filter=QueryFilter(
+                must_match={"action": "REJECT"},
+                must_not_has_id=list(seen_ids) or None,
+            ),
+            limit=limit * len(comments),
+        )
+
+        similar_suggestions = []
+        for results in results_per_comment:
+            suggestions = [
+                SuggestionFeedback.from_payload_score(point)
+                for point in results
+                if point.id not in seen_ids
+            ][:limit]
+            seen_ids.update(suggestion.id for suggestion in suggestions)
+            similar_suggestions.append(suggestions)
+
+        return similar_suggestions
+
     def find_similar_rejected_suggestions(
         self, comment: str, limit: int, excluded_ids: Iterable[int] = ()
     ):
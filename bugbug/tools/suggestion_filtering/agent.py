@@ -120,18 +120,15 @@ class SuggestionFilteringTool(GenerativeModelTool):
             raise Exception("Suggestions feedback database is not available")
 
         num_examples_per_suggestion = 10 // len(suggestions) or 1
-        seen_ids: set[int] = set()
-
-        for suggestion in suggestions:
-            similar_rejected_suggestions = (
-                self.suggestions_feedback_db.find_similar_rejected_suggestions(
-                    suggestion.comment,
-                    limit=num_examples_per_suggestion,
-                    excluded_ids=seen_ids,
-                )
+
+        similar_rejected_suggestions = (
+            self.suggestions_feedback_db.find_similar_rejected_suggestions_many(
+                [suggestion.comment for suggestion in suggestions],
+                limit=num_examples_per_suggestion,
             )
-            for rejected_suggestion in similar_rejected_suggestions:
-                seen_ids.add(rejected_suggestion.id)
+        )
+        for rejected_suggestions in similar_rejected_suggestions:
+            for rejected_suggestion in rejected_suggestions:
                 yield rejected_suggestion.comment
 
     @classmethod
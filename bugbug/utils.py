@@ -6,8 +6,10 @@
 import concurrent.futures
 import enum
 import errno
+import itertools
 import json
 import logging
+import multiprocessing
 import os
 import re
 import socket
@@ -19,7 +21,7 @@ from contextlib import contextmanager
 from datetime import datetime
 from functools import cache
 from importlib.metadata import PackageNotFoundError
-from typing import Any, Iterator
+from typing import Any, Callable, Iterable, Iterator
 
 import boto3
 import botocore
@@ -481,6 +483,13 @@ class LMDBDict:
             self.db.sync()
         self.db.close()
 
+    def commit(self) -> None:
+        """Commit the pending writes to disk and start a new transaction."""
+        assert not self.readonly, "Can't commit a read-only LMDB"
+        self.txn.commit()
+        self.db.sync(True)
+        self.txn = self.db.begin(buffers=True, write=True)
+
     def __contains__(self, key: bytes) -> bool:
         return self.txn.get(key) is not None
 
@@ -493,6 +502,10 @@ class LMDBDict:
     def __setitem__(self, key: bytes, value: Any) -> None:
         self.txn.put(key, value, dupdata=False)
 
+    def __delitem__(self, key: bytes) -> None:
+        if not self.txn.delete(key):
+            raise KeyError
+
     def keys(self):
         cursor = self.txn.cursor()
         for key, value in cursor:
@@ -606,6 +619,70 @@ def get_physical_cpu_count() -> int:
     return psutil.cpu_count(logical=False)
 
 
+def map_rows(
+    func: Callable[[Any], Any],
+    items: Iterable[Any],
+    get_key: Callable[[Any], tuple] | None = None,
+    cache: Any = None,
+    n_jobs: int | None = 1,
+    chunk_size: int = 256,
+    initializer: Callable[..., None] | None = None,
+    initargs: tuple = (),
+) -> Iterator[Any]:
+    """Apply func to the items, preserving their order.
+
+    Args:
+        func: the function to apply; it must be picklable when n_jobs is not 1.
+        items: the items.
+        get_key: a function returning the cache key of an item.
+        cache: an optional cache (with `get` and `put` methods) of the results.
+        n_jobs: the number of worker processes (None to use all the physical CPUs,
+            1 to run func in the current process).
+        chunk_size: the number of items sent at once to a worker.
+        initializer: a function to run once in each worker, when it starts.
+        initargs: the arguments of the initializer.
+
+    Returns:
+        an iterator over the results.
+    """
+    if n_jobs is None:
+        n_jobs = get_physical_cpu_count()
+
+    pool = None
+    if n_jobs != 1:
+        pool = multiprocessing.Pool(n_jobs, initializer, initargs)
+    elif initializer is not None:
+        initializer(*initargs)
+
+    try:
+        # Feed the workers a batch at a time, so that the cached results can be
+        # looked up (and the new ones stored) in order in the current process.
+        for batch in itertools.batched(items, chunk_size * n_jobs):
+            if cache is not None:
+                assert get_key is not None
+                keys = [get_key(item) for item in batch]
+                results = [cache.get(key) for key in keys]
+            else:
+                results = [None] * len(batch)
+
+            misses = [i for i, result in enumerate(results) if result is None]
+            to_process = [batch[i] for i in misses]
+            if pool is not None:
+                processed = pool.map(func, to_process, chunksize=chunk_size)
+            else:
+                processed = [func(item) for item in to_process]
+
+            for i, result in zip(misses, processed):
+                results[i] = result
+                if cache is not None:
+                    cache.put(keys[i], result)
+
+            yield from results
+    finally:
+        if pool is not None:
+            pool.terminate()
+
+
 def extract_metadata(body: str) -> dict:
     """Extract metadata as dict from github issue body.
 
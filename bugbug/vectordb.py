@@ -3,15 +3,24 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this file,
 # You can obtain one at http://mozilla.org/MPL/2.0/.
 
+import itertools
+import json
+import logging
 import os
 from abc import ABC, abstractmethod
 from dataclasses import dataclass
-from typing import Iterable, Optional
+from typing import Any, Iterable, Optional
 
+import numpy as np
+import orjson
 from qdrant_client import QdrantClient
 from qdrant_client.conversions import common_types as qdrant_types
 from qdrant_client.http.exceptions import UnexpectedResponse
-from qdrant_client.models import Distance, PointStruct, VectorParams
+from qdrant_client.models import Distance, PointStruct, QueryRequest, VectorParams
+
+from bugbug.utils import LMDBDict
+
+logger = logging.getLogger(__name__)
 
 
 @dataclass
@@ -23,7 +32,7 @@ class VectorPoint:
 
 @dataclass(order=True)
 class PayloadScore:
-    score: int
+    score: float
     id: int
     payload: dict
 
@@ -71,6 +80,44 @@ class QueryFilter:
 
         return qdrant_filter or None
 
+    def matches(self, point_id: int, payload: dict) -> bool:
+        """Check whether a point matches the filter, the same way Qdrant would."""
+        if self.must_not_has_id and point_id in self.must_not_has_id:
+            return False
+
+        for key, expected in (self.must_match or {}).items():
+            value = _get_payload_value(payload, key)
+            if value != expected or isinstance(value, bool) != isinstance(
+                expected, bool
+            ):
+                return False
+
+        for key, range_ in (self.must_range or {}).items():
+            value = _get_payload_value(payload, key)
+            # Like Qdrant, numeric ranges only match numbers.
+            if not isinstance(value, (int, float)) or isinstance(value, bool):
+                return False
+
+            if (
+                ("lt" in range_ and not value < range_["lt"])
+                or ("lte" in range_ and not value <= range_["lte"])
+                or ("gt" in range_ and not value > range_["gt"])
+                or ("gte" in range_ and not value >= range_["gte"])
+            ):
+                return False
+
+        return True
+
+
+def _get_payload_value(payload: dict, key: str) -> Any:
+    value: Any = payload
+    for part in key.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return None
+        value = value[part]
+
+    return value
+
 
 class VectorDB(ABC):
     """Abstract class for a vector database.
@@ -89,6 +136,19 @@ class VectorDB(ABC):
         self, query: list[float], filter: QueryFilter | None = None, limit: int = 10
     ) -> Iterable[PayloadScore]: ...
 
+    def search_many(
+        self,
+        queries: list[list[float]],
+        filter: QueryFilter | None = None,
+        limit: int = 10,
+    ) -> list[list[PayloadScore]]:
+        """Run several searches with the same filter and limit at once.
+
+        Returns:
+            the results of each query, in the same order as the queries.
+        """
+        return [list(self.search(query, filter, limit)) for query in queries]
+
     @abstractmethod
     def get_largest_id(self) -> int: ...
 
@@ -139,6 +199,38 @@ class QdrantVectorDB(VectorDB):
         ):
             yield PayloadScore(item.score, item.id, item.payload)
 
+    def search_many(
+        self,
+        queries: list[list[float]],
+        filter: QueryFilter | None = None,
+        limit: int = 10,
+    ) -> list[list[PayloadScore]]:
+        qdrant_filter = filter.to_qdrant_filter() if filter else None
+
+        results = []
+        for batch in itertools.batched(queries, 100):
+            responses = self.client.query_batch_points(
+                self.collection_name,
+                [
+                    QueryRequest(
+                        query=query,
+                        filter=qdrant_filter,
+                        limit=limit,
+                        with_payload=True,
+                    )
+                    for query in batch
+                ],
+            )
+            results.extend(
+                [
+                    PayloadScore(point.score, point.id, point.payload)
+                    for point in response.points
+                ]
+                for response in responses
+            )
+
+        return results
+
     def get_existing_ids(self) -> Iterable[int]:
         offset = 0
 
@@ -165,3 +257,355 @@ class QdrantVectorDB(VectorDB):
             )
 
         return points[-1].id if points else 0
+
+
+class LocalVectorDB(VectorDB):
+    """A vector database stored in local files, not needing any service.
+
+    The vectors are normalized (so that their dot product is their cosine
+    similarity) and appended to a memory-mapped float32 matrix. Once the
+    collection is large enough, the vectors are clustered with k-means into an
+    inverted file index, and searches only scan the clusters closest to the
+    query. The index is rebuilt when the collection grows too much since it
+    was built, new vectors being added to their closest cluster in between.
+    Payloads are stored in LMDB, and only loaded for the best results.
+    """
+
+    def __init__(
+        self,
+        collection_name: str,
+        size: int = 3072,
+        path: str | None = None,
+        n_probe: int = 8,
+        min_indexed_size: int = 10000,
+    ):
+        """Open a local vector DB.
+
+        Args:
+            collection_name: the name of the collection.
+            size: the dimension of the vectors.
+            path: the directory of the collection, by default in "data".
+            n_probe: the number of clusters scanned by searches.
+            min_indexed_size: the number of vectors from which searches use an
+                index, instead of scanning all the vectors.
+        """
+        self.collection_name = collection_name
+        self.size = size
+        self.path = (
+            path
+            if path is not None
+            else os.path.join("data", f"{collection_name}_vectordb")
+        )
+        self.n_probe = n_probe
+        self.min_indexed_size = min_indexed_size
+
+        self.payloads: LMDBDict | None = None
+        self.id_to_row: dict[int, int] = {}
+        self.largest_id = 0
+        self.vectors = np.zeros((0, size), dtype=np.float32)
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.centroids: np.ndarray | None = None
+        self.indexed_rows = 0
+        self.clusters = np.zeros(0, dtype=np.int32)
+        self.cluster_rows: list[np.ndarray] = []
+
+        if os.path.exists(self._file("meta.json")):
+            self._load()
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def _load(self) -> None:
+        if self.payloads is None:
+            self.payloads = LMDBDict(self._file("payloads"))
+
+        with open(self._file("meta.json")) as f:
+            meta = json.load(f)
+        assert meta["size"] == self.size, (
+            f"The vectors of {self.collection_name} have size {meta['size']}"
+        )
+        self.indexed_rows = meta["indexed_rows"]
+        if self.indexed_rows:
+            self.centroids = np.load(self._file("centroids.npy"))
+
+        self._map(os.path.getsize(self._file("ids.i64")) // 8)
+        if self.indexed_rows:
+            self._build_cluster_rows()
+
+        # Later rows replace earlier rows with the same ID.
+        self.id_to_row = {int(point_id): row for row, point_id in enumerate(self.ids)}
+        self.largest_id = max(self.id_to_row, default=0)
+
+    def _map(self, n_rows: int) -> None:
+        """Map the first rows of the files of the collection in memory."""
+        if n_rows == 0:
+            self.vectors = np.zeros((0, self.size), dtype=np.float32)
+            self.ids = np.zeros(0, dtype=np.int64)
+            self.clusters = np.zeros(0, dtype=np.int32)
+            return
+
+        self.vectors = np.memmap(
+            self._file("vectors.f32"),
+            dtype=np.float32,
+            mode="r",
+            shape=(n_rows, self.size),
+        )
+        self.ids = np.memmap(
+            self._file("ids.i64"), dtype=np.int64, mode="r", shape=(n_rows,)
+        )
+        if self.centroids is not None:
+            self.clusters = np.memmap(
+                self._file("clusters.i32"), dtype=np.int32, mode="r", shape=(n_rows,)
+            )
+
+    def _save_meta(self) -> None:
+        with open(self._file("meta.json"), "w") as f:
+            json.dump({"size": self.size, "indexed_rows": self.indexed_rows}, f)
+
+    def setup(self):
+        if os.path.exists(self._file("meta.json")):
+            return
+
+        os.makedirs(self.path, exist_ok=True)
+        for name in ("vectors.f32", "ids.i64", "clusters.i32"):
+            open(self._file(name), "wb").close()
+        self._save_meta()
+        self._load()
+
+    def close(self) -> None:
+        if self.payloads is not None:
+            self.payloads.close()
+            self.payloads = None
+
+    def _normalize(self, vectors: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return vectors / np.where(norms == 0, 1, norms)
+
+    def _assign(self, vectors: np.ndarray) -> np.ndarray:
+        assert self.centroids is not None
+        return np.argmax(vectors @ self.centroids.T, axis=1).astype(np.int32)
+
+    def _build_cluster_rows(self) -> None:
+        assert self.centroids is not None
+        order = np.argsort(self.clusters, kind="stable")
+        bounds = np.searchsorted(
+            self.clusters[order], np.arange(len(self.centroids) + 1)
+        )
+        self.cluster_rows = [
+            order[start:end] for start, end in itertools.pairwise(bounds)
+        ]
+
+    def _build_index(self) -> None:
+        n_rows = len(self.vectors)
+        n_clusters = int(np.sqrt(n_rows))
+        logger.info(
+            "Indexing %d vectors of %s into %d clusters",
+            n_rows,
+            self.collection_name,
+            n_clusters,
+        )
+
+        # Spherical k-means, on a sample of the vectors.
+        rng = np.random.default_rng(0)
+        sample = self.vectors[
+            np.sort(rng.choice(n_rows, min(n_rows, 64 * n_clusters), replace=False))
+        ]
+        self.centroids = sample[rng.choice(len(sample), n_clusters, replace=False)]
+        for _ in range(10):
+            assignments = self._assign(sample)
+            centroids = np.zeros_like(self.centroids)
+            np.add.at(centroids, assignments, sample)
+            empty = np.bincount(assignments, minlength=n_clusters) == 0
+            centroids[empty] = self.centroids[empty]
+            self.centroids = self._normalize(centroids).astype(np.float32)
+
+        self.clusters = np.concatenate(
+            [
+                self._assign(self.vectors[start : start + 65536])
+                for start in range(0, n_rows, 65536)
+            ]
+        )
+        self.indexed_rows = n_rows
+
+        np.save(self._file("centroids.npy"), self.centroids)
+        self.clusters.tofile(self._file("clusters.i32"))
+        self._save_meta()
+        self._build_cluster_rows()
+
+    def insert(self, points: Iterable[VectorPoint]):
+        assert self.payloads is not None, "The collection must be set up first"
+
+        n_rows = len(self.ids)
+        new_clusters = []
+        with (
+            open(self._file("vectors.f32"), "ab") as vectors_file,
+            open(self._file("ids.i64"), "ab") as ids_file,
+            open(self._file("clusters.i32"), "ab") as clusters_file,
+        ):
+            for chunk in itertools.batched(points, 1024):
+                vectors = self._normalize(
+                    np.array([point.vector for point in chunk], dtype=np.float32)
+                ).astype(np.float32)
+                assert vectors.shape[1] == self.size, (
+                    f"Expected vectors of size {self.size}, got {vectors.shape[1]}"
+                )
+
+                for point in chunk:
+                    self.payloads[str(point.id).encode("ascii")] = orjson.dumps(
+                        point.payload
+                    )
+                self.payloads.commit()
+
+                vectors_file.write(vectors.tobytes())
+                ids_file.write(
+                    np.array([point.id for point in chunk], dtype=np.int64).tobytes()
+                )
+                if self.centroids is not None:
+                    clusters = self._assign(vectors)
+                    clusters_file.write(clusters.tobytes())
+                    new_clusters.append(clusters)
+
+                for row, point in enumerate(chunk, start=n_rows):
+                    self.id_to_row[point.id] = row
+                    self.largest_id = max(self.largest_id, point.id)
+                n_rows += len(chunk)
+
+        # Only the new rows are added to the in-memory state, the files being
+        # mapped again.
+        first_new_row = len(self.ids)
+        self._map(n_rows)
+        if new_clusters:
+            clusters = np.concatenate(new_clusters)
+            rows = np.arange(first_new_row, n_rows)
+            for cluster in np.unique(clusters):
+                self.cluster_rows[cluster] = np.concatenate(
+                    [self.cluster_rows[cluster], rows[clusters == cluster]]
+                )
+
+        if n_rows >= self.min_indexed_size and n_rows > 4 * self.indexed_rows:
+            self._build_index()
+
+    def _get_payload(self, point_id: int) -> dict:
+        assert self.payloads is not None
+        return orjson.loads(self.payloads[str(point_id).encode("ascii")])
+
+    def _scan(
+        self,
+        scores: np.ndarray,
+        rows: np.ndarray | None,
+        filter: QueryFilter | None,
+        limit: int,
+        seen: set[int],
+    ) -> list[PayloadScore]:
+        if filter is None:
+            # Only the best rows are needed, apart from the ones which were
+            # replaced or already returned.
+            n_best = min(
+                len(scores), limit + len(self.ids) - len(self.id_to_row) + len(seen)
+            )
+            if n_best == 0:
+                return []
+            best = np.argpartition(-scores, n_best - 1)[:n_best]
+            order = best[np.argsort(-scores[best], kind="stable")]
+        else:
+            order = np.argsort(-scores, kind="stable")
+
+        results: list[PayloadScore] = []
+        for i in order:
+            row = int(i) if rows is None else int(rows[i])
+            point_id = int(self.ids[row])
+            if self.id_to_row[point_id] != row or point_id in seen:
+                continue
+
+            payload = self._get_payload(point_id)
+            if filter is not None and not filter.matches(point_id, payload):
+                continue
+
+            seen.add(point_id)
+            results.append(PayloadScore(float(scores[i]), point_id, payload))
+            if len(results) == limit:
+                break
+
+        return results
+
+    def _search(
+        self,
+        query_vector: np.ndarray,
+        filter: QueryFilter | None,
+        limit: int,
+        scores: np.ndarray | None = None,
+    ) -> list[PayloadScore]:
+        """Search the points closest to a normalized query vector.
+
+        Args:
+            query_vector: the normalized query vector.
+            filter: the filter the points must match.
+            limit: the maximum number of points to return.
+            scores: the scores of all the points, if already computed.
+        """
+        seen: set[int] = set()
+
+        if self.centroids is None:
+            if scores is None:
+                scores = self.vectors @ query_vector
+            return self._scan(scores, None, filter, limit, seen)
+
+        closest_clusters = np.argsort(-(self.centroids @ query_vector))[: self.n_probe]
+        rows = np.concatenate(
+            [self.cluster_rows[cluster] for cluster in closest_clusters]
+        )
+        results = self._scan(
+            self.vectors[rows] @ query_vector if scores is None else scores[rows],
+            rows,
+            filter,
+            limit,
+            seen,
+        )
+
+        # The closest clusters might not have enough points matching the
+        # filter, in which case all the points are scanned.
+        if len(results) < limit:
+            if scores is None:
+                scores = self.vectors @ query_vector
+            results += self._scan(scores, None, filter, limit - len(results), seen)
+            results.sort(key=lambda result: result.score, reverse=True)
+
+        return results
+
+    def search(
+        self, query: list[float], filter: QueryFilter | None = None, limit: int = 10
+    ) -> Iterable[PayloadScore]:
+        yield from self._search(
+            self._normalize(np.array(query, dtype=np.float32)), filter, limit
+        )
+
+    def search_many(
+        self,
+        queries: list[list[float]],
+        filter: QueryFilter | None = None,
+        limit: int = 10,
+    ) -> list[list[PayloadScore]]:
+        if not queries:
+            return []
+
+        query_vectors = self._normalize(np.array(queries, dtype=np.float32))
+
+        # Without an index, all the points are scanned for all the queries, so
+        # score them at once.
+        all_scores = self.vectors @ query_vectors.T if self.centroids is None else None
+
+        return [
+            self._search(
+                query_vector,
+                filter,
+                limit,
+                all_scores[:, i] if all_scores is not None else None,
+            )
+            for i, query_vector in enumerate(query_vectors)
+        ]
+
+    def get_existing_ids(self) -> Iterable[int]:
+        return self.id_to_row.keys()
+
+    def get_largest_id(self) -> int:
+        return self.largest_id
@@ -14,6 +14,7 @@ from typing import Any, Callable, Sequence
 from urllib.parse import urlparse
 
 import orjson
+import rs_parsepatch
 import zstandard
 from apispec import APISpec
 from apispec.ext.marshmallow import MarshmallowPlugin
@@ -28,14 +29,22 @@ from rq import Queue
 from rq.exceptions import NoSuchJobError
 from rq.job import Job
 from sentry_sdk.integrations.flask import FlaskIntegration
+from werkzeug.exceptions import NotAcceptable
 
 from bugbug import bugzilla, get_bugbug_version, utils
+from bugbug_http import metrics
 from bugbug_http.models import (
+    DEFAULT_EXPIRATION_TTL,
     MODELS_NAMES,
+    SCHEDULES_CACHE_TTL,
+    SCHEDULES_VERSION_KEY,
     classify_broken_site_report,
     classify_bug,
     classify_issue,
+    classify_pending_bugs,
+    classify_pending_issues,
     get_config_specific_groups,
+    get_schedules_signature_key,
     schedule_tests,
     schedule_tests_from_patch,
 )
@@ -86,6 +95,8 @@ BUGZILLA_JOB_TIMEOUT = 5 * 60
 QUEUE_TIMEOUT = 7 * 60
 # Store the information that a job failed for 3 minutes.
 FAILURE_TTL = 3 * 60
+# Cache the last change time of bugs for 2 minutes.
+BUG_CHANGE_TIME_TTL = 2 * 60
 
 q = Queue(
     connection=redis_conn, default_timeout=JOB_TIMEOUT
@@ -96,6 +107,17 @@ BUGZILLA_TOKEN = os.environ.get("BUGBUG_BUGZILLA_TOKEN")
 GITHUB_TOKEN = os.environ.get("BUGBUG_GITHUB_TOKEN")
 
 dctx = zstandard.ZstdDecompressor()
+cctx = zstandard.ZstdCompressor(level=10)
+fast_cctx = zstandard.ZstdCompressor(level=1)
+
+# The magic number starting zstd frames.
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+# The encodings of the responses, by order of preference.
+RESPONSE_ENCODINGS = ["zstd", "gzip", "identity"]
+
+# Responses larger than this (in bytes) are compressed with a fast level.
+LARGE_RESPONSE_SIZE = 256 * 1024
 
 logging.basicConfig(level=logging.DEBUG)
 LOGGER = logging.getLogger()
@@ -182,6 +204,26 @@ class JobInfo:
         """
         return f"bugbug:change_time:{self}"
 
+    @property
+    def pending_key(self):
+        """The pending items key for this batch job.
+
+        Returns:
+            (str) A key to be used to for the items waiting to be processed
+            by the job.
+        """
+        return f"bugbug:pending:{self}"
+
+    @property
+    def pending_job_id_key(self):
+        """The pending job id key for this batch job.
+
+        Returns:
+            (str) A key to be used to for the id of the job which will process
+            the pending items.
+        """
+        return f"bugbug:pending_job_id:{self}"
+
 
 def get_job_id() -> str:
     return uuid.uuid4().hex
@@ -266,45 +308,79 @@ def create_broken_site_report_classification_jobs(
     )
 
 
-def schedule_issue_classification(
-    model_name: str, owner: str, repo: str, issue_nums: Sequence[int]
+def schedule_pending_job(
+    batch: JobInfo,
+    items: Sequence[int],
+    item_jobs: Sequence[JobInfo],
+    timeout: int,
+    extra_args: Sequence[Any] = (),
 ) -> None:
-    """Schedule the classification of a issue_id list"""
-    job_id = get_job_id()
+    """Add items to the batch job which is gathering them, starting one if needed.
+
+    Items are added before checking for the job, and the job stops gathering
+    items before taking them, so that every item is taken by some job.
+    """
+    redis_conn.sadd(batch.pending_key, *items)
+    redis_conn.expire(batch.pending_key, QUEUE_TIMEOUT)
+
+    while True:
+        job_id = get_job_id()
+        if redis_conn.set(batch.pending_job_id_key, job_id, nx=True, ex=QUEUE_TIMEOUT):
+            new_job = True
+            break
+
+        current_job_id = redis_conn.get(batch.pending_job_id_key)
+        # The job might have stopped gathering items in the meantime.
+        if current_job_id:
+            job_id = current_job_id.decode("ascii")
+            new_job = False
+            break
 
     # Set the mapping before queuing to avoid some race conditions
-    job_id_mapping = {}
-    for issue_num in issue_nums:
-        key = JobInfo(classify_issue, model_name, owner, repo, issue_num).mapping_key
-        job_id_mapping[key] = job_id
+    redis_conn.mset({job.mapping_key: job_id for job in item_jobs})
+
+    if new_job:
+        q.enqueue(
+            batch.func,
+            *batch.args,
+            *extra_args,
+            job_id=job_id,
+            job_timeout=timeout,
+            ttl=QUEUE_TIMEOUT,
+            failure_ttl=FAILURE_TTL,
+        )
 
-    redis_conn.mset(job_id_mapping)
 
-    schedule_job(
-        JobInfo(classify_issue, model_name, owner, repo, issue_nums),
-        job_id=job_id,
-        timeout=BUGZILLA_JOB_TIMEOUT,
+def schedule_bug_classification(model_name: str, bug_ids: Sequence[int]) -> None:
+    """Schedule the classification of a bug_id list, together with other requests"""
+    schedule_pending_job(
+        JobInfo(classify_pending_bugs, model_name),
+        bug_ids,
+        [JobInfo(classify_bug, model_name, bug_id) for bug_id in bug_ids],
+        BUGZILLA_JOB_TIMEOUT,
+        extra_args=[BUGZILLA_TOKEN],
     )
 
 
-def is_pending(job):
-    # Check if there is a job
-    job_id = redis_conn.get(job.mapping_key)
-
-    if not job_id:
-        LOGGER.debug("No job ID mapping %s, False", job_id)
-        return False
+def schedule_issue_classification(
+    model_name: str, owner: str, repo: str, issue_nums: Sequence[int]
+) -> None:
+    """Schedule the classification of a issue_id list, together with other requests"""
+    schedule_pending_job(
+        JobInfo(classify_pending_issues, model_name, owner, repo),
+        issue_nums,
+        [
+            JobInfo(classify_issue, model_name, owner, repo, issue_num)
+            for issue_num in issue_nums
+        ],
+        BUGZILLA_JOB_TIMEOUT,
+    )
 
-    try:
-        job = Job.fetch(job_id.decode("ascii"), connection=redis_conn)
-    except NoSuchJobError:
-        LOGGER.debug("No job in DB for %s, False", job_id)
-        # The job might have expired from redis
-        return False
 
-    job_status = job.get_status()
+def is_job_pending(job: Job, refresh: bool = True) -> bool:
+    job_status = job.get_status(refresh=refresh)
     if job_status == "started":
-        LOGGER.debug("Job %s is running, True", job_id)
+        LOGGER.debug("Job %s is running, True", job.id)
         return True
 
     # Enforce job timeout as RQ doesn't seems to do it https://github.com/rq/rq/issues/758
@@ -315,39 +391,121 @@ def is_pending(job):
         job.cancel()
         job.cleanup()
 
-        LOGGER.debug("Job timeout %s, False", job_id)
+        LOGGER.debug("Job timeout %s, False", job.id)
 
         return False
 
     if job_status == "queued":
-        LOGGER.debug("Job %s is queued, True", job_id)
+        LOGGER.debug("Job %s is queued, True", job.id)
         return True
 
-    LOGGER.debug("Job %s has status %s, False", job_id, job_status)
+    LOGGER.debug("Job %s has status %s, False", job.id, job_status)
 
     return False
 
 
+def is_pending(job):
+    # Check if there is a job
+    job_id = redis_conn.get(job.mapping_key)
+
+    if not job_id:
+        LOGGER.debug("No job ID mapping %s, False", job_id)
+        return False
+
+    try:
+        job = Job.fetch(job_id.decode("ascii"), connection=redis_conn)
+    except NoSuchJobError:
+        LOGGER.debug("No job in DB for %s, False", job_id)
+        # The job might have expired from redis
+        return False
+
+    return is_job_pending(job)
+
+
+def are_pending(jobs: Sequence[JobInfo]) -> list[bool]:
+    """Bulk version of is_pending, with a constant number of round-trips."""
+    if not jobs:
+        return []
+
+    job_ids = [
+        job_id.decode("ascii") if job_id else None
+        for job_id in redis_conn.mget([job.mapping_key for job in jobs])
+    ]
+
+    # Many jobs can share the same job ID, when they were classified together.
+    unique_job_ids = list({job_id for job_id in job_ids if job_id})
+    pending = {}
+    if unique_job_ids:
+        for job_id, job in zip(
+            unique_job_ids, Job.fetch_many(unique_job_ids, connection=redis_conn)
+        ):
+            if job is None:
+                LOGGER.debug("No job in DB for %s, False", job_id)
+                # The job might have expired from redis
+                pending[job_id] = False
+                continue
+
+            # The status was already fetched along with the job.
+            pending[job_id] = is_job_pending(job, refresh=False)
+
+    return [pending.get(job_id, False) if job_id else False for job_id in job_ids]
+
+
 def get_bugs_last_change_time(bug_ids):
+    """Get the last change time of bugs, from Bugzilla or from a short-lived cache.
+
+    Clients poll the batch endpoint repeatedly with the same bugs while they
+    wait for the results, so only the bugs which were not looked up in the
+    last BUG_CHANGE_TIME_TTL seconds are queried on Bugzilla.
+    """
+    keys = [f"bugbug:bug_change_time:{bug_id}" for bug_id in bug_ids]
+
+    bugs = {}
+    missing_bug_ids = []
+    for bug_id, change_time in zip(bug_ids, redis_conn.mget(keys)):
+        if change_time is None:
+            missing_bug_ids.append(bug_id)
+        # An empty change time means Bugzilla didn't return the bug (e.g. it's a
+        # security bug).
+        elif change_time:
+            bugs[int(bug_id)] = change_time.decode("utf-8")
+
+    if not missing_bug_ids:
+        return bugs
+
     bugzilla.set_token(BUGZILLA_TOKEN)
 
     old_CHUNK_SIZE = Bugzilla.BUGZILLA_CHUNK_SIZE
     try:
         Bugzilla.BUGZILLA_CHUNK_SIZE = 700
 
-        bugs = {}
+        fetched_bugs = {}
 
         def bughandler(bug):
-            bugs[bug["id"]] = bug["last_change_time"]
+            fetched_bugs[bug["id"]] = bug["last_change_time"]
 
         Bugzilla(
-            bugids=bug_ids,
+            bugids=missing_bug_ids,
             bughandler=bughandler,
             include_fields=["id", "last_change_time"],
         ).get_data().wait()
     finally:
         Bugzilla.BUGZILLA_CHUNK_SIZE = old_CHUNK_SIZE
 
+    fetched_change_times = {
+        str(bug_id): change_time for bug_id, change_time in fetched_bugs.items()
+    }
+    pipe = redis_conn.pipeline(transaction=False)
+    for bug_id in missing_bug_ids:
+        pipe.set(
+            f"bugbug:bug_change_time:{bug_id}",
+            fetched_change_times.get(str(bug_id), ""),
+            ex=BUG_CHANGE_TIME_TTL,
+        )
+    pipe.execute()
+
+    bugs.update(fetched_bugs)
+
     return bugs
 
 
@@ -391,46 +549,157 @@ def clean_prediction_cache(job):
     redis_conn.delete(job.change_time_key)
 
 
-def get_result(job: JobInfo) -> Any | None:
+def decode_result(result: bytes) -> Any:
+    try:
+        result = dctx.decompress(result)
+    except zstandard.ZstdError:
+        # Some job results were stored before compression was enabled.
+        # We can remove the exception handling after enough time has passed
+        # since 47114f4f47db6b73214cf946377be8da945d34b5.
+        pass
+
+    return orjson.loads(result)
+
+
+def get_raw_result(job: JobInfo) -> bytes | None:
     LOGGER.debug("Checking for existing results at %s", job.result_key)
-    result = redis_conn.get(job.result_key)
+    return redis_conn.get(job.result_key)
+
+
+def get_result(job: JobInfo) -> Any | None:
+    result = get_raw_result(job)
 
     if result:
         LOGGER.debug("Found %r", result)
-        try:
-            result = dctx.decompress(result)
-        except zstandard.ZstdError:
-            # Some job results were stored before compression was enabled.
-            # We can remove the exception handling after enough time has passed
-            # since 47114f4f47db6b73214cf946377be8da945d34b5.
-            pass
-
-        assert result is not None  # mypy thinks it could be None
-        return orjson.loads(result)
+        return decode_result(result)
 
     return None
 
 
+def get_valid_results(
+    jobs: Sequence[JobInfo], change_times: Sequence[str | None] | None = None
+) -> list[Any | None]:
+    """Bulk version of get_result, with a constant number of round-trips.
+
+    When the change times of the items are given, the results which were
+    invalidated by a change are removed, like is_prediction_invalidated and
+    clean_prediction_cache do.
+    """
+    if not jobs:
+        return []
+
+    results = redis_conn.mget([job.result_key for job in jobs])
+
+    if change_times is not None:
+        saved_change_times = redis_conn.mget([job.change_time_key for job in jobs])
+
+        invalidated_keys = []
+        for i, (job, change_time, saved_change_time) in enumerate(
+            zip(jobs, change_times, saved_change_times)
+        ):
+            # Change time could be None if it's a security bug
+            if not change_time:
+                continue
+
+            # If we have no last changed time, the bug was not classified yet or
+            # the bug was classified by an old worker, and we can have a result
+            # without a cache time
+            if saved_change_time:
+                invalidated = saved_change_time.decode("utf-8") != change_time
+            else:
+                invalidated = results[i] is not None
+
+            if invalidated:
+                LOGGER.debug("Cleaning results for %s", job)
+                invalidated_keys += [job.result_key, job.change_time_key]
+                results[i] = None
+
+        if invalidated_keys:
+            redis_conn.delete(*invalidated_keys)
+
+    return [decode_result(result) if result else None for result in results]
+
+
+def negotiate_encoding() -> str:
+    """Choose the encoding of the response among the ones accepted by the client.
+
+    Clients which don't say which encodings they accept get gzip, as they
+    always did. Responses are sent unencoded to clients which only accept
+    unsupported encodings, unless they explicitly refuse unencoded responses
+    (e.g. with "identity;q=0" or "*;q=0"), in which case a 406 error is raised.
+    """
+    if not request.accept_encodings:
+        return "gzip"
+
+    encoding = request.accept_encodings.best_match(RESPONSE_ENCODINGS)
+    if encoding is not None:
+        return encoding
+
+    # "identity" is only listed (explicitly or with "*") with a zero quality.
+    if "identity" in request.accept_encodings:
+        raise NotAcceptable("None of the accepted encodings is supported")
+
+    return "identity"
+
+
+def encode_response(body: bytes, status_code: int) -> Response:
+    """Compress a JSON body with the encoding accepted by the client and frame response
+
+    Large bodies are compressed with a fast compression level, as the time
+    saved compressing them is worth more than the bytes saved sending them.
+    """
+    encoding = negotiate_encoding()
+    large = len(body) > LARGE_RESPONSE_SIZE
+
+    if encoding == "zstd":
+        body = (fast_cctx if large else cctx).compress(body)
+    elif encoding == "gzip":
+        body = gzip.compress(body, compresslevel=1 if large else 9)
+
+    response = Response(status=status_code)
+    response.set_data(body)
+    if encoding != "identity":
+        response.headers["Content-Encoding"] = encoding
+    response.headers["Content-Length"] = len(body)
+    response.headers["Content-Type"] = "application/json"
+    response.vary.add("Accept-Encoding")
+
+    return response
+
+
 def compress_response(data: dict, status_code: int):
-    """Compress data using gzip compressor and frame response
+    """Compress data with the encoding accepted by the client and frame response
 
     :param data: data
     :type data: dict
     :param status_code: response status code
     :type status_code: int
-    :return: response with gzip compressed data
+    :return: response with compressed data
     :rtype: Response
     """
+    return encode_response(orjson.dumps(data), status_code)
 
-    gzip_buffer = gzip.compress(orjson.dumps(data), compresslevel=9)
 
-    response = Response(status=status_code)
-    response.set_data(gzip_buffer)
-    response.headers["Content-Encoding"] = "gzip"
-    response.headers["Content-Length"] = len(gzip_buffer)
-    response.headers["Content-Type"] = "application/json"
+def result_response(result: bytes) -> Response:
+    """Frame a response with a job result, as stored by the worker.
 
-    return response
+    Results are stored compressed with zstd, so they are sent as they are to
+    clients which accept zstd, without being decompressed, parsed, serialized
+    and compressed again.
+    """
+    if result.startswith(ZSTD_MAGIC):
+        if negotiate_encoding() == "zstd":
+            response = Response(status=200)
+            response.set_data(result)
+            response.headers["Content-Encoding"] = "zstd"
+            response.headers["Content-Length"] = len(result)
+            response.headers["Content-Type"] = "application/json"
+            response.vary.add("Accept-Encoding")
+            return response
+
+        result = dctx.decompress(result)
+
+    return encode_response(result, 200)
 
 
 def has_diff_content(patch: str) -> bool:
@@ -452,6 +721,29 @@ def has_diff_content(patch: str) -> bool:
     return has_diff_header and has_hunk
 
 
+def get_schedules_by_signature(patch: str) -> bytes | None:
+    """Look for the test selection results of a change modifying the same files."""
+    if not SCHEDULES_CACHE_TTL:
+        return None
+
+    # The version is only known once a worker analyzed a change.
+    version = redis_conn.get(SCHEDULES_VERSION_KEY)
+    if not version:
+        return None
+
+    modified_paths = set()
+    for diff in rs_parsepatch.get_diffs(patch.encode("utf-8")):
+        modified_paths.add(diff["filename"])
+        # Mercurial considers both the source and the destination of a rename
+        # as modified.
+        if diff["renamed_from"]:
+            modified_paths.add(diff["renamed_from"])
+
+    return redis_conn.get(
+        get_schedules_signature_key(modified_paths, version.decode("ascii"))
+    )
+
+
 @application.route("/<model_name>/predict/<int:bug_id>")
 @cross_origin()
 def model_prediction(model_name, bug_id):
@@ -512,10 +804,7 @@ def model_prediction(model_name, bug_id):
 
     if not data:
         if not is_pending(job):
-            job_info, job_id, timeout = create_bug_classification_jobs(
-                model_name, [bug_id]
-            )
-            schedule_job(job_info, job_id=job_id, timeout=timeout)
+            schedule_bug_classification(model_name, [bug_id])
         status_code = 202
         data = {"ready": False}
 
@@ -749,20 +1038,22 @@ def batch_prediction(model_name):
 
     bug_change_dates = get_bugs_last_change_time(bugs)
 
-    for bug_id in bugs:
-        job = JobInfo(classify_bug, model_name, bug_id)
+    jobs = [JobInfo(classify_bug, model_name, bug_id) for bug_id in bugs]
+    results = get_valid_results(
+        jobs, [bug_change_dates.get(int(bug_id)) for bug_id in bugs]
+    )
 
-        change_time = bug_change_dates.get(int(bug_id))
-        # Change time could be None if it's a security bug
-        if change_time and is_prediction_invalidated(job, change_time):
-            clean_prediction_cache(job)
+    not_ready = [bug_id for bug_id, result in zip(bugs, results) if not result]
+    pending = are_pending([job for job, result in zip(jobs, results) if not result])
 
-        data[str(bug_id)] = get_result(job)
-        if not data[str(bug_id)]:
-            if not is_pending(job):
-                missing_bugs.append(bug_id)
-            status_code = 202
-            data[str(bug_id)] = {"ready": False}
+    for bug_id, result in zip(bugs, results):
+        data[str(bug_id)] = result
+
+    for bug_id, is_bug_pending in zip(not_ready, pending):
+        if not is_bug_pending:
+            missing_bugs.append(bug_id)
+        status_code = 202
+        data[str(bug_id)] = {"ready": False}
 
     queueJobList: Queue = []
 
@@ -935,16 +1226,23 @@ def batch_prediction_broken_site_report(model_name):
     data = {}
     missing_reports = []
 
-    for report in reports:
-        report_uuid = report["uuid"]
-        job = JobInfo(classify_broken_site_report, model_name, report_uuid)
+    jobs = [
+        JobInfo(classify_broken_site_report, model_name, report["uuid"])
+        for report in reports
+    ]
+    results = get_valid_results(jobs)
+
+    not_ready = [report for report, result in zip(reports, results) if not result]
+    pending = are_pending([job for job, result in zip(jobs, results) if not result])
 
-        data[report_uuid] = get_result(job)
-        if not data[report_uuid]:
-            if not is_pending(job):
-                missing_reports.append(report)
-            status_code = 202
-            data[report_uuid] = {"ready": False}
+    for report, result in zip(reports, results):
+        data[report["uuid"]] = result
+
+    for report, is_report_pending in zip(not_ready, pending):
+        if not is_report_pending:
+            missing_reports.append(report)
+        status_code = 202
+        data[report["uuid"]] = {"ready": False}
 
     queueJobList: Queue = []
 
@@ -1007,9 +1305,9 @@ def push_schedules(branch, rev):
         branch = "integration/autoland"
 
     job = JobInfo(schedule_tests, branch, rev)
-    data = get_result(job)
-    if data:
-        return compress_response(data, 200)
+    result = get_raw_result(job)
+    if result:
+        return result_response(result)
 
     if not is_pending(job):
         schedule_job(job)
@@ -1103,15 +1401,15 @@ def patch_schedules(base_rev, patch_hash):
         LOGGER.info("Request with API TOKEN %r", auth)
 
     job = JobInfo(schedule_tests_from_patch, base_rev, patch_hash)
-    data = get_result(job)
-    if data:
+    result = get_raw_result(job)
+    if result:
         # We don't need to read the POST data to find the response in the cache
         # because the hash of the data is in the URL. However, we must consume
         # the request body for POST requests before returning the cached response
         # to avoid the client receiving a response before finishing sending the body.
         if request.method == "POST":
             _ = request.data
-        return compress_response(data, 200)
+        return result_response(result)
 
     if not is_pending(job):
         if request.method != "POST":
@@ -1124,6 +1422,13 @@ def patch_schedules(base_rev, patch_hash):
         if not has_diff_content(patch):
             return jsonify({"error": "Patch contains no diff content"}), 400
 
+        result = get_schedules_by_signature(patch)
+        if result:
+            LOGGER.info("Reusing the schedules of a change modifying the same files")
+            redis_conn.set(job.result_key, result)
+            redis_conn.expire(job.result_key, DEFAULT_EXPIRATION_TTL)
+            return result_response(result)
+
         patch_key = f"bugbug:patch:{patch_hash}"
         redis_conn.set(patch_key, patch)
         redis_conn.expire(patch_key, 7 * 24 * 3600)  # 7 days expiration
@@ -1179,9 +1484,9 @@ def config_specific_groups(config: str) -> tuple[Response, int]:
         LOGGER.info("Request with API TOKEN %r", auth)
 
     job = JobInfo(get_config_specific_groups, config)
-    data = get_result(job)
-    if data is not None:
-        return compress_response(data, 200)
+    result = get_raw_result(job)
+    if result is not None:
+        return result_response(result)
 
     if not is_pending(job):
         schedule_job(job)
@@ -1205,6 +1510,11 @@ def doc():
     return render_template("doc.html")
 
 
+@application.route("/metrics")
+def job_metrics():
+    return Response(metrics.render(redis_conn), mimetype="text/plain; version=0.0.4")
+
+
 @application.route("/__lbheartbeat__")
 def heartbeat():
     return ""
@@ -13,7 +13,13 @@ Call this script like:
 
 import logging
 import os
+import queue
+import signal
+import threading
+import time
 import traceback
+from collections import OrderedDict
+from functools import partial
 
 import requests
 from kombu import Connection, Exchange, Queue
@@ -29,6 +35,15 @@ PORT = os.environ.get("PORT", 8000)
 BUGBUG_HTTP_SERVER = os.environ.get("BUGBUG_HTTP_SERVER", f"http://localhost:{PORT}")
 CONNECTION_URL = "amqp://{}:{}@pulse.mozilla.org:5671/?ssl=1"
 
+# Number of concurrent requests to the bugbug server.
+CONCURRENCY = int(os.environ.get("BUGBUG_LISTENER_CONCURRENCY", "4"))
+# Number of pushes waiting to be requested, after which the consumer blocks.
+QUEUE_SIZE = int(os.environ.get("BUGBUG_LISTENER_QUEUE_SIZE", "100"))
+# Time during which a push which was already requested isn't requested again.
+DEDUP_WINDOW = int(os.environ.get("BUGBUG_LISTENER_DEDUP_WINDOW", 60 * 60))
+MAX_RETRIES = int(os.environ.get("BUGBUG_LISTENER_MAX_RETRIES", "5"))
+RETRY_BACKOFF = 2.0
+
 if os.environ.get("SENTRY_DSN"):
     setup_sentry(dsn=os.environ.get("SENTRY_DSN"))
 
@@ -68,7 +83,119 @@ class HgPushesConsumer:
         self.connection.close()
 
 
-def _on_message(body, message):
+class PushScheduler:
+    """Request the schedules of pushes from the bugbug server.
+
+    The requests are made by a pool of threads, so that the consumer isn't
+    blocked by the latency of the server, and are retried with an exponential
+    backoff when the server is unavailable. Pushes which were requested in the
+    last `dedup_window` seconds are skipped.
+
+    The pushes are only kept in memory: the queued ones are requested when the
+    scheduler is closed, but they are lost if the process is killed.
+    """
+
+    def __init__(
+        self,
+        concurrency: int = CONCURRENCY,
+        queue_size: int = QUEUE_SIZE,
+        dedup_window: float = DEDUP_WINDOW,
+        max_retries: int = MAX_RETRIES,
+        retry_backoff: float = RETRY_BACKOFF,
+    ) -> None:
+        self.dedup_window = dedup_window
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+
+        self.queue: queue.Queue[tuple[str, str] | None] = queue.Queue(queue_size)
+        self.lock = threading.Lock()
+        # Time at which pushes were submitted, from the oldest to the newest.
+        self.submitted: OrderedDict[tuple[str, str], float] = OrderedDict()
+
+        self.threads = [
+            threading.Thread(target=self._run, daemon=True) for _ in range(concurrency)
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def submit(self, branch: str, rev: str) -> bool:
+        """Queue a push, blocking while the queue is full.
+
+        Returns:
+            whether the push was queued, i.e. it wasn't a duplicate.
+        """
+        push = (branch, rev)
+        now = time.monotonic()
+        with self.lock:
+            while (
+                self.submitted
+                and next(iter(self.submitted.values())) < now - self.dedup_window
+            ):
+                self.submitted.popitem(last=False)
+
+            if push in self.submitted:
+                logger.info("Skipping %s/%s, already requested", branch, rev)
+                return False
+
+            self.submitted[push] = now
+
+        self.queue.put(push)
+        return True
+
+    def close(self) -> None:
+        """Wait for the queued pushes to be requested, and stop the threads."""
+        for _ in self.threads:
+            self.queue.put(None)
+
+        for thread in self.threads:
+            thread.join()
+
+    def _run(self) -> None:
+        session = requests.Session()
+        session.headers["X-Api-Key"] = "pulse_listener"
+
+        while (push := self.queue.get()) is not None:
+            try:
+                if not self._request(session, *push):
+                    # Let the push be requested again if it's seen again.
+                    with self.lock:
+                        self.submitted.pop(push, None)
+            except Exception:
+                logger.warning("Failed to request %s/%s", *push, exc_info=True)
+
+    def _request(self, session: requests.Session, branch: str, rev: str) -> bool:
+        url = "{}/push/{}/{}/schedules".format(BUGBUG_HTTP_SERVER, branch, rev)
+
+        for attempt in range(self.max_retries + 1):
+            if attempt > 0:
+                time.sleep(self.retry_backoff * 2 ** (attempt - 1))
+
+            try:
+                response = session.get(url)
+            except requests.exceptions.RequestException as e:
+                logger.warning("Error while requesting %s: %s", url, e)
+                continue
+
+            if response.status_code in (200, 202):
+                logger.info("Successfully requested %s/%s", branch, rev)
+                return True
+
+            logger.warning("We got status: %s for: %s", response.status_code, url)
+
+            # Only retry when the server is overloaded or unavailable.
+            if response.status_code != 429 and response.status_code < 500:
+                return False
+
+        return False
+
+
+def _on_message(scheduler, body, message):
     try:
         # Only act on messages describing a push that introduced commits on a repository.
         # Skip repository creations and obsolescence markers additions.
@@ -83,16 +210,12 @@ def _on_message(body, message):
             if user in ("reviewbot", "wptsync@mozilla.com"):
                 return
 
-            url = "{}/push/{}/{}/schedules".format(BUGBUG_HTTP_SERVER, branch, rev)
-            response = requests.get(url, headers={"X-Api-Key": "pulse_listener"})
-            if response.status_code == 202:
-                logger.info("Successfully requested %s/%s", branch, rev)
-            else:
-                logger.warning("We got status: %s for: %s", response.status_code, url)
+            scheduler.submit(branch, rev)
     except Exception:
         logger.warning(body)
         traceback.print_exc()
     finally:
+        # The message is acked once its push is queued, not once it is requested.
         message.ack()
 
 
@@ -102,8 +225,18 @@ def main():
     user = os.environ.get("PULSE_USER")
     password = os.environ.get("PULSE_PASSWORD")
     if user and password:
-        with HgPushesConsumer(user, password, _on_message) as consumer:
-            consumer.run()
+        with PushScheduler() as scheduler:
+            with HgPushesConsumer(
+                user, password, partial(_on_message, scheduler)
+            ) as consumer:
+
+                def stop(signum, frame):
+                    consumer.should_stop = True
+
+                # Stop consuming on SIGTERM, so that the pushes which were
+                # already queued are requested before exiting.
+                signal.signal(signal.SIGTERM, stop)
+                consumer.run()
     else:
         logger.warning(
             "The Pulse listener will be skipped unless you define PULSE_USER & PULSE_PASSWORD"
@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Latency metrics of the jobs run by the workers.
+
+Jobs time their stages (e.g. pulling commits, running a model), and once they
+are done the timings are aggregated into histograms stored in Redis, so that
+the web service can expose the metrics of all the workers in the Prometheus
+text format.
+"""
+
+import contextvars
+import logging
+import re
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Iterator
+
+LOGGER = logging.getLogger()
+
+METRICS_KEY = "bugbug:metrics"
+
+# Upper bounds of the buckets of the histograms, in seconds.
+BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+HISTOGRAMS = {
+    "bugbug_job_queue_wait_seconds": "Time between the enqueuing and the start of jobs.",
+    "bugbug_job_duration_seconds": "Time taken to run jobs.",
+    "bugbug_job_stage_duration_seconds": "Time taken by the stages of jobs.",
+}
+
+COUNTERS = {
+    "bugbug_jobs_total": "Number of jobs run, by status.",
+    "bugbug_model_cache_hits_total": "Number of models found in the model cache.",
+    "bugbug_model_cache_misses_total": "Number of models missing from the model cache.",
+    "bugbug_model_cache_loads_total": "Number of models loaded in the model cache.",
+    "bugbug_model_cache_load_failures_total": "Number of models which failed to load.",
+    "bugbug_model_cache_load_seconds_total": "Time taken to load models.",
+    "bugbug_model_cache_evictions_total": "Number of models evicted from the model cache.",
+}
+
+# The statistics of the model cache which are exported as counters.
+MODEL_CACHE_STATS = (
+    "hits",
+    "misses",
+    "loads",
+    "load_failures",
+    "load_seconds",
+    "evictions",
+)
+
+
+class Trace:
+    """The timings of the stages of a job."""
+
+    def __init__(self, job_name: str, queue_wait: float | None = None) -> None:
+        self.job_name = job_name
+        self.queue_wait = queue_wait
+        self.start_time = time.monotonic()
+        self.stages: dict[str, float] = defaultdict(float)
+
+    def get_timings(self) -> dict[str, float]:
+        timings = dict(self.stages)
+        timings["total"] = time.monotonic() - self.start_time
+        if self.queue_wait is not None:
+            timings["queue_wait"] = self.queue_wait
+        return timings
+
+
+current_trace: contextvars.ContextVar[Trace | None] = contextvars.ContextVar(
+    "current_trace", default=None
+)
+
+
+@contextmanager
+def trace(job_name: str, queue_wait: float | None = None) -> Iterator[Trace]:
+    """Time a job, making it the current job of the stages."""
+    job_trace = Trace(job_name, queue_wait)
+    token = current_trace.set(job_trace)
+    try:
+        yield job_trace
+    finally:
+        current_trace.reset(token)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Time a stage of the current job.
+
+    The time of stages run multiple times by a job is summed.
+    """
+    start_time = time.monotonic()
+    try:
+        yield
+    finally:
+        job_trace = current_trace.get()
+        if job_trace is not None:
+            job_trace.stages[name] += time.monotonic() - start_time
+
+
+def get_timings() -> dict[str, float]:
+    """Get the timings of the stages run so far by the current job."""
+    job_trace = current_trace.get()
+    return job_trace.get_timings() if job_trace is not None else {}
+
+
+def _format_labels(labels: dict[str, str]) -> str:
+    return ",".join(f'{name}="{value}"' for name, value in sorted(labels.items()))
+
+
+def _observe(pipe, metric: str, labels: dict[str, str], value: float) -> None:
+    for bound in BUCKETS:
+        if value <= bound:
+            pipe.hincrbyfloat(
+                METRICS_KEY,
+                f"{metric}_bucket{{{_format_labels({**labels, 'le': str(bound)})}}}",
+                1,
+            )
+    pipe.hincrbyfloat(
+        METRICS_KEY,
+        f"{metric}_bucket{{{_format_labels({**labels, 'le': '+Inf'})}}}",
+        1,
+    )
+    pipe.hincrbyfloat(METRICS_KEY, f"{metric}_sum{{{_format_labels(labels)}}}", value)
+    pipe.hincrbyfloat(METRICS_KEY, f"{metric}_count{{{_format_labels(labels)}}}", 1)
+
+
+def record(redis_conn, job_trace: Trace, status: str) -> None:
+    """Add the timings of a job to the histograms."""
+    timings = job_trace.get_timings()
+    labels = {"job": job_trace.job_name}
+
+    pipe = redis_conn.pipeline(transaction=False)
+    pipe.hincrbyfloat(
+        METRICS_KEY,
+        f"bugbug_jobs_total{{{_format_labels({**labels, 'status': status})}}}",
+        1,
+    )
+    if job_trace.queue_wait is not None:
+        _observe(pipe, "bugbug_job_queue_wait_seconds", labels, job_trace.queue_wait)
+    _observe(pipe, "bugbug_job_duration_seconds", labels, timings["total"])
+    for stage_name, duration in job_trace.stages.items():
+        _observe(
+            pipe,
+            "bugbug_job_stage_duration_seconds",
+            {**labels, "stage": stage_name},
+            duration,
+        )
+    pipe.execute()
+
+    LOGGER.info("Timings of %s: %r", job_trace.job_name, timings)
+
+
+def record_model_cache(
+    redis_conn, before: dict[str, int | float], after: dict[str, int | float]
+) -> None:
+    """Add the model cache statistics changed since `before` to the counters.
+
+    The statistics are kept by each process, and the work horses exit after
+    their job, so only the changes are added up in Redis.
+    """
+    pipe = redis_conn.pipeline(transaction=False)
+    for stat in MODEL_CACHE_STATS:
+        if after[stat] != before[stat]:
+            pipe.hincrbyfloat(
+                METRICS_KEY,
+                f"bugbug_model_cache_{stat}_total",
+                after[stat] - before[stat],
+            )
+    pipe.execute()
+
+
+def _sort_key(sample: str) -> tuple[str, float]:
+    # Buckets must be listed in increasing order of their upper bound.
+    match = re.search(r',?le="([^"]+)"', sample)
+    if match is None:
+        return sample, 0
+    return sample[: match.start()] + sample[match.end() :], float(match.group(1))
+
+
+def render(redis_conn) -> str:
+    """Render the metrics in the Prometheus text format."""
+    samples: dict[str, list[tuple[str, float]]] = defaultdict(list)
+    for sample, value in redis_conn.hgetall(METRICS_KEY).items():
+        if isinstance(sample, bytes):
+            sample = sample.decode("utf-8")
+
+        name = sample.split("{", 1)[0]
+        for suffix in ("_bucket", "_sum", "_count"):
+            if name.endswith(suffix) and name[: -len(suffix)] in HISTOGRAMS:
+                name = name[: -len(suffix)]
+                break
+
+        samples[name].append((sample, float(value)))
+
+    lines = []
+    for metrics, metric_type in ((HISTOGRAMS, "histogram"), (COUNTERS, "counter")):
+        for name, description in metrics.items():
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            lines.extend(
+                f"{sample} {value!r}"
+                for sample, value in sorted(
+                    samples[name], key=lambda item: _sort_key(item[0])
+                )
+            )
+
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Registry of the models served by the workers.
+
+The models are loaded once, by the main worker process, before it forks the
+work horses that run the jobs. The work horses share the memory of the models
+with their parent (the pages are copy-on-write, and the models are only read)
+instead of each loading its own copy.
+
+Each model is associated with the version of its files on disk, so that a
+model which is downloaded again is loaded again the next time it is requested.
+"""
+
+import gc
+import logging
+import os
+from typing import Callable, Generic, Iterable, TypeVar
+
+from bugbug_http.readthrough_cache import ReadthroughLRUCache
+
+LOGGER = logging.getLogger()
+
+Model = TypeVar("Model")
+
+Version = tuple[int, int]
+
+
+def get_model_version(path: str) -> Version | None:
+    """Get the version of the files in a model directory.
+
+    The version changes whenever any of the files is replaced, which is what
+    happens when a new model is downloaded and extracted.
+    """
+    try:
+        with os.scandir(path) as entries:
+            stats = [entry.stat() for entry in entries if entry.is_file()]
+    except FileNotFoundError:
+        return None
+
+    return (
+        max((stat.st_mtime_ns for stat in stats), default=0),
+        sum(stat.st_size for stat in stats),
+    )
+
+
+class ModelRegistry(Generic[Model]):
+    def __init__(
+        self,
+        load_model: Callable[[str], Model],
+        get_path: Callable[[str], str] = lambda model_name: f"{model_name}model",
+        max_size: int | None = None,
+    ) -> None:
+        """Create a registry of models.
+
+        Args:
+            load_model: the function loading a model from its name.
+            get_path: the function returning the directory of a model.
+            max_size: the memory budget of the loaded models, in bytes. The size
+                of a model is estimated from the size of its files. The least
+                recently used models are unloaded when the budget is exceeded.
+        """
+        self.load_model = load_model
+        self.get_path = get_path
+        self.cache: ReadthroughLRUCache[str, tuple[Version | None, Model]] = (
+            ReadthroughLRUCache(
+                self._load,
+                max_size=max_size,
+                get_item_size=lambda item: item[0][1] if item[0] is not None else 0,
+            )
+        )
+
+    def _load(self, model_name: str) -> tuple[Version | None, Model]:
+        version = get_model_version(self.get_path(model_name))
+        LOGGER.info("Loading %s model (version %r)", model_name, version)
+        return version, self.load_model(model_name)
+
+    def get(self, model_name: str) -> Model:
+        version = get_model_version(self.get_path(model_name))
+        _, model = self.cache.get(model_name, is_stale=lambda item: item[0] != version)
+        return model
+
+    def preload(self, model_names: Iterable[str], allow_missing: bool = False) -> None:
+        """Load the models, so that the processes forked afterwards share them."""
+        for model_name in model_names:
+            try:
+                self.get(model_name)
+            except FileNotFoundError:
+                if not allow_missing:
+                    raise
+
+                LOGGER.info("Missing %r model, skipping preload", model_name)
+
+        self._freeze()
+
+    def refresh(self) -> list[str]:
+        """Load again the models whose files changed since they were loaded.
+
+        Returns:
+            the names of the models that were loaded again.
+        """
+        refreshed = []
+        for model_name, (loaded_version, _) in self.cache.items():
+            version = get_model_version(self.get_path(model_name))
+            if version is None or version == loaded_version:
+                continue
+
+            self.get(model_name)
+            refreshed.append(model_name)
+
+        if refreshed:
+            self._freeze()
+
+        return refreshed
+
+    def get_stats(self) -> dict[str, int | float]:
+        return self.cache.get_stats()
+
+    @staticmethod
+    def _freeze() -> None:
+        # Move the models out of the reach of the garbage collector, otherwise
+        # its collections in the forked processes would write to (and so copy)
+        # the pages holding them. Unfreezing first lets the models which were
+        # swapped out be collected.
+        gc.unfreeze()
+        gc.collect()
+        gc.freeze()
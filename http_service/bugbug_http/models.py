@@ -3,24 +3,31 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this file,
 # You can obtain one at http://mozilla.org/MPL/2.0/.
 
+import fcntl
+import functools
+import hashlib
 import logging
 import os
-from datetime import timedelta
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
 from functools import lru_cache
-from typing import Sequence
+from typing import Callable, Iterable, Iterator, Sequence
 from urllib.parse import urlparse
 
 import orjson
 import requests
 import zstandard
 from redis import Redis
+from rq import get_current_job
 
 from bugbug import bugzilla, repository, test_scheduling, utils
 from bugbug.github import Github
 from bugbug.model import Model
 from bugbug.models import testselect
 from bugbug.utils import get_hgmo_stack
-from bugbug_http.readthrough_cache import ReadthroughTTLCache
+from bugbug_http import metrics
+from bugbug_http.model_registry import ModelRegistry, get_model_version
 
 logging.basicConfig(level=logging.INFO)
 LOGGER = logging.getLogger()
@@ -42,7 +49,33 @@ MODELS_NAMES = [
     "fenixcomponent",
 ]
 
+# The models loaded when the worker starts, all of them by default.
+PRELOADED_MODELS_NAMES = [
+    model_name
+    for model_name in os.environ.get(
+        "BUGBUG_PRELOADED_MODELS", ",".join(MODELS_NAMES)
+    ).split(",")
+    if model_name
+]
+
+# The memory budget of the loaded models, in megabytes (unbounded when 0).
+MODEL_CACHE_MAX_SIZE_MB = int(os.environ.get("BUGBUG_MODEL_CACHE_MAX_SIZE_MB", "0"))
+
 DEFAULT_EXPIRATION_TTL = 7 * 24 * 3600  # A week
+
+# Single item classification requests for the same model are gathered in
+# batches of at most BATCH_MAX_SIZE items, waiting at most BATCH_MAX_WAIT
+# seconds for the batch to fill up.
+BATCH_MAX_SIZE = int(os.environ.get("BUGBUG_BATCH_MAX_SIZE", 100))
+BATCH_MAX_WAIT = float(os.environ.get("BUGBUG_BATCH_MAX_WAIT", 0.5))
+
+# Test selection results are also cached by the set of files the analyzed
+# change modifies, for this many seconds (the cache is disabled when 0).
+SCHEDULES_CACHE_TTL = int(os.environ.get("BUGBUG_SCHEDULES_CACHE_TTL", "0"))
+SCHEDULES_VERSION_KEY = "bugbug:schedules_version"
+
+# Whether to add the timings of the stages of the jobs to their results.
+DEBUG_TIMINGS = bool(os.environ.get("BUGBUG_DEBUG_TIMINGS"))
 url = urlparse(os.environ.get("REDIS_URL", "redis://localhost/0"))
 assert url.hostname is not None
 redis = Redis(
@@ -53,12 +86,13 @@ redis = Redis(
     ssl_cert_reqs=None,
 )
 
-MODEL_CACHE: ReadthroughTTLCache[str, Model] = ReadthroughTTLCache(
-    timedelta(hours=1), lambda m: Model.load(f"{m}model")
+MODEL_CACHE: ModelRegistry[Model] = ModelRegistry(
+    lambda m: Model.load_for_inference(f"{m}model"),
+    max_size=MODEL_CACHE_MAX_SIZE_MB * 2**20 or None,
 )
-MODEL_CACHE.start_ttl_thread()
 
 cctx = zstandard.ZstdCompressor(level=10)
+dctx = zstandard.ZstdDecompressor()
 
 
 def setkey(key: str, value: bytes, compress: bool = False) -> None:
@@ -69,6 +103,73 @@ def setkey(key: str, value: bytes, compress: bool = False) -> None:
     redis.expire(key, DEFAULT_EXPIRATION_TTL)
 
 
+@contextmanager
+def model_cache_metrics() -> Iterator[None]:
+    """Record the use of the model cache in the metrics."""
+    before = MODEL_CACHE.get_stats()
+    try:
+        yield
+    finally:
+        try:
+            metrics.record_model_cache(redis, before, MODEL_CACHE.get_stats())
+        except Exception:
+            LOGGER.warning("Failed to record the model cache metrics", exc_info=True)
+
+
+@contextmanager
+def working_copy_lock(repo_dir: str) -> Iterator[None]:
+    """Serialize the changes to the working copy of a repository.
+
+    The repository is shared by the workers running on the same machine (e.g.
+    the warm worker processes).
+    """
+    with open(f"{repo_dir}.lock", "w") as lock_f:
+        with metrics.stage("working_copy_lock"):
+            fcntl.flock(lock_f, fcntl.LOCK_EX)
+        yield
+
+
+def timed_job(func: Callable[..., str]) -> Callable[..., str]:
+    """Record the latency metrics of a job function.
+
+    Job functions called by other jobs are timed as part of the calling job.
+    """
+
+    @functools.wraps(func)
+    def wrapper(*args):
+        if metrics.current_trace.get() is not None:
+            return func(*args)
+
+        queue_wait = None
+        job = get_current_job()
+        if job is not None and job.enqueued_at is not None:
+            started_at = job.started_at or datetime.now(timezone.utc)
+            queue_wait = max(0.0, (started_at - job.enqueued_at).total_seconds())
+
+        with (
+            model_cache_metrics(),
+            metrics.trace(func.__name__, queue_wait) as job_trace,
+        ):
+            status = "error"
+            try:
+                status = func(*args)
+                return status
+            finally:
+                try:
+                    metrics.record(redis, job_trace, status)
+                except Exception:
+                    LOGGER.warning("Failed to record the metrics", exc_info=True)
+
+    return wrapper
+
+
+def add_timings(data: dict) -> dict:
+    if DEBUG_TIMINGS:
+        data["timings"] = metrics.get_timings()
+    return data
+
+
+@timed_job
 def classify_bug(model_name: str, bug_ids: Sequence[int], bugzilla_token: str) -> str:
     from bugbug_http.app import JobInfo
 
@@ -77,7 +178,8 @@ def classify_bug(model_name: str, bug_ids: Sequence[int], bugzilla_token: str) -
     bug_ids_set = set(map(int, bug_ids))
     bugzilla.set_token(bugzilla_token)
 
-    bugs = bugzilla.get(bug_ids)
+    with metrics.stage("fetch_bugs"):
+        bugs = bugzilla.get(bug_ids)
 
     missing_bugs = bug_ids_set.difference(bugs.keys())
 
@@ -90,7 +192,8 @@ def classify_bug(model_name: str, bug_ids: Sequence[int], bugzilla_token: str) -
     if not bugs:
         return "NOK"
 
-    model = MODEL_CACHE.get(model_name)
+    with metrics.stage("load_model"):
+        model = MODEL_CACHE.get(model_name)
 
     if not model:
         LOGGER.info("Missing model %r, aborting", model_name)
@@ -100,9 +203,10 @@ def classify_bug(model_name: str, bug_ids: Sequence[int], bugzilla_token: str) -
 
     # TODO: Classify could choke on a single bug which could make the whole
     # job to fails. What should we do here?
-    probs = model.classify(list(bugs.values()), True)
-    indexes = probs.argmax(axis=-1)
-    suggestions = model.le.inverse_transform(indexes)
+    with metrics.stage("classify"):
+        probs = model.classify(list(bugs.values()), True)
+        indexes = probs.argmax(axis=-1)
+        suggestions = model.le.inverse_transform(indexes)
 
     probs_list = probs.tolist()
     indexes_list = indexes.tolist()
@@ -117,7 +221,7 @@ def classify_bug(model_name: str, bug_ids: Sequence[int], bugzilla_token: str) -
         }
 
         job = JobInfo(classify_bug, model_name, bug_id)
-        setkey(job.result_key, orjson.dumps(data), compress=True)
+        setkey(job.result_key, orjson.dumps(add_timings(data)), compress=True)
 
         # Save the bug last change
         setkey(job.change_time_key, bugs[bug_id]["last_change_time"].encode())
@@ -125,6 +229,45 @@ def classify_bug(model_name: str, bug_ids: Sequence[int], bugzilla_token: str) -
     return "OK"
 
 
+def take_pending_batches(batch) -> Iterator[list[int]]:
+    """Take the items gathered for a batch job, BATCH_MAX_SIZE at a time.
+
+    The job waits for more items to be gathered, until the batch is full or
+    BATCH_MAX_WAIT seconds passed since the job was enqueued.
+    """
+    job = get_current_job()
+    if job is not None and job.enqueued_at is not None:
+        deadline = job.enqueued_at.timestamp() + BATCH_MAX_WAIT
+        with metrics.stage("batch_wait"):
+            while (
+                time.time() < deadline
+                and redis.scard(batch.pending_key) < BATCH_MAX_SIZE
+            ):
+                time.sleep(max(0.0, min(0.05, deadline - time.time())))
+
+    # Close the batch before taking its items, the items gathered from now on
+    # will be taken by a new job.
+    redis.delete(batch.pending_job_id_key)
+
+    while items := redis.spop(batch.pending_key, BATCH_MAX_SIZE):
+        yield [int(item) for item in items]
+
+
+@timed_job
+def classify_pending_bugs(model_name: str, bugzilla_token: str) -> str:
+    from bugbug_http.app import JobInfo
+
+    batch = JobInfo(classify_pending_bugs, model_name)
+
+    results = [
+        classify_bug(model_name, bug_ids, bugzilla_token)
+        for bug_ids in take_pending_batches(batch)
+    ]
+
+    return "OK" if "OK" in results else "NOK"
+
+
+@timed_job
 def classify_issue(
     model_name: str, owner: str, repo: str, issue_nums: Sequence[int]
 ) -> str:
@@ -134,10 +277,11 @@ def classify_issue(
 
     issue_ids_set = set(map(int, issue_nums))
 
-    issues = {
-        issue_num: github.fetch_issue_by_number(owner, repo, issue_num, True)
-        for issue_num in issue_nums
-    }
+    with metrics.stage("fetch_issues"):
+        issues = {
+            issue_num: github.fetch_issue_by_number(owner, repo, issue_num, True)
+            for issue_num in issue_nums
+        }
 
     missing_issues = issue_ids_set.difference(issues.keys())
 
@@ -150,7 +294,8 @@ def classify_issue(
     if not issues:
         return "NOK"
 
-    model = MODEL_CACHE.get(model_name)
+    with metrics.stage("load_model"):
+        model = MODEL_CACHE.get(model_name)
 
     if not model:
         LOGGER.info("Missing model %r, aborting", model_name)
@@ -160,9 +305,10 @@ def classify_issue(
 
     # TODO: Classify could choke on a single bug which could make the whole
     # job to fail. What should we do here?
-    probs = model.classify(list(issues.values()), True)
-    indexes = probs.argmax(axis=-1)
-    suggestions = model.le.inverse_transform(indexes)
+    with metrics.stage("classify"):
+        probs = model.classify(list(issues.values()), True)
+        indexes = probs.argmax(axis=-1)
+        suggestions = model.le.inverse_transform(indexes)
 
     probs_list = probs.tolist()
     indexes_list = indexes.tolist()
@@ -177,7 +323,7 @@ def classify_issue(
         }
 
         job = JobInfo(classify_issue, model_name, owner, repo, issue_id)
-        setkey(job.result_key, orjson.dumps(data), compress=True)
+        setkey(job.result_key, orjson.dumps(add_timings(data)), compress=True)
 
         # Save the bug last change
         setkey(job.change_time_key, issues[issue_id]["updated_at"].encode())
@@ -185,6 +331,21 @@ def classify_issue(
     return "OK"
 
 
+@timed_job
+def classify_pending_issues(model_name: str, owner: str, repo: str) -> str:
+    from bugbug_http.app import JobInfo
+
+    batch = JobInfo(classify_pending_issues, model_name, owner, repo)
+
+    results = [
+        classify_issue(model_name, owner, repo, issue_nums)
+        for issue_nums in take_pending_batches(batch)
+    ]
+
+    return "OK" if "OK" in results else "NOK"
+
+
+@timed_job
 def classify_broken_site_report(model_name: str, reports_data: list[dict]) -> str:
     from bugbug_http.app import JobInfo
 
@@ -196,16 +357,18 @@ def classify_broken_site_report(model_name: str, reports_data: list[dict]) -> st
     if not reports:
         return "NOK"
 
-    model = MODEL_CACHE.get(model_name)
+    with metrics.stage("load_model"):
+        model = MODEL_CACHE.get(model_name)
 
     if not model:
         LOGGER.info("Missing model %r, aborting", model_name)
         return "NOK"
 
     model_extra_data = model.get_extra_data()
-    probs = model.classify(list(reports.values()), True)
-    indexes = probs.argmax(axis=-1)
-    suggestions = model.le.inverse_transform(indexes)
+    with metrics.stage("classify"):
+        probs = model.classify(list(reports.values()), True)
+        indexes = probs.argmax(axis=-1)
+        suggestions = model.le.inverse_transform(indexes)
 
     probs_list = probs.tolist()
     indexes_list = indexes.tolist()
@@ -220,7 +383,7 @@ def classify_broken_site_report(model_name: str, reports_data: list[dict]) -> st
         }
 
         job = JobInfo(classify_broken_site_report, model_name, report_uuid)
-        setkey(job.result_key, orjson.dumps(data), compress=True)
+        setkey(job.result_key, orjson.dumps(add_timings(data)), compress=True)
 
     return "OK"
 
@@ -231,6 +394,47 @@ def get_known_tasks() -> tuple[str, ...]:
         return tuple(line.strip() for line in f)
 
 
+def get_schedules_version() -> str:
+    """Get the version of what test selection depends on, apart from the change.
+
+    That is the test selection models, the past failures DBs and the known
+    tasks.
+    """
+    versions = [
+        get_model_version(f"{model_name}model")
+        for model_name in ("testlabelselect", "testgroupselect")
+    ]
+    versions += [
+        get_model_version(os.path.join("data", db[: -len(".tar.zst")]))
+        for db in (
+            test_scheduling.PAST_FAILURES_LABEL_DB,
+            test_scheduling.PAST_FAILURES_GROUP_DB,
+        )
+    ]
+    try:
+        versions.append(os.stat("known_tasks").st_mtime_ns)
+    except FileNotFoundError:
+        versions.append(None)
+
+    return hashlib.sha256(repr(versions).encode("utf-8")).hexdigest()
+
+
+def get_schedules_signature_key(modified_paths: Iterable[str], version: str) -> str:
+    """Get the key of the test selection results for a change.
+
+    The results only depend on the files the change modifies (from which their
+    types and components are derived) and on the version of the models and
+    DBs, so changes rebased onto a new base, or different changes modifying the
+    same files, share them.
+    """
+    signature = hashlib.sha256(version.encode("utf-8"))
+    for path in sorted(set(modified_paths)):
+        signature.update(b"\0" + path.encode("utf-8"))
+
+    return f"bugbug:schedules_signature:{signature.hexdigest()}"
+
+
+@timed_job
 def schedule_tests(branch: str, rev: str) -> str:
     from bugbug_http import REPO_DIR
     from bugbug_http.app import JobInfo
@@ -240,12 +444,14 @@ def schedule_tests(branch: str, rev: str) -> str:
 
     # Pull the revision to the local repository
     LOGGER.info("Pulling commits from the remote repository...")
-    repository.pull(REPO_DIR, branch, rev, update=False)
+    with metrics.stage("pull"):
+        repository.pull(REPO_DIR, branch, rev, update=False)
 
     # Load the full stack of patches leading to that revision
     LOGGER.info("Loading commits to analyze using automationrelevance...")
     try:
-        revs = get_hgmo_stack(branch, rev)
+        with metrics.stage("get_hgmo_stack"):
+            revs = get_hgmo_stack(branch, rev)
     except requests.exceptions.RequestException:
         LOGGER.warning("Push not found for %s @ %s!", branch, rev)
         return "NOK"
@@ -259,20 +465,23 @@ def schedule_tests(branch: str, rev: str) -> str:
 
     data = _analyze_patch(revs, repo_branch)
 
-    setkey(job.result_key, orjson.dumps(data), compress=True)
+    setkey(job.result_key, orjson.dumps(add_timings(data)), compress=True)
 
     return "OK"
 
 
+@timed_job
 def get_config_specific_groups(config: str) -> str:
     from bugbug_http.app import JobInfo
 
     job = JobInfo(get_config_specific_groups, config)
     LOGGER.info("Processing %s...", job)
 
-    equivalence_sets = testselect._get_equivalence_sets(0.9)
+    with metrics.stage("load_equivalence_sets"):
+        equivalence_sets = testselect._get_equivalence_sets(0.9)
 
-    past_failures_data = test_scheduling.PastFailures("group", True)
+    with metrics.stage("load_past_failures"):
+        past_failures_data = test_scheduling.PastFailures("group", True)
 
     setkey(
         job.result_key,
@@ -292,6 +501,7 @@ def get_config_specific_groups(config: str) -> str:
     return "OK"
 
 
+@timed_job
 def schedule_tests_from_patch(base_rev: str, patch_hash: str) -> str:
     from bugbug_http import REPO_DIR
     from bugbug_http.app import JobInfo
@@ -307,19 +517,27 @@ def schedule_tests_from_patch(base_rev: str, patch_hash: str) -> str:
         LOGGER.error("Patch not found in Redis for hash %s", patch_hash)
         return "NOK"
 
-    hg_base_rev = utils.git2hg(base_rev)
+    with metrics.stage("git2hg"):
+        hg_base_rev = utils.git2hg(base_rev)
     LOGGER.info("Mapped git base rev %s to hg rev %s", base_rev, hg_base_rev)
 
-    # Pull the base revision to the local repository
-    LOGGER.info("Pulling base revision from the remote repository...")
-    repository.pull(REPO_DIR, "integration/autoland", hg_base_rev, update=True)
+    # The patch is applied on top of the working copy, which must not be
+    # updated by another job in the meantime.
+    with working_copy_lock(REPO_DIR):
+        # Pull the base revision to the local repository
+        LOGGER.info("Pulling base revision from the remote repository...")
+        with metrics.stage("pull"):
+            repository.pull(REPO_DIR, "integration/autoland", hg_base_rev, update=True)
 
-    LOGGER.info("Generating commit(s) from patch...")
-    revs = repository.import_commits(REPO_DIR, hg_base_rev, patch=patch_data_raw)
+        LOGGER.info("Generating commit(s) from patch...")
+        with metrics.stage("import_commits"):
+            revs = repository.import_commits(
+                REPO_DIR, hg_base_rev, patch=patch_data_raw
+            )
 
     data = _analyze_patch(revs, "default")
 
-    setkey(job.result_key, orjson.dumps(data), compress=True)
+    setkey(job.result_key, orjson.dumps(add_timings(data)), compress=True)
 
     return "OK"
 
@@ -327,13 +545,14 @@ def schedule_tests_from_patch(base_rev: str, patch_hash: str) -> str:
 def _analyze_patch(revs: list[bytes], branch: str | None) -> dict:
     from bugbug_http import REPO_DIR
 
-    commits = repository.download_commits(
-        REPO_DIR,
-        revs=revs,
-        branch=branch,
-        save=False,
-        include_no_bug=True,
-    )
+    with metrics.stage("download_commits"):
+        commits = repository.download_commits(
+            REPO_DIR,
+            revs=revs,
+            branch=branch,
+            save=False,
+            include_no_bug=True,
+        )
 
     if not commits:
         return {
@@ -345,35 +564,53 @@ def _analyze_patch(revs: list[bytes], branch: str | None) -> dict:
             "known_tasks": get_known_tasks(),
         }
 
+    modified_paths = list(set(path for commit in commits for path in commit["files"]))
+
+    signature_key = None
+    if SCHEDULES_CACHE_TTL:
+        version = get_schedules_version()
+        redis.set(SCHEDULES_VERSION_KEY, version)
+
+        signature_key = get_schedules_signature_key(modified_paths, version)
+        cached_data = redis.get(signature_key)
+        if cached_data:
+            LOGGER.info("Reusing the schedules of a change modifying the same files")
+            with metrics.stage("load_cached_schedules"):
+                return orjson.loads(dctx.decompress(cached_data))
+
     test_selection_threshold = float(
         os.environ.get("TEST_SELECTION_CONFIDENCE_THRESHOLD", 0.5)
     )
 
-    testlabelselect_model = MODEL_CACHE.get("testlabelselect")
-    testgroupselect_model = MODEL_CACHE.get("testgroupselect")
+    with metrics.stage("load_models"):
+        testlabelselect_model = MODEL_CACHE.get("testlabelselect")
+        testgroupselect_model = MODEL_CACHE.get("testgroupselect")
 
-    known_tasks = get_known_tasks()
-    modified_paths = list(set(path for commit in commits for path in commit["files"]))
+        known_tasks = get_known_tasks()
 
-    tasks = testlabelselect_model.select_tests(commits, test_selection_threshold)
-    for task in test_scheduling.find_tasks_for_paths(
-        REPO_DIR, known_tasks, modified_paths
-    ):
-        tasks[task] = 1.0
+    with metrics.stage("select_tasks"):
+        tasks = testlabelselect_model.select_tests(commits, test_selection_threshold)
+        for task in test_scheduling.find_tasks_for_paths(
+            REPO_DIR, known_tasks, modified_paths
+        ):
+            tasks[task] = 1.0
 
-    reduced = testselect.reduce_configs(
-        set(t for t, c in tasks.items() if c >= 0.8), 1.0
-    )
+    with metrics.stage("reduce_configs"):
+        reduced = testselect.reduce_configs(
+            set(t for t, c in tasks.items() if c >= 0.8), 1.0
+        )
 
-    reduced_higher = testselect.reduce_configs(
-        set(t for t, c in tasks.items() if c >= 0.9), 1.0
-    )
+        reduced_higher = testselect.reduce_configs(
+            set(t for t, c in tasks.items() if c >= 0.9), 1.0
+        )
 
-    groups = testgroupselect_model.select_tests(commits, test_selection_threshold)
-    for group in test_scheduling.find_manifests_for_paths(REPO_DIR, modified_paths):
-        groups[group] = 1.0
+    with metrics.stage("select_groups"):
+        groups = testgroupselect_model.select_tests(commits, test_selection_threshold)
+        for group in test_scheduling.find_manifests_for_paths(REPO_DIR, modified_paths):
+            groups[group] = 1.0
 
-    config_groups = testselect.select_configs(groups, 0.9)
+    with metrics.stage("select_configs"):
+        config_groups = testselect.select_configs(groups, 0.9)
 
     data = {
         "tasks": tasks,
@@ -384,4 +621,9 @@ def _analyze_patch(revs: list[bytes], branch: str | None) -> dict:
         "known_tasks": known_tasks,
     }
 
+    if signature_key is not None:
+        redis.set(
+            signature_key, cctx.compress(orjson.dumps(data)), ex=SCHEDULES_CACHE_TTL
+        )
+
     return data
@@ -4,72 +4,138 @@
 # You can obtain one at http://mozilla.org/MPL/2.0/.
 
 
-import datetime
 import logging
 import threading
 import time
-from datetime import timedelta
+from collections import OrderedDict
 from typing import Callable, Generic, TypeVar
 
 LOGGER = logging.getLogger()
 
-# A simple TTL cache to use with models. Because we expect the number of models
-# in the service to not be very large, simplicity of implementation is
-# preferred to algorithmic efficiency of operations.
-#
-# Called an 'Idle' TTL cache because TTL of items is reset after every get
+# A size-aware LRU cache to use with models. Items are loaded on the first
+# access, and the least recently used items are evicted when the total size of
+# the items exceeds the budget. Because we expect the number of models in the
+# service to not be very large, simplicity of implementation is preferred to
+# algorithmic efficiency of operations.
 Key = TypeVar("Key")
 Value = TypeVar("Value")
 
 
-class ReadthroughTTLCache(Generic[Key, Value]):
-    def __init__(self, ttl: timedelta, load_item_function: Callable[[Key], Value]):
-        self.ttl = ttl
+class ReadthroughLRUCache(Generic[Key, Value]):
+    def __init__(
+        self,
+        load_item_function: Callable[[Key], Value],
+        max_size: int | None = None,
+        get_item_size: Callable[[Value], int] = lambda item: 1,
+    ):
         self.load_item_function = load_item_function
-        self.items_last_accessed: dict[Key, datetime.datetime] = {}
-        self.items_storage: dict[Key, Value] = {}
+        self.max_size = max_size
+        self.get_item_size = get_item_size
+
+        self.items_storage: OrderedDict[Key, Value] = OrderedDict()
+        self.items_size: dict[Key, int] = {}
+        self.size = 0
+
+        self.lock = threading.Lock()
+        # Items being loaded, with an event set once they are loaded.
+        self.loading: dict[Key, threading.Event] = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.load_failures = 0
+        self.load_seconds = 0.0
+        self.evictions = 0
 
     def __contains__(self, key):
         return key in self.items_storage
 
-    def get(self, key, force_store=False):
-        store_item = force_store
+    def __len__(self):
+        return len(self.items_storage)
+
+    def items(self) -> list[tuple[Key, Value]]:
+        with self.lock:
+            return list(self.items_storage.items())
+
+    def get(self, key: Key, is_stale: Callable[[Value], bool] | None = None) -> Value:
+        """Get an item, loading it if it isn't cached or if it is stale.
+
+        Concurrent misses for the same key only load the item once, the other
+        callers wait for it to be loaded.
+        """
+        while True:
+            with self.lock:
+                if key in self.items_storage and (
+                    is_stale is None or not is_stale(self.items_storage[key])
+                ):
+                    self.hits += 1
+                    self.items_storage.move_to_end(key)
+                    return self.items_storage[key]
+
+                loaded_event = self.loading.get(key)
+                if loaded_event is None:
+                    self.misses += 1
+                    loaded_event = self.loading[key] = threading.Event()
+                    break
+
+            # Another thread is loading the item. Once it is done, the item is
+            # either cached or it failed to load and we'll try loading it.
+            loaded_event.wait()
+
+        try:
+            start_time = time.monotonic()
+            try:
+                item = self.load_item_function(key)
+            except Exception:
+                with self.lock:
+                    self.load_failures += 1
+                raise
+
+            with self.lock:
+                self.loads += 1
+                self.load_seconds += time.monotonic() - start_time
+                self._store(key, item)
+
+            return item
+        finally:
+            with self.lock:
+                del self.loading[key]
+            loaded_event.set()
+
+    def _store(self, key: Key, item: Value) -> None:
         if key in self.items_storage:
-            item = self.items_storage[key]
-        else:
-            item = self.load_item_function(key)
-            # Cache the item only if it was last accessed within the past TTL seconds
-            # Note that all entries in items_last_accessed are purged if item was not
-            # accessed in the last TTL seconds.
-            if key in self.items_last_accessed:
-                store_item = True
-
-        self.items_last_accessed[key] = datetime.datetime.now()
-        if store_item:
+            self.size -= self.items_size[key]
+
+        LOGGER.info("Storing item with the following key in readthroughcache: %s", key)
+        self.items_storage[key] = item
+        self.items_storage.move_to_end(key)
+        self.items_size[key] = self.get_item_size(item)
+        self.size += self.items_size[key]
+
+        # Always keep the most recently used item, even if it alone exceeds the
+        # budget.
+        while (
+            self.max_size is not None
+            and self.size > self.max_size
+            and len(self.items_storage) > 1
+        ):
+            evicted_key, _ = self.items_storage.popitem(last=False)
+            self.size -= self.items_size.pop(evicted_key)
+            self.evictions += 1
             LOGGER.info(
-                "Storing item with the following key in readthroughcache: %s", key
+                "Evicting item with the following key from readthroughcache: %s",
+                evicted_key,
             )
-            self.items_storage[key] = item
-
-        return item
-
-    def purge_expired_entries(self):
-        purge_entries_before = datetime.datetime.now() - self.ttl
-        for key, time_last_touched in list(self.items_last_accessed.items()):
-            if time_last_touched < purge_entries_before:
-                LOGGER.info(
-                    "Evicting item with the following key from readthroughcache: %s",
-                    key,
-                )
-                del self.items_last_accessed[key]
-                del self.items_storage[key]
-
-    def start_ttl_thread(self):
-        def purge_expired_entries_with_wait():
-            while True:
-                time.sleep(self.ttl.total_seconds())
-                self.purge_expired_entries()
-
-        thread = threading.Thread(target=purge_expired_entries_with_wait)
-        thread.setDaemon(True)
-        thread.start()
+
+    def get_stats(self) -> dict[str, int | float]:
+        with self.lock:
+            return {
+                "items": len(self.items_storage),
+                "size": self.size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "loads": self.loads,
+                "load_failures": self.load_failures,
+                "load_seconds": self.load_seconds,
+                "evictions": self.evictions,
+            }
@@ -4,25 +4,165 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this file,
 # You can obtain one at http://mozilla.org/MPL/2.0/.
 
+import logging
 import os
+import signal
 import sys
+import time
 from urllib.parse import urlparse
 
+import psutil
 from redis import Redis
-from rq import Worker
+from rq import Queue, SimpleWorker, Worker
+from rq.job import Job
+from rq.worker import WorkerStatus
 from sentry_sdk.integrations.rq import RqIntegration
 
 import bugbug_http.boot
+from bugbug import repository
+from bugbug_http import ALLOW_MISSING_MODELS
+from bugbug_http.models import (
+    MODEL_CACHE,
+    PRELOADED_MODELS_NAMES,
+    model_cache_metrics,
+)
 from bugbug_http.sentry import setup_sentry
 
 if os.environ.get("SENTRY_DSN"):
     setup_sentry(dsn=os.environ.get("SENTRY_DSN"), integrations=[RqIntegration()])
 
+logger = logging.getLogger(__name__)
+
+# Whether to run the jobs in long-lived worker processes, instead of forking a
+# work horse for each job.
+WARM_WORKER = bool(int(os.environ.get("BUGBUG_WARM_WORKER", "0")))
+# Number of long-lived worker processes. They share the repository, whose
+# working copy is changed by the jobs scheduling tests for patches under a lock,
+# so these jobs run one at a time.
+WARM_WORKER_PROCESSES = int(os.environ.get("BUGBUG_WARM_WORKER_PROCESSES", "1"))
+# Number of jobs after which a long-lived worker process is replaced (0 means
+# never).
+WARM_WORKER_MAX_JOBS = int(os.environ.get("BUGBUG_WARM_WORKER_MAX_JOBS", "100"))
+# Memory usage after which a long-lived worker process is replaced (0 means
+# no limit).
+WARM_WORKER_MAX_MEMORY_MB = int(os.environ.get("BUGBUG_WARM_WORKER_MAX_MEMORY_MB", "0"))
+
+
+class ModelSharingWorker(Worker):
+    """A worker whose work horses share the models loaded by the worker."""
+
+    def execute_job(self, job: Job, queue: Queue) -> None:
+        # Swap in the models downloaded since the last job before forking the
+        # work horse, so that it doesn't have to load them on its own.
+        with model_cache_metrics():
+            for model_name in MODEL_CACHE.refresh():
+                logger.info("Swapped in a new version of the %s model", model_name)
+
+        super().execute_job(job, queue)
+
+
+class WarmWorker(SimpleWorker):
+    """A worker running the jobs in its own process.
+
+    The state loaded by a job (models, DBs, servers, caches) is reused by the
+    following jobs. The worker stops after a job fails, as the job could have
+    been interrupted (e.g. by its timeout) while changing that state, or when
+    it uses too much memory, so that it is replaced by a fresh one.
+    """
+
+    def execute_job(self, job: Job, queue: Queue) -> None:
+        with model_cache_metrics():
+            for model_name in MODEL_CACHE.refresh():
+                logger.info("Swapped in a new version of the %s model", model_name)
+
+        self.prepare_execution(job)
+        succeeded = self.perform_job(job, queue)
+        self.set_state(WorkerStatus.IDLE)
+
+        if not succeeded:
+            logger.info("Job %s failed, stopping the worker", job.id)
+            self._stop_requested = True
+
+        rss = psutil.Process().memory_info().rss
+        if WARM_WORKER_MAX_MEMORY_MB and rss > WARM_WORKER_MAX_MEMORY_MB * 2**20:
+            logger.info("Worker is using %d MB of memory, stopping it", rss // 2**20)
+            self._stop_requested = True
+
+
+def run_warm_workers(queue_names: list[str], redis_conn: Redis) -> None:
+    """Run long-lived worker processes, replacing them when they stop.
+
+    The processes are forked from this one, so they share the models it
+    loaded.
+    """
+    children: dict[int, float] = {}
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        # On SIGINT, the whole process group already got the signal.
+        if signum == signal.SIGTERM:
+            for pid in children:
+                os.kill(pid, signum)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    while True:
+        while not stopping and len(children) < WARM_WORKER_PROCESSES:
+            pid = os.fork()
+            if pid == 0:
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                signal.signal(signal.SIGINT, signal.SIG_DFL)
+                exit_code = 1
+                try:
+                    w = WarmWorker(queue_names, connection=redis_conn)
+                    w.work(max_jobs=WARM_WORKER_MAX_JOBS or None)
+                    exit_code = 0
+                except Exception:
+                    # The process exits right away, without printing the traceback.
+                    logger.exception("Worker process %d crashed", os.getpid())
+                finally:
+                    os._exit(exit_code)
+
+            logger.info("Started worker process %d", pid)
+            children[pid] = time.monotonic()
+
+        if not children:
+            break
+
+        try:
+            pid, _ = os.wait()
+        except InterruptedError:
+            continue
+        except ChildProcessError:
+            break
+
+        started_at = children.pop(pid)
+        if not stopping:
+            logger.info("Worker process %d stopped, replacing it", pid)
+            # Don't replace the processes too eagerly when they can't work.
+            time.sleep(max(0.0, 5 - (time.monotonic() - started_at)))
+
 
 def main():
     # Bootstrap the worker assets
     bugbug_http.boot.boot_worker()
 
+    # Load the models once, before the work horses are forked.
+    with model_cache_metrics():
+        MODEL_CACHE.preload(PRELOADED_MODELS_NAMES, allow_missing=ALLOW_MISSING_MODELS)
+    logger.info("Models preloaded: %r", MODEL_CACHE.get_stats())
+
+    # Keep the servers and DBs used to analyze commits open across jobs. The
+    # rust-code-analysis server is started here, so that the work horses share it.
+    repository.enable_persistent_servers()
+    try:
+        repository.get_code_analysis_server(1)
+    except RuntimeError:
+        logger.warning("rust-code-analysis server not started", exc_info=True)
+
     # Provide queue names to listen to as arguments to this script,
     # similar to rq worker
     url = urlparse(os.environ.get("REDIS_URL", "redis://localhost/0"))
@@ -35,12 +175,15 @@ def main():
         ssl_cert_reqs=None,
     )
     qs = sys.argv[1:] or ["default"]
-    w = Worker(qs, connection=redis_conn)
 
     # Write readiness probe file.
     open("/tmp/ready", "w").close()
 
-    w.work()
+    if WARM_WORKER:
+        run_warm_workers(qs, redis_conn)
+    else:
+        w = ModelSharingWorker(qs, connection=redis_conn)
+        w.work()
 
 
 if __name__ == "__main__":
@@ -27,7 +27,7 @@ import bugbug.models.testselect
 import bugbug_http
 import bugbug_http.models
 from bugbug import repository, test_scheduling
-from bugbug_http import app
+from bugbug_http import app, metrics
 
 
 @pytest.fixture
@@ -59,16 +59,20 @@ def patch_resources(monkeypatch, jobs):
             self.data = {}
             self.expirations = {}
 
-        def set(self, k, v):
+        def set(self, k, v, nx=False, ex=None):
+            if nx and k in self.data:
+                return False
+
             # keep track of job ids for testing purposes
             if k.startswith("bugbug:job_id"):
                 key = k.split(":", 2)[-1]
                 jobs[v].append(key)
 
             if not isinstance(v, bytes):
-                v = v.encode("ascii")
+                v = str(v).encode("ascii")
 
             self.data[k] = v
+            return True
 
         def mset(self, d):
             for k, v in d.items():
@@ -77,16 +81,57 @@ def patch_resources(monkeypatch, jobs):
         def get(self, k):
             return self.data.get(k)
 
+        def mget(self, keys):
+            return [self.data.get(k) for k in keys]
+
         def exists(self, k):
             return k in self.data
 
-        def delete(self, k):
-            if self.exists(k):
-                del self.data[k]
+        def delete(self, *keys):
+            for k in keys:
+                if self.exists(k):
+                    del self.data[k]
 
         def expire(self, key, expiration):
             self.expirations[key] = expiration
 
+        def pipeline(self, transaction=True):
+            # Commands are run right away, there is nothing to gain by
+            # buffering them here.
+            mock = self
+
+            class PipelineMock:
+                def __getattr__(self, name):
+                    return getattr(mock, name)
+
+                def execute(self):
+                    return []
+
+            return PipelineMock()
+
+        def hincrbyfloat(self, k, field, amount):
+            fields = self.data.setdefault(k, {})
+            fields[field.encode()] = float(fields.get(field.encode(), 0)) + amount
+            return fields[field.encode()]
+
+        def hgetall(self, k):
+            return {
+                field: str(value).encode()
+                for field, value in self.data.get(k, {}).items()
+            }
+
+        def sadd(self, k, *values):
+            self.data.setdefault(k, set()).update(str(v).encode() for v in values)
+
+        def scard(self, k):
+            return len(self.data.get(k, ()))
+
+        def spop(self, k, count):
+            items = sorted(self.data.get(k, ()))[:count]
+            for item in items:
+                self.data[k].remove(item)
+            return items
+
     class QueueMock:
         """Mock class to mimic rq.Queue."""
 
@@ -116,7 +161,15 @@ def patch_resources(monkeypatch, jobs):
 
             raise NoSuchJobError
 
-        def get_status(self):
+        @staticmethod
+        def fetch_many(job_ids, **kwargs):
+            return [JobMock(job_id) if job_id in jobs else None for job_id in job_ids]
+
+        @property
+        def id(self):
+            return self.job_id
+
+        def get_status(self, refresh=True):
             if self.job_id not in jobs:
                 raise NoSuchJobError
 
@@ -321,6 +374,9 @@ class MockModelCache:
         else:
             return bugbug.models.testselect.TestLabelSelectModel()
 
+    def get_stats(self):
+        return dict.fromkeys(metrics.MODEL_CACHE_STATS, 0)
+
 
 @pytest.fixture
 def mock_get_config_specific_groups(
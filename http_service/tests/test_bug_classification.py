@@ -8,7 +8,9 @@ import time
 
 import orjson
 
+from bugbug_http import app, models
 from bugbug_http.app import API_TOKEN
+from bugbug_http.models import classify_pending_bugs
 
 
 def retrieve_compressed_reponse(response):
@@ -19,19 +21,20 @@ def retrieve_compressed_reponse(response):
     return response.json
 
 
-def test_model_predict_id(client, jobs, add_result, responses):
-    bug_id = "123456"
+def test_model_predict_id(client, jobs, add_result, add_change_time, responses):
+    bug_id = 123456
     result = {
         "class": "Core::Layout",
         "extra_data": {"index": 0, "prob": [0.0032219779677689075]},
     }
+    change_time = str(time.time())
 
     responses.add(
         responses.GET,
         f"https://bugzilla.mozilla.org/rest/bug?id={bug_id}&include_fields=last_change_time&include_fields=id",
         status=200,
         json={
-            "bugs": [{"id": bug_id, "last_change_time": time.time()}],
+            "bugs": [{"id": bug_id, "last_change_time": change_time}],
         },
     )
 
@@ -53,6 +56,8 @@ def test_model_predict_id(client, jobs, add_result, responses):
 
     # now it's ready
     keys = next(iter(jobs.values()))
+    # Need to set the change time in redis or the result will be invalidated.
+    add_change_time(keys[0], change_time)
     add_result(keys[0], result)
 
     rv = do_request()
@@ -101,6 +106,50 @@ def test_model_predict_id_github(client, jobs, add_result, responses):
     assert retrieve_compressed_reponse(rv) == result
 
 
+def test_model_predict_id_coalesced(client, jobs, responses, monkeypatch):
+    for bug_id in (123, 456, 789):
+        responses.add(
+            responses.GET,
+            f"https://bugzilla.mozilla.org/rest/bug?id={bug_id}&include_fields=last_change_time&include_fields=id",
+            status=200,
+            json={
+                "bugs": [{"id": bug_id, "last_change_time": time.time()}],
+            },
+        )
+
+    enqueued = []
+    monkeypatch.setattr(
+        app.q, "enqueue", lambda func, *args, **kwargs: enqueued.append((func, args))
+    )
+
+    for bug_id in (123, 456):
+        rv = client.get(f"/component/predict/{bug_id}", headers={API_TOKEN: "test"})
+        assert rv.status_code == 202
+
+    # Both bugs are classified by the same job.
+    assert enqueued == [(classify_pending_bugs, ("component", None))]
+    assert len(jobs) == 1
+    assert next(iter(jobs.values())) == [
+        "classify_bug:component_123",
+        "classify_bug:component_456",
+    ]
+
+    classified = []
+    monkeypatch.setattr(models, "BATCH_MAX_SIZE", 1)
+    monkeypatch.setattr(
+        models,
+        "classify_bug",
+        lambda model_name, bug_ids, token: classified.append(bug_ids) or "OK",
+    )
+    assert classify_pending_bugs("component", None) == "OK"
+    assert classified == [[123], [456]]
+
+    # Once the job took the pending bugs, a new one is started.
+    rv = client.get("/component/predict/789", headers={API_TOKEN: "test"})
+    assert rv.status_code == 202
+    assert len(enqueued) == 2
+
+
 def test_model_predict_batch(client, jobs, add_result, add_change_time, responses):
     bug_ids = [123, 456]
     result = {
@@ -158,6 +207,95 @@ def test_model_predict_batch(client, jobs, add_result, add_change_time, response
     }
 
 
+def test_model_predict_batch_invalidated(
+    client, jobs, add_result, add_change_time, responses
+):
+    bug_ids = [123, 456, 789]
+    result = {
+        "class": "Core::Layout",
+        "extra_data": {"index": 0, "prob": [0.0032219779677689075]},
+    }
+    change_time = str(time.time())
+
+    responses.add(
+        responses.GET,
+        "https://bugzilla.mozilla.org/rest/bug?id=123,456,789&include_fields=id&include_fields=last_change_time",
+        status=200,
+        json={
+            "bugs": [
+                {"id": bug_id, "last_change_time": change_time} for bug_id in bug_ids
+            ],
+        },
+    )
+
+    for bug_id in bug_ids:
+        add_result(f"classify_bug:component_{bug_id}", result)
+
+    # The first bug is up to date, the second changed since it was classified,
+    # and the third was classified without storing its change time.
+    add_change_time("classify_bug:component_123", change_time)
+    add_change_time("classify_bug:component_456", "0")
+
+    rv = client.post(
+        "/component/predict/batch",
+        json={"bugs": bug_ids},
+        headers={API_TOKEN: "test"},
+    )
+    assert rv.status_code == 202
+    assert retrieve_compressed_reponse(rv) == {
+        "bugs": {"123": result, "456": {"ready": False}, "789": {"ready": False}}
+    }
+    assert "bugbug:job_result:classify_bug:component_456" not in app.redis_conn.data
+    assert "bugbug:change_time:classify_bug:component_456" not in app.redis_conn.data
+    assert "bugbug:job_result:classify_bug:component_789" not in app.redis_conn.data
+    assert len(jobs) == 1
+    assert next(iter(jobs.values()))[:2] == [
+        "classify_bug:component_456",
+        "classify_bug:component_789",
+    ]
+
+
+def test_model_predict_batch_change_time_cache(client, responses):
+    change_time = str(time.time())
+
+    responses.add(
+        responses.GET,
+        "https://bugzilla.mozilla.org/rest/bug?id=123,456&include_fields=id&include_fields=last_change_time",
+        status=200,
+        json={"bugs": [{"id": 123, "last_change_time": change_time}]},
+    )
+    responses.add(
+        responses.GET,
+        "https://bugzilla.mozilla.org/rest/bug?id=789&include_fields=id&include_fields=last_change_time",
+        status=200,
+        json={"bugs": [{"id": 789, "last_change_time": change_time}]},
+    )
+
+    def do_request(bug_ids):
+        rv = client.post(
+            "/component/predict/batch",
+            json={"bugs": bug_ids},
+            headers={API_TOKEN: "test"},
+        )
+        assert rv.status_code == 202
+
+    do_request([123, 456])
+    assert len(responses.calls) == 1
+
+    # Polling again doesn't query Bugzilla, even for the bug it didn't return.
+    do_request([123, 456])
+    assert len(responses.calls) == 1
+
+    # Only the new bug is queried.
+    do_request([123, 456, 789])
+    assert len(responses.calls) == 2
+
+    assert app.get_bugs_last_change_time([123, 456, 789]) == {
+        123: change_time,
+        789: change_time,
+    }
+
+
 def test_model_predict_batch_broken_site_reports(client, jobs, add_result):
     reports = [
         {
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import os
+import signal
+import time
+
+import responses
+
+from bugbug_http import listener
+
+
+def push_url(branch, rev):
+    return f"{listener.BUGBUG_HTTP_SERVER}/push/{branch}/{rev}/schedules"
+
+
+def test_push_scheduler():
+    responses.add(responses.GET, push_url("autoland", "rev1"), status=202)
+    responses.add(responses.GET, push_url("try", "rev2"), status=503)
+    responses.add(responses.GET, push_url("try", "rev2"), status=202)
+    responses.add(responses.GET, push_url("try", "rev3"), status=404)
+
+    with listener.PushScheduler(concurrency=2, retry_backoff=0) as scheduler:
+        assert scheduler.submit("autoland", "rev1")
+        assert scheduler.submit("try", "rev2")
+        assert scheduler.submit("try", "rev3")
+
+        # Pushes which were already requested are skipped.
+        assert not scheduler.submit("autoland", "rev1")
+
+    requested = [call.request.url for call in responses.calls]
+    assert requested.count(push_url("autoland", "rev1")) == 1
+    # The unavailable server is retried.
+    assert requested.count(push_url("try", "rev2")) == 2
+    # Other errors aren't retried, but the push can be requested again.
+    assert requested.count(push_url("try", "rev3")) == 1
+    assert ("try", "rev3") not in scheduler.submitted
+    assert ("try", "rev2") in scheduler.submitted
+
+
+def test_push_scheduler_dedup_window():
+    responses.add(responses.GET, push_url("autoland", "rev1"), status=202)
+
+    with listener.PushScheduler(dedup_window=-1) as scheduler:
+        assert scheduler.submit("autoland", "rev1")
+        assert scheduler.submit("autoland", "rev1")
+
+    assert len(responses.calls) == 2
+
+
+def test_main_sigterm(monkeypatch):
+    """Test that the queued pushes are requested when the listener is stopped."""
+    responses.add(responses.GET, push_url("autoland", "rev1"), status=202)
+
+    class Message:
+        acked = False
+
+        def ack(self):
+            self.acked = True
+
+    message = Message()
+
+    class Consumer:
+        should_stop = False
+
+        def __init__(self, user, password, callback):
+            self.callback = callback
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, type, value, traceback):
+            pass
+
+        def run(self):
+            self.callback(
+                {
+                    "payload": {
+                        "type": "changegroup.1",
+                        "data": {
+                            "repo_url": "https://hg.mozilla.org/integration/autoland",
+                            "heads": ["rev1"],
+                            "pushlog_pushes": [{"user": "user@mozilla.com"}],
+                        },
+                    }
+                },
+                message,
+            )
+            os.kill(os.getpid(), signal.SIGTERM)
+            while not self.should_stop:
+                time.sleep(0.01)
+
+    monkeypatch.setenv("PULSE_USER", "user")
+    monkeypatch.setenv("PULSE_PASSWORD", "password")
+    monkeypatch.setattr(listener, "HgPushesConsumer", Consumer)
+
+    previous_handler = signal.getsignal(signal.SIGTERM)
+    try:
+        listener.main()
+    finally:
+        signal.signal(signal.SIGTERM, previous_handler)
+
+    assert message.acked
+    assert [call.request.url for call in responses.calls] == [
+        push_url("autoland", "rev1")
+    ]
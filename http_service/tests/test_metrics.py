@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import pytest
+
+from bugbug_http import metrics, models
+from bugbug_http.readthrough_cache import ReadthroughLRUCache
+
+
+@models.timed_job
+def inner_job(value):
+    with metrics.stage("inner"):
+        return "OK" if value else "NOK"
+
+
+@models.timed_job
+def outer_job(value):
+    with metrics.stage("outer"):
+        pass
+
+    return inner_job(value)
+
+
+def test_timed_job(client, monkeypatch):
+    monkeypatch.setattr(models, "DEBUG_TIMINGS", True)
+
+    assert outer_job(True) == "OK"
+    assert outer_job(False) == "NOK"
+    assert inner_job(True) == "OK"
+
+    # Timings are only available while a job is running.
+    assert models.add_timings({}) == {"timings": {}}
+
+    rv = client.get("/metrics")
+    assert rv.status_code == 200
+    lines = rv.data.decode("utf-8").splitlines()
+
+    assert "# TYPE bugbug_job_stage_duration_seconds histogram" in lines
+    assert 'bugbug_jobs_total{job="outer_job",status="OK"} 1.0' in lines
+    assert 'bugbug_jobs_total{job="outer_job",status="NOK"} 1.0' in lines
+    assert 'bugbug_jobs_total{job="inner_job",status="OK"} 1.0' in lines
+    assert 'bugbug_job_duration_seconds_count{job="outer_job"} 2.0' in lines
+
+    # The stages of a job called by another job are part of the calling job.
+    assert (
+        'bugbug_job_stage_duration_seconds_bucket{job="outer_job",le="+Inf",stage="inner"} 2.0'
+        in lines
+    )
+    assert (
+        'bugbug_job_stage_duration_seconds_bucket{job="outer_job",le="+Inf",stage="outer"} 2.0'
+        in lines
+    )
+
+    # Buckets are listed in increasing order of their upper bound.
+    buckets = [
+        line.split('le="', 1)[1].split('"', 1)[0]
+        for line in lines
+        if line.startswith('bugbug_job_duration_seconds_bucket{job="inner_job"')
+    ]
+    assert buckets == [str(bound) for bound in metrics.BUCKETS] + ["+Inf"]
+
+
+def test_add_timings(monkeypatch):
+    @models.timed_job
+    def job():
+        with metrics.stage("stage"):
+            pass
+
+        data = models.add_timings({})
+        assert set(data["timings"]) == {"stage", "total"}
+        return "OK"
+
+    assert models.add_timings({}) == {}
+
+    monkeypatch.setattr(models, "DEBUG_TIMINGS", True)
+    assert job() == "OK"
+
+
+def test_model_cache_metrics(client, monkeypatch):
+    def load(key):
+        if key == "missing":
+            raise FileNotFoundError(key)
+        return key
+
+    cache = ReadthroughLRUCache(load, max_size=1)
+    monkeypatch.setattr(models, "MODEL_CACHE", cache)
+
+    @models.timed_job
+    def job():
+        cache.get("a")
+        cache.get("a")
+        cache.get("b")
+        with pytest.raises(FileNotFoundError):
+            cache.get("missing")
+        return "OK"
+
+    # Models loaded outside of jobs (e.g. when preloading them) are counted too.
+    with models.model_cache_metrics():
+        cache.get("a")
+    assert job() == "OK"
+
+    rv = client.get("/metrics")
+    assert rv.status_code == 200
+    lines = rv.data.decode("utf-8").splitlines()
+
+    assert "# TYPE bugbug_model_cache_hits_total counter" in lines
+    assert "bugbug_model_cache_hits_total 2.0" in lines
+    assert "bugbug_model_cache_misses_total 3.0" in lines
+    assert "bugbug_model_cache_loads_total 2.0" in lines
+    assert "bugbug_model_cache_load_failures_total 1.0" in lines
+    assert "bugbug_model_cache_evictions_total 1.0" in lines
+    assert any(
+        line.startswith("bugbug_model_cache_load_seconds_total ") for line in lines
+    )
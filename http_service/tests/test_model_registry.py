@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import os
+
+import pytest
+
+from bugbug_http.model_registry import ModelRegistry, get_model_version
+
+
+def write_model(model_name, content, mtime):
+    os.makedirs(f"{model_name}model", exist_ok=True)
+    path = os.path.join(f"{model_name}model", "model.pkl")
+    with open(path, "w") as f:
+        f.write(content)
+    os.utime(path, ns=(mtime, mtime))
+
+
+def load_model(model_name):
+    with open(os.path.join(f"{model_name}model", "model.pkl")) as f:
+        return [f.read()]
+
+
+def test_get_model_version():
+    assert get_model_version("regressionmodel") is None
+
+    write_model("regression", "v1", 1000)
+    assert get_model_version("regressionmodel") == (1000, 2)
+
+    write_model("regression", "v22", 2000)
+    assert get_model_version("regressionmodel") == (2000, 3)
+
+
+def test_model_registry():
+    registry = ModelRegistry(load_model)
+
+    write_model("regression", "v1", 1000)
+    model = registry.get("regression")
+    assert model == ["v1"]
+    assert registry.get("regression") is model
+
+    # A new version of the model is loaded when it is requested.
+    write_model("regression", "v2", 2000)
+    assert registry.get("regression") == ["v2"]
+
+
+def test_model_registry_preload_refresh():
+    registry = ModelRegistry(load_model)
+
+    write_model("regression", "v1", 1000)
+    write_model("spambug", "v1", 1000)
+
+    with pytest.raises(FileNotFoundError):
+        registry.preload(["regression", "component"])
+
+    registry.preload(["regression", "spambug", "component"], allow_missing=True)
+    assert {model_name for model_name, _ in registry.cache.items()} == {
+        "regression",
+        "spambug",
+    }
+    model = registry.get("spambug")
+
+    assert registry.refresh() == []
+
+    write_model("regression", "v2", 2000)
+    assert registry.refresh() == ["regression"]
+    assert registry.get("regression") == ["v2"]
+    assert registry.get_stats()["loads"] == 3
+    assert registry.get("spambug") is model
@@ -3,10 +3,12 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this file,
 # You can obtain one at http://mozilla.org/MPL/2.0/.
 
+import fcntl
 import gzip
 from unittest.mock import patch
 
 import orjson
+import pytest
 
 from bugbug_http.app import API_TOKEN
 
@@ -27,7 +29,7 @@ def test_patch_schedules_post_with_cache(client, add_result, jobs):
     IncompleteRead error because the response was sent before consuming
     the request body.
 
-    The test verifies that request.data is accessed before compress_response
+    The test verifies that request.data is accessed before result_response
     is called when there's cached data for a POST request.
     """
     from bugbug_http import app
@@ -67,11 +69,11 @@ diff --git a/test.txt b/test.txt
     keys = next(iter(jobs.values()))
     add_result(keys[0], result)
 
-    # Wrap compress_response to track if request.data was accessed before it
-    original_compress_response = app.compress_response
+    # Wrap result_response to track if request.data was accessed before it
+    original_result_response = app.result_response
     request_data_accessed_before_compress = False
 
-    def tracking_compress_response(*args, **kwargs):
+    def tracking_result_response(*args, **kwargs):
         nonlocal request_data_accessed_before_compress
         # Check if we're in a request context and if data was accessed
         try:
@@ -84,11 +86,9 @@ diff --git a/test.txt b/test.txt
                     request_data_accessed_before_compress = True
         except Exception:
             pass
-        return original_compress_response(*args, **kwargs)
+        return original_result_response(*args, **kwargs)
 
-    with patch(
-        "bugbug_http.app.compress_response", side_effect=tracking_compress_response
-    ):
+    with patch("bugbug_http.app.result_response", side_effect=tracking_result_response):
         # Second POST request with same parameters - should return cached result
         # This is where the bug would occur - sending response before reading body
         rv = client.post(
@@ -100,9 +100,9 @@ diff --git a/test.txt b/test.txt
         assert rv.status_code == 200
         assert retrieve_compressed_reponse(rv) == result
 
-        # Verify that request.data was accessed before compress_response was called
+        # Verify that request.data was accessed before result_response was called
         assert request_data_accessed_before_compress, (
-            "request.data was not accessed before compress_response for POST request with cached result"
+            "request.data was not accessed before result_response for POST request with cached result"
         )
 
 
@@ -209,3 +209,104 @@ Subject: [PATCH] Uncommitted changes
 
     assert rv.status_code == 400
     assert rv.json == {"error": "Patch contains no diff content"}
+
+
+def test_patch_schedules_signature_cache(client, jobs, monkeypatch):
+    """Test that a patch modifying the same files as an analyzed one reuses its results."""
+    from bugbug_http import app, models
+
+    patch_content = """
+From 0000000000000000000000000000000000000000 Mon Sep 17 00:00:00 2001
+From: Test User <test@example.com>
+Date: Mon Nov 17 14:58:22 2025
+Subject: [PATCH] Uncommitted changes
+---
+
+diff --git a/test.txt b/test.txt
+--- a/test.txt
++++ b/test.txt
+@@ -1,1 +1,2 @@
+ line 1
++line 2
+"""
+    result = {
+        "groups": ["foo/mochitest.ini"],
+        "tasks": ["test-linux/opt-mochitest-1"],
+    }
+
+    def do_request():
+        return client.post(
+            "/patch/abc123/other456/schedules",
+            data=patch_content.encode("utf-8"),
+            headers={API_TOKEN: "test"},
+        )
+
+    monkeypatch.setattr(app, "SCHEDULES_CACHE_TTL", 3600)
+
+    # No worker analyzed a change yet.
+    rv = do_request()
+    assert rv.status_code == 202
+    assert len(jobs) == 1
+
+    # A worker analyzed a change modifying the same file.
+    app.redis_conn.set(models.SCHEDULES_VERSION_KEY, "version")
+    app.redis_conn.set(
+        models.get_schedules_signature_key(["test.txt"], "version"),
+        models.cctx.compress(orjson.dumps(result)),
+    )
+
+    rv = client.post(
+        "/patch/def789/other789/schedules",
+        data=patch_content.encode("utf-8"),
+        headers={API_TOKEN: "test"},
+    )
+    assert rv.status_code == 200
+    assert retrieve_compressed_reponse(rv) == result
+    assert len(jobs) == 1
+
+    # The result is now also available for the patch itself.
+    rv = client.get("/patch/def789/other789/schedules", headers={API_TOKEN: "test"})
+    assert rv.status_code == 200
+    assert retrieve_compressed_reponse(rv) == result
+
+
+def test_schedule_tests_from_patch_working_copy_lock(tmp_path, monkeypatch):
+    """Test that the working copy isn't changed by others while a patch is applied."""
+    import bugbug_http
+    from bugbug_http import models
+
+    repo_dir = str(tmp_path / "repo")
+    monkeypatch.setattr(bugbug_http, "REPO_DIR", repo_dir)
+    models.redis.set("bugbug:patch:patch_hash", b"patch")
+
+    def assert_locked():
+        with open(f"{repo_dir}.lock", "w") as lock_f:
+            with pytest.raises(BlockingIOError):
+                fcntl.flock(lock_f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+    stages = []
+
+    def pull(repo_dir, branch, revision, update=False):
+        assert update
+        assert_locked()
+        stages.append("pull")
+
+    def import_commits(repo_dir, base_rev, patch):
+        assert_locked()
+        stages.append("import_commits")
+        return [b"rev"]
+
+    def analyze_patch(revs, branch):
+        # The lock is released once the commits were imported.
+        with open(f"{repo_dir}.lock", "w") as lock_f:
+            fcntl.flock(lock_f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        stages.append("analyze_patch")
+        return {}
+
+    monkeypatch.setattr(models.utils, "git2hg", lambda rev: "hg_base_rev")
+    monkeypatch.setattr(models.repository, "pull", pull)
+    monkeypatch.setattr(models.repository, "import_commits", import_commits)
+    monkeypatch.setattr(models, "_analyze_patch", analyze_patch)
+
+    assert models.schedule_tests_from_patch("base_rev", "patch_hash") == "OK"
+    assert stages == ["pull", "import_commits", "analyze_patch"]
@@ -6,7 +6,9 @@
 import gzip
 
 import orjson
+import zstandard
 
+from bugbug_http import app
 from bugbug_http.app import API_TOKEN
 
 
@@ -58,3 +60,48 @@ def test_no_api_key(client):
 
     assert rv.status_code == 401
     assert rv.json == {"message": "Error, missing X-API-KEY"}
+
+
+def test_response_encoding(client, add_result, jobs):
+    client.get("/push/autoland/abcdef/schedules", headers={API_TOKEN: "test"})
+
+    result = {
+        "groups": ["foo/mochitest.ini", "bar/xpcshell.ini"],
+        "tasks": ["test-linux/opt-mochitest-1"],
+    }
+    keys = next(iter(jobs.values()))
+    add_result(keys[0], result)
+
+    def do_request(accept_encoding):
+        return client.get(
+            "/push/autoland/abcdef/schedules",
+            headers={API_TOKEN: "test", "Accept-Encoding": accept_encoding},
+        )
+
+    # The stored result is sent as is.
+    rv = do_request("gzip, zstd")
+    assert rv.status_code == 200
+    assert rv.headers["Content-Encoding"] == "zstd"
+    assert rv.data == app.redis_conn.get(f"bugbug:job_result:{keys[0]}")
+    assert orjson.loads(zstandard.ZstdDecompressor().decompress(rv.data)) == result
+
+    rv = do_request("gzip")
+    assert rv.headers["Content-Encoding"] == "gzip"
+    assert orjson.loads(gzip.decompress(rv.data)) == result
+
+    rv = do_request("identity")
+    assert "Content-Encoding" not in rv.headers
+    assert rv.json == result
+    assert rv.headers["Vary"] == "Accept-Encoding"
+
+    # Clients only accepting unsupported encodings get an unencoded response,
+    # unless they refuse it.
+    rv = do_request("br")
+    assert rv.status_code == 200
+    assert "Content-Encoding" not in rv.headers
+    assert rv.json == result
+
+    for accept_encoding in ("br, identity;q=0", "br, *;q=0", "gzip;q=0, *;q=0"):
+        rv = do_request(accept_encoding)
+        assert rv.status_code == 406
+        assert "Content-Encoding" not in rv.headers
@@ -5,179 +5,108 @@
 
 
 import threading
-from datetime import datetime, timedelta
-from unittest.mock import MagicMock, patch
 
-from bugbug_http.readthrough_cache import ReadthroughTTLCache
+import pytest
 
-time_change_event = threading.Event()
+from bugbug_http.readthrough_cache import ReadthroughLRUCache
 
 
-class MockDatetime:
-    def __init__(self, mock_now):
-        self.mock_now = mock_now
+def test_cache_loads_once():
+    loaded = []
 
-    def now(self):
-        return self.mock_now
+    def load(key):
+        loaded.append(key)
+        return f"payload_{key}"
 
-    def set_now(self, new_mock_now):
-        self.mock_now = new_mock_now
-        time_change_event.set()
+    cache = ReadthroughLRUCache(load)
 
+    assert cache.get("key_a") == "payload_key_a"
+    assert "key_a" in cache
+    assert cache.get("key_a") == "payload_key_a"
+    assert loaded == ["key_a"]
 
-class MockSleep:
-    def __init__(self, mock_datetime):
-        self.mock_datetime = mock_datetime
-        self.wakeups_count = 0
-
-        # count variable used to ensure that context switch into
-        # thread calling sleep occurred
-
-    def sleep(self, sleep_seconds):
-        self.wakeup_time = self.mock_datetime.now() + timedelta(seconds=sleep_seconds)
-        while self.mock_datetime.now() < self.wakeup_time:
-            time_change_event.wait()
-            time_change_event.clear()
-        self.wakeups_count += 1
-
-
-class PurgeCountCache(ReadthroughTTLCache):
-    def __init__(self, ttl, load_item_function):
-        super().__init__(ttl, load_item_function)
-        self.purge_count = 0
-
-        def purge_then_increment(purge):
-            purge()
-            self.purge_count += 1
-
-        super().purge_expired_entries = purge_then_increment(
-            super().purge_expired_entries
-        )
-
-
-def test_doesnt_cache_unless_accessed_within_ttl():
-    mockdatetime = MockDatetime(datetime(2019, 4, 1, 10))
-    cache = ReadthroughTTLCache(timedelta(hours=4), lambda x: "payload")
-
-    with patch("datetime.datetime", mockdatetime):
-        cache.get("key_a")
+    stats = cache.get_stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+    assert stats["loads"] == 1
+    assert stats["evictions"] == 0
 
-        # after one hour
-        mockdatetime.set_now(datetime(2019, 4, 1, 11))
-        assert "key_a" not in cache
 
-        # after two hours
-        mockdatetime.set_now(datetime(2019, 4, 1, 12))
-        cache.get("key_a")
+def test_cache_reloads_stale_items():
+    payloads = iter(["v1", "v2"])
+    cache = ReadthroughLRUCache(lambda key: next(payloads))
 
-        # after three hours
-        mockdatetime.set_now(datetime(2019, 4, 1, 13))
-        assert "key_a" in cache
+    assert cache.get("key_a") == "v1"
+    assert cache.get("key_a", is_stale=lambda item: item != "v1") == "v1"
+    assert cache.get("key_a", is_stale=lambda item: item == "v1") == "v2"
+    assert cache.get("key_a") == "v2"
+    assert len(cache) == 1
 
 
-def test_cache_purges_after_ttl():
-    mockdatetime = MockDatetime(datetime(2019, 4, 1, 10))
-    cache = ReadthroughTTLCache(timedelta(hours=2), lambda x: "payload")
+def test_cache_evicts_least_recently_used():
+    sizes = {"key_a": 4, "key_b": 4, "key_c": 4, "key_d": 20}
+    cache = ReadthroughLRUCache(lambda key: key, max_size=10, get_item_size=sizes.get)
 
-    with patch("datetime.datetime", mockdatetime):
-        cache.get("key_a", force_store=True)
+    cache.get("key_a")
+    cache.get("key_b")
+    assert cache.size == 8
 
-        # after one hour
-        mockdatetime.set_now(datetime(2019, 4, 1, 11))
-        cache.purge_expired_entries()
-        assert "key_a" in cache
+    # key_a was used more recently than key_b, so key_b is evicted.
+    cache.get("key_a")
+    cache.get("key_c")
+    assert "key_a" in cache
+    assert "key_b" not in cache
+    assert "key_c" in cache
+    assert cache.size == 8
 
-        # after two hours one minute
-        mockdatetime.set_now(datetime(2019, 4, 1, 12, 1))
-        cache.purge_expired_entries()
-        assert "key_a" not in cache
+    # An item larger than the budget is still kept.
+    cache.get("key_d")
+    assert [key for key, _ in cache.items()] == ["key_d"]
+    assert cache.size == 20
+    assert cache.get_stats()["evictions"] == 3
 
 
-def test_cache_ttl_refreshes_after_get():
-    mockdatetime = MockDatetime(datetime(2019, 4, 1, 10))
-    cache = ReadthroughTTLCache(timedelta(hours=2), lambda x: "payload")
+def test_cache_load_failure():
+    def load(key):
+        raise FileNotFoundError(key)
 
-    with patch("datetime.datetime", mockdatetime):
-        cache.get("key_a", force_store=True)
+    cache = ReadthroughLRUCache(load)
 
-        # after one hour
-        mockdatetime.set_now(datetime(2019, 4, 1, 11))
-        cache.purge_expired_entries()
-        assert "key_a" in cache
-        assert cache.get("key_a") == "payload"
+    for _ in range(2):
+        with pytest.raises(FileNotFoundError):
+            cache.get("key_a")
 
-        # after three hours
-        mockdatetime.set_now(datetime(2019, 4, 1, 13))
-        cache.purge_expired_entries()
-        assert "key_a" in cache
+    assert "key_a" not in cache
+    assert cache.get_stats()["load_failures"] == 2
 
-        # after three hours one minute
-        mockdatetime.set_now(datetime(2019, 4, 1, 13, 1))
-        cache.purge_expired_entries()
-        assert "key_a" not in cache
 
+def test_cache_single_flight():
+    loading = threading.Event()
+    release = threading.Event()
+    loaded = []
 
-def test_force_store():
-    def with_spied_storage(cache):
-        cache.storage_access_count = 0
-        cache_getitem = cache.items_storage.__getitem__
+    def load(key):
+        loaded.append(key)
+        loading.set()
+        release.wait()
+        return "payload"
 
-        def spy_getitem(key):
-            cache.storage_access_count += 1
-            return cache_getitem(key)
+    cache = ReadthroughLRUCache(load)
 
-        mock_items_storage = MagicMock()
-        mock_items_storage.__getitem__.side_effect = spy_getitem
-        mock_items_storage.__setitem__.side_effect = cache.items_storage.__setitem__
-        mock_items_storage.__contains__.side_effect = cache.items_storage.__contains__
-        cache.items_storage = mock_items_storage
-        return cache
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(cache.get("key_a")))
+        for _ in range(4)
+    ]
+    threads[0].start()
+    loading.wait()
+    for thread in threads[1:]:
+        thread.start()
 
-    cache = with_spied_storage(
-        ReadthroughTTLCache(timedelta(hours=2), lambda x: "payload")
-    )
-    cache.get("key_a", force_store=True)
+    release.set()
+    for thread in threads:
+        thread.join()
 
-    assert "key_a" in cache
-    assert cache.get("key_a") == "payload"
-    assert cache.storage_access_count == 1
-
-
-def test_cache_thread():
-    purged_event = threading.Event()
-
-    def cache_with_purge_count(cache):
-        cache.purge_count = 0
-        purge = cache.purge_expired_entries
-
-        def purge_then_increment():
-            purge()
-            cache.purge_count += 1
-            purged_event.set()
-
-        cache.purge_expired_entries = purge_then_increment
-        return cache
-
-    mockdatetime = MockDatetime(datetime(2019, 4, 1, 10))
-    cache = cache_with_purge_count(
-        ReadthroughTTLCache(timedelta(hours=2), lambda x: "payload")
-    )
-    mocksleep = MockSleep(mockdatetime)
-    with patch("datetime.datetime", mockdatetime):
-        with patch("time.sleep", mocksleep.sleep):
-            cache.get("key_a", force_store=True)
-            cache.start_ttl_thread()
-
-            # after one hour
-            mockdatetime.set_now(datetime(2019, 4, 1, 11))
-            assert cache.purge_count == 0
-            assert "key_a" in cache
-            assert mocksleep.wakeups_count == 0
-
-            # after two hours one minute
-            mockdatetime.set_now(datetime(2019, 4, 1, 12, 1))
-
-            purged_event.wait()
-            assert cache.purge_count == 1
-            assert "key_a" not in cache
-            assert mocksleep.wakeups_count == 1
+    assert results == ["payload"] * 4
+    assert loaded == ["key_a"]
+    assert cache.get_stats()["loads"] == 1
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import logging
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+import pytest
+
+from bugbug_http import worker
+
+
+@pytest.fixture
+def warm_worker(monkeypatch):
+    connection = MagicMock()
+    connection.connection_pool.connection_kwargs = {}
+    w = worker.WarmWorker(["default"], connection=connection)
+
+    monkeypatch.setattr(w, "prepare_execution", lambda job: None)
+    monkeypatch.setattr(w, "set_state", lambda state: None)
+    monkeypatch.setattr(worker.MODEL_CACHE, "refresh", lambda: [])
+    return w
+
+
+def set_rss(monkeypatch, rss):
+    process = SimpleNamespace(memory_info=lambda: SimpleNamespace(rss=rss))
+    monkeypatch.setattr(worker.psutil, "Process", lambda: process)
+
+
+def test_warm_worker_keeps_running(monkeypatch, warm_worker):
+    set_rss(monkeypatch, 2**30)
+    monkeypatch.setattr(warm_worker, "perform_job", lambda job, queue: True)
+
+    for _ in range(3):
+        warm_worker.execute_job(MagicMock(), MagicMock())
+
+    assert not warm_worker._stop_requested
+
+
+def test_warm_worker_stops_after_failure(monkeypatch, warm_worker):
+    set_rss(monkeypatch, 2**30)
+    monkeypatch.setattr(warm_worker, "perform_job", lambda job, queue: False)
+
+    warm_worker.execute_job(MagicMock(), MagicMock())
+
+    assert warm_worker._stop_requested
+
+
+def test_warm_worker_stops_over_memory_limit(monkeypatch, warm_worker):
+    monkeypatch.setattr(worker, "WARM_WORKER_MAX_MEMORY_MB", 512)
+    monkeypatch.setattr(warm_worker, "perform_job", lambda job, queue: True)
+
+    set_rss(monkeypatch, 256 * 2**20)
+    warm_worker.execute_job(MagicMock(), MagicMock())
+    assert not warm_worker._stop_requested
+
+    set_rss(monkeypatch, 1024 * 2**20)
+    warm_worker.execute_job(MagicMock(), MagicMock())
+    assert warm_worker._stop_requested
+
+
+def test_run_warm_workers_logs_crashes(monkeypatch, caplog):
+    class Exited(Exception):
+        pass
+
+    def exit(code):
+        raise Exited(code)
+
+    def crash(*args, **kwargs):
+        raise RuntimeError("Can't connect")
+
+    # Run the code of the child process in this one.
+    monkeypatch.setattr(worker.signal, "signal", lambda signum, handler: None)
+    monkeypatch.setattr(worker.os, "fork", lambda: 0)
+    monkeypatch.setattr(worker.os, "_exit", exit)
+    monkeypatch.setattr(worker, "WarmWorker", crash)
+
+    with caplog.at_level(logging.ERROR), pytest.raises(Exited) as e:
+        worker.run_warm_workers(["default"], MagicMock())
+
+    assert e.value.args == (1,)
+    assert "crashed" in caplog.text
+    assert "Can't connect" in caplog.text
@@ -29,7 +29,7 @@ def classify_bugs(model_name: str, bug_id: int) -> None:
             raise SystemExit(1)
 
     model_class = get_model_class(model_name)
-    model = model_class.load(model_file_name)
+    model = model_class.load_for_inference(model_file_name)
 
     if bug_id:
         bugs = bugzilla.get(bug_id).values()
@@ -5,6 +5,7 @@
 
 
 from bugbug.tools.code_review import PhabricatorReviewData, ReviewCommentsDB
+from bugbug.tools.code_review.database import EMBEDDINGS_CACHE_DIR
 from bugbug.vectordb import QdrantVectorDB
 
 
@@ -12,10 +13,14 @@ def main():
     review_data = PhabricatorReviewData()
     vector_db = QdrantVectorDB("diff_comments")
     vector_db.setup()
-    comments_db = ReviewCommentsDB(vector_db)
+    # Reuse the embeddings of the hunks already seen by previous runs.
+    comments_db = ReviewCommentsDB(
+        vector_db, embeddings_cache_path=EMBEDDINGS_CACHE_DIR
+    )
     # TODO: support resuming from where last run left off. We should run it from
     # scratch only once. Following runs should add only new comments.
     comments_db.add_comments_by_hunk(review_data.retrieve_comments_with_hunks())
+    comments_db.embeddings.close()
 
 
 if __name__ == "__main__":
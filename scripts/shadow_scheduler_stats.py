@@ -5,6 +5,7 @@
 
 import argparse
 import concurrent.futures
+import functools
 import logging
 import time
 import traceback
@@ -138,8 +139,9 @@ GROUP_TRANSLATIONS = {
 }
 
 
+@functools.lru_cache(maxsize=test_scheduling.RUNNABLE_CACHE_SIZE)
 def translate_group(group):
-    group = group.split(":")[0]
+    group = test_scheduling.rename_group(group)
 
     for prefix, value in GROUP_TRANSLATIONS.items():
         if group.startswith(prefix):
@@ -7,10 +7,12 @@ import argparse
 import concurrent.futures
 import math
 import os
+import time
 import traceback
 from datetime import datetime
+from functools import partial
 from logging import INFO, basicConfig, getLogger
-from typing import Any, Generator
+from typing import Any, Callable, Generator
 
 import dateutil.parser
 import mozci.errors
@@ -30,6 +32,34 @@ logger = getLogger(__name__)
 # and we can decide when we want to regenerate parts of the dataset.
 MOZCI_VERSION = 5
 
+# How often (in number of pushes) to checkpoint the test scheduling history generation.
+CHECKPOINT_INTERVAL = 5000
+
+
+class Checkpoint:
+    """Marker yielded while generating the history, when a checkpoint can be taken.
+
+    The history generated up to the checkpoint needs to be flushed to disk before
+    committing the checkpoint with the size of the history DB.
+    """
+
+    def __init__(self, commit: Callable[[int], None]) -> None:
+        self.commit = commit
+
+
+def log_phase_metrics(
+    phase: str, processed: int, start_time: float, total: int | None = None
+) -> None:
+    elapsed = time.monotonic() - start_time
+    logger.info(
+        "%s: processed %d%s pushes in %.1f seconds (%.1f pushes/s)",
+        phase,
+        processed,
+        f"/{total}" if total is not None else "",
+        elapsed,
+        processed / elapsed if elapsed > 0 else 0.0,
+    )
+
 
 class Retriever(object):
     def generate_push_data(
@@ -189,7 +219,11 @@ class Retriever(object):
         zstd_compress(push_data_db)
 
     def generate_test_scheduling_history(
-        self, granularity: str, training_months: int
+        self,
+        granularity: str,
+        training_months: int,
+        resume: bool = False,
+        checkpoint_interval: int = CHECKPOINT_INTERVAL,
     ) -> None:
         if granularity != "config_group":
             # Get the commits DB.
@@ -226,18 +260,61 @@ class Retriever(object):
             granularity
         )
 
-        if granularity in ("label", "config_group"):
+        # The checkpoint is stored in the past failures DB, so it is committed
+        # atomically with the past failures it refers to.
+        checkpoint = None
+        if resume and granularity != "config_group":
+            past_failures = test_scheduling.PastFailures(granularity, True)
+            checkpoint = past_failures.checkpoint
+            past_failures.close()
+
+            if checkpoint is not None and granularity == "group":
+                touched_together = test_scheduling.get_touched_together_db(True)
+                touched_together_index = (
+                    int(touched_together[b"checkpoint"])
+                    if b"checkpoint" in touched_together
+                    else None
+                )
+                test_scheduling.close_touched_together_db()
+
+                if touched_together_index != checkpoint["index"]:
+                    raise Exception(
+                        f"The touched together DB is at checkpoint {touched_together_index}, "
+                        f"the past failures DB at checkpoint {checkpoint['index']}: "
+                        "can't resume, the generation needs to restart from scratch"
+                    )
+
+            if checkpoint is not None:
+                logger.info(
+                    "Resuming from push %d (push number %d, %d bytes of history)",
+                    checkpoint["index"],
+                    checkpoint["push_num"],
+                    checkpoint["history_size"],
+                )
+                with open(test_scheduling_db, "ab") as f:
+                    f.truncate(checkpoint["history_size"])
+            else:
+                logger.info("No checkpoint found, starting from scratch")
+
+        if granularity in ("label", "config_group") and checkpoint is None:
+            phase_start = time.monotonic()
             test_scheduling.generate_failing_together_probabilities(
                 granularity, push_data_iter(), push_data_count
             )
+            log_phase_metrics("failing together", push_data_count, phase_start)
 
-        def generate_all_data() -> Generator[dict[str, Any], None, None]:
+        def generate_all_data() -> Generator[dict[str, Any] | Checkpoint, None, None]:
             past_failures = test_scheduling.PastFailures(granularity, False)
 
-            try:
-                push_num = past_failures.push_num
-            except KeyError:
-                push_num = 0
+            if checkpoint is not None:
+                push_num = checkpoint["push_num"]
+                start_index = checkpoint["index"]
+            else:
+                try:
+                    push_num = past_failures.push_num
+                except KeyError:
+                    push_num = 0
+                start_index = 0
 
             commit_map = {}
             for commit_data in tqdm(repository.get_commits()):
@@ -257,6 +334,30 @@ class Retriever(object):
                 update_touched_together_gen = test_scheduling.update_touched_together()
                 next(update_touched_together_gen)
 
+            phase_start = time.monotonic()
+
+            def commit_checkpoint(index: int, history_size: int) -> None:
+                past_failures.checkpoint = {
+                    "index": index,
+                    "push_num": push_num,
+                    "history_size": history_size,
+                }
+
+                # Commit touched together first: if we are interrupted before
+                # committing past failures, the checkpoint indexes won't match
+                # and we won't resume from an inconsistent state.
+                if granularity == "group":
+                    touched_together = test_scheduling.get_touched_together_db(False)
+                    touched_together[b"checkpoint"] = str(index).encode("ascii")
+                    touched_together.commit()
+
+                past_failures.commit()
+
+                log_phase_metrics(
+                    "history", index - start_index, phase_start, push_data_count
+                )
+                logger.info("Checkpoint at push %d (%d bytes)", index, history_size)
+
             for (
                 i,
                 (
@@ -267,6 +368,14 @@ class Retriever(object):
                     likely_regressions,
                 ),
             ) in enumerate(tqdm(push_data_iter(), total=push_data_count)):
+                if i < start_index:
+                    for revision in revisions:
+                        commit_map.pop(revision, None)
+                    continue
+
+                if i % checkpoint_interval == 0:
+                    yield Checkpoint(partial(commit_checkpoint, i))
+
                 push_num += 1
 
                 # XXX: Some commits are skipped in the repository mining, e.g. merges and backouts. Maybe we should not skip them.
@@ -336,22 +445,38 @@ class Retriever(object):
                     }
 
             if granularity == "group":
+                touched_together = test_scheduling.get_touched_together_db(False)
+                if b"checkpoint" in touched_together:
+                    del touched_together[b"checkpoint"]
                 try:
                     update_touched_together_gen.send(None)
                 except StopIteration:
                     pass
 
+            log_phase_metrics(
+                "history", push_data_count - start_index, phase_start, push_data_count
+            )
             logger.info("saved push data nodes: %d", len(saved_nodes))
             logger.info("skipped %d (no commits in our DB)", skipped_no_commits)
             logger.info("skipped %d (too big commits)", skipped_too_big_commits)
             logger.info("skipped %d (no interesting runnables)", skipped_no_runnables)
 
             past_failures.push_num = push_num
+            past_failures.checkpoint = None
             past_failures.close()
 
         # For the config/group granularity, we are only interested in the failing together DB.
         if granularity != "config_group":
-            db.append(test_scheduling_db, generate_all_data())
+            with open(test_scheduling_db, "ab") as history_f:
+                history = db.PickleStore(history_f)
+                for elem in generate_all_data():
+                    if isinstance(elem, Checkpoint):
+                        # Flush the history before recording its size in the checkpoint.
+                        history_f.flush()
+                        os.fsync(history_f.fileno())
+                        elem.commit(history_f.tell())
+                    else:
+                        history.write((elem,))
 
             zstd_compress(test_scheduling_db)
             create_tar_zst(past_failures_db)
@@ -387,6 +512,17 @@ def main():
         required=True,
         help="How many months of pushes to use for training.",
     )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Resume the generation from the last checkpoint of an interrupted run.",
+    )
+    parser.add_argument(
+        "--checkpoint-interval",
+        type=int,
+        default=CHECKPOINT_INTERVAL,
+        help="How often (in number of pushes) to checkpoint the generation.",
+    )
 
     args = parser.parse_args()
 
@@ -397,7 +533,10 @@ def main():
         )
     elif args.op == "generate":
         retriever.generate_test_scheduling_history(
-            args.granularity, args.training_months
+            args.granularity,
+            args.training_months,
+            args.resume,
+            args.checkpoint_interval,
         )
 
 
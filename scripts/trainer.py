@@ -38,7 +38,13 @@ class Trainer(object):
             logger.info("Skipping download of the databases")
 
         logger.info("Training *%s* model", model_name)
-        metrics = model_obj.train(limit=args.limit)
+        metrics = model_obj.train(
+            limit=args.limit,
+            extraction_jobs=args.extraction_jobs,
+            extraction_chunk_size=args.extraction_chunk_size,
+            streaming=args.streaming,
+            hashed_columns=args.hash_columns,
+        )
 
         # Save the metrics as a file that can be uploaded as an artifact.
         metric_file_path = "metrics.json"
@@ -82,6 +88,33 @@ def parse_args(args):
         dest="download_eval",
         help="Download databases and database support files required at runtime (e.g. if the model performs custom evaluations)",
     )
+    parser.add_argument(
+        "--extraction-jobs",
+        type=int,
+        help="Number of processes used to extract features (defaults to the number of physical CPUs)",
+    )
+    parser.add_argument(
+        "--extraction-chunk-size",
+        type=int,
+        default=256,
+        help="Number of items sent at once to each feature extraction process",
+    )
+    parser.add_argument(
+        "--streaming",
+        action="store_true",
+        help=(
+            "Vectorize the features as they are extracted, without holding them all in memory. "
+            "The vocabularies are then fitted once on all the training rows, including the "
+            "validation rows of the cross validation folds, so the cross validation scores "
+            "are not comparable with the ones of non-streaming trainings"
+        ),
+    )
+    parser.add_argument(
+        "--hash-columns",
+        nargs="*",
+        default=[],
+        help="Columns to vectorize with feature hashing (e.g. 'files' for wide file features)",
+    )
     parser.add_argument(
         "--lemmatization",
         help="Perform lemmatization (using spaCy)",
@@ -3,11 +3,16 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this file,
 # You can obtain one at http://mozilla.org/MPL/2.0/.
 
+import inspect
+import itertools
 import json
 import os
+import time
 
 import pytest
+from sklearn.pipeline import Pipeline
 
+from bugbug import bugzilla, feature_cache
 from bugbug.bug_features import (
     BlockedBugsNumber,
     BugExtractor,
@@ -30,6 +35,7 @@ from bugbug.bug_features import (
     Landings,
     Patches,
     Product,
+    ReporterExperience,
     Severity,
     Whiteboard,
 )
@@ -181,6 +187,81 @@ def test_BugExtractor():
         BugExtractor([HasSTR(), HasURL()], [fileref(), fileref()])
 
 
+def test_BugExtractor_parallel():
+    bugs = list(bugzilla.get_bugs())
+
+    extractor = BugExtractor(
+        [HasSTR(), Keywords(), ReporterExperience()], [fileref(), url()]
+    )
+    expected = extractor.transform(lambda: bugs)
+
+    extractor.set_params(n_jobs=2, chunk_size=3)
+    assert extractor.transform(lambda: bugs).equals(expected)
+
+
+def test_BugExtractor_feature_cache(monkeypatch):
+    bugs = list(itertools.islice(bugzilla.get_bugs(), 20))
+
+    extractor = BugExtractor([HasSTR(), Keywords(), Severity()], [fileref(), url()])
+    pipeline = Pipeline([("bug_extractor", extractor)])
+
+    expected = extractor.transform(lambda: bugs)
+
+    with feature_cache.enabled(pipeline, "test"):
+        assert extractor.transform(lambda: bugs).equals(expected)
+        assert extractor.feature_cache.misses == len(bugs)
+
+    assert not hasattr(extractor, "feature_cache")
+
+    # The second time around, the features are not extracted again.
+    monkeypatch.setattr(
+        HasSTR, "__call__", lambda *args, **kwargs: pytest.fail("Not cached")
+    )
+
+    with feature_cache.enabled(pipeline, "test"):
+        assert extractor.transform(lambda: bugs).equals(expected)
+        assert extractor.feature_cache.hits == len(bugs)
+
+    # A different configuration does not reuse the cache.
+    extractor.feature_extractors = [Keywords(), Severity()]
+    with feature_cache.enabled(pipeline, "test"):
+        extractor.transform(lambda: bugs)
+        assert extractor.feature_cache.hits == 0
+
+
+def test_feature_cache_fingerprint_source(monkeypatch):
+    extractor = BugExtractor([HasSTR(), Keywords()], [fileref()])
+    fingerprint = extractor.get_cache_fingerprint()
+    assert extractor.get_cache_fingerprint() == fingerprint
+
+    # Changing the code of the extractors invalidates the cache.
+    getsource = inspect.getsource
+    monkeypatch.setattr(
+        feature_cache.inspect,
+        "getsource",
+        lambda module: (
+            getsource(module)
+            + ("\n# changed" if module.__name__ == "bugbug.bug_features" else "")
+        ),
+    )
+    assert extractor.get_cache_fingerprint() != fingerprint
+
+
+def test_feature_cache_cleanup():
+    old_cache = feature_cache.FeatureCache("test", "0" * 64)
+    old_cache.close()
+    other_cache = feature_cache.FeatureCache("test", "1" * 64)
+    other_cache.close()
+
+    eight_days_ago = time.time() - 8 * 24 * 60 * 60
+    os.utime(old_cache.path, (eight_days_ago, eight_days_ago))
+
+    # Caches which are still in use by other configurations are kept.
+    feature_cache.FeatureCache("test", "2" * 64).close()
+    assert not os.path.exists(old_cache.path)
+    assert os.path.exists(other_cache.path)
+
+
 def test_BugTypes(read) -> None:
     read(
         "bug_types.json",
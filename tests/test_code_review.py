@@ -10,7 +10,12 @@ import httpx
 import pytest
 from unidiff import PatchSet
 
-from bugbug.tools.code_review import data_types, langchain_tools, review_context
+from bugbug.tools.code_review import (
+    data_types,
+    database,
+    langchain_tools,
+    review_context,
+)
 from bugbug.tools.code_review.data_types import (
     ExternalContent,
     GeneratedReviewComment,
@@ -45,11 +50,13 @@ from bugbug.tools.code_review.review_context_schema import (
     main as validate_review_context_main,
 )
 from bugbug.tools.code_review.utils import find_comment_scope
+from bugbug.tools.core.data_types import InlineComment
 from bugbug.tools.core.platforms.patch_apply import (
     apply_patched_file,
     get_file_after_stack,
     strip_diff_prefix,
 )
+from bugbug.vectordb import LocalVectorDB
 
 FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "fixtures/phabricator")
 
@@ -1436,3 +1443,174 @@ def test_generate_review_comments_no_repo_configured_or_known():
 
     fake_patch.github_repo_ref.assert_awaited_once()
     loader.assert_not_awaited()
+
+
+# ---------------------------------------------------------------------------
+# ReviewCommentsDB
+# ---------------------------------------------------------------------------
+
+
+class CountingEmbeddings:
+    def __init__(self):
+        self.calls = []
+
+    def embed_documents(self, texts):
+        self.calls.append(list(texts))
+        return [[float(len(text)), float(text.count("+")), 1.0] for text in texts]
+
+
+REVIEW_COMMENTS_DIFF = """diff --git a/a.py b/a.py
+--- a/a.py
++++ b/a.py
+@@ -1,2 +1,3 @@
+ import os
++import sys
+ import re
+@@ -10,2 +11,3 @@
+ def f():
++    return 1
+     pass
+"""
+
+
+def test_review_comments_db_embeddings_cache(tmp_path, monkeypatch):
+    embeddings = CountingEmbeddings()
+    monkeypatch.setattr(database, "init_embeddings", lambda model: embeddings)
+
+    vector_db = LocalVectorDB("comments", size=3, path=str(tmp_path / "comments"))
+    vector_db.setup()
+    comments_db = database.ReviewCommentsDB(
+        vector_db,
+        embeddings_cache_path=str(tmp_path / "embeddings"),
+        embeddings_batch_size=2,
+    )
+
+    hunks = [
+        hunk for patched_file in PatchSet(REVIEW_COMMENTS_DIFF) for hunk in patched_file
+    ]
+    items = [
+        (
+            hunk,
+            InlineComment(
+                filename="a.py",
+                start_line=1,
+                end_line=1,
+                content=f"Comment {i}",
+                on_removed_code=False,
+                id=i + 1,
+            ),
+        )
+        for i, hunk in enumerate(hunks * 2)
+    ]
+    comments_db.add_comments_by_hunk(items)
+
+    # The hunks are embedded in batches, and only once.
+    assert embeddings.calls == [[str(hunks[0]), str(hunks[1])]]
+    assert set(vector_db.get_existing_ids()) == {1, 2, 3, 4}
+
+    results = comments_db.find_similar_patch_comments(
+        SimpleNamespace(raw_diff=REVIEW_COMMENTS_DIFF), limit=4
+    )
+    assert sorted(result.id for result in results) == [1, 2, 3, 4]
+    assert len(embeddings.calls) == 1
+    assert comments_db.embeddings.hits == 4
+    assert comments_db.embeddings.misses == 2
+
+    # The embeddings are persisted.
+    comments_db.embeddings.close()
+    vector_db.close()
+    cached = database.CachedEmbeddings(
+        CountingEmbeddings(), database.EMBEDDINGS_MODEL, str(tmp_path / "embeddings")
+    )
+    assert cached.embed_query(str(hunks[1])) == [
+        float(len(str(hunks[1]))),
+        float(str(hunks[1]).count("+")),
+        1.0,
+    ]
+    assert cached.hits == 1
+    cached.close()
+
+
+def test_suggestions_feedback_db_find_similar_rejected_suggestions_many(
+    tmp_path, monkeypatch
+):
+    # An asymmetric model, whose query embeddings differ from its document
+    # embeddings.
+    class Embeddings:
+        def embed_query(self, text):
+            return [float(len(text)), 1.0]
+
+        def embed_documents(self, texts):
+            return [[1.0, float(len(text))] for text in texts]
+
+    monkeypatch.setattr(database, "init_embeddings", lambda model: Embeddings())
+
+    vector_db = LocalVectorDB("feedback", size=2, path=str(tmp_path / "feedback"))
+    vector_db.setup()
+    feedback_db = database.SuggestionsFeedbackDB(vector_db)
+    feedback_db.add_suggestions_feedback(
+        database.SuggestionFeedback(
+            id=i + 1,
+            comment="x" * (i + 1),
+            file_path="a.py",
+            action="REJECT" if i % 4 else "APPROVE",
+            user="user",
+        )
+        for i in range(40)
+    )
+
+    comments = ["x" * 10, "x" * 11, "x" * 30]
+    seen_ids = {12}
+    expected = []
+    for comment in comments:
+        suggestions = list(
+            feedback_db.find_similar_rejected_suggestions(
+                comment, limit=3, excluded_ids=seen_ids
+            )
+        )
+        seen_ids.update(suggestion.id for suggestion in suggestions)
+        expected.append(suggestions)
+
+    assert (
+        feedback_db.find_similar_rejected_suggestions_many(
+            comments, limit=3, excluded_ids={12}
+        )
+        == expected
+    )
+    assert all(len(suggestions) == 3 for suggestions in expected)
+    vector_db.close()
+
+
+def test_review_comments_db_embeddings_cache_in_memory(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, "init_embeddings", lambda model: CountingEmbeddings())
+
+    # Multiple instances can be used at the same time, as the embeddings are
+    # only persisted on request.
+    comments_dbs = [
+        database.ReviewCommentsDB(
+            LocalVectorDB("comments", size=3, path=str(tmp_path / f"comments{i}"))
+        )
+        for i in range(2)
+    ]
+    for comments_db in comments_dbs:
+        assert isinstance(comments_db.embeddings.db, dict)
+        comments_db.vector_db.close()
+    assert not os.path.exists(database.EMBEDDINGS_CACHE_DIR)
+
+
+def test_cached_embeddings_memory_cache_size():
+    embeddings = CountingEmbeddings()
+    cached = database.CachedEmbeddings(
+        embeddings, database.EMBEDDINGS_MODEL, memory_cache_size=2
+    )
+
+    cached.embed(["a", "b"])
+    cached.embed(["a", "c"])
+    assert embeddings.calls == [["a", "b"], ["c"]]
+
+    # The least recently used embedding was evicted.
+    assert list(cached.db) == [cached._key("a"), cached._key("c")]
+    cached.embed(["b"])
+    assert embeddings.calls[-1] == ["b"]
+    assert len(cached.db) == 2
+    cached.close()
@@ -5,7 +5,14 @@
 
 import pytest
 
-from bugbug.commit_features import AuthorExperience, CommitExtractor, ReviewersNum
+from bugbug import repository
+from bugbug.commit_features import (
+    AuthorExperience,
+    CommitExtractor,
+    Components,
+    ReviewersNum,
+    Types,
+)
 from bugbug.feature_cleanup import fileref, url
 
 
@@ -15,3 +22,14 @@ def test_CommitExtractor():
         CommitExtractor([ReviewersNum(), AuthorExperience()], [fileref(), fileref()])
     with pytest.raises(AssertionError):
         CommitExtractor([AuthorExperience(), AuthorExperience()], [fileref(), url()])
+
+
+def test_CommitExtractor_parallel():
+    commits = list(repository.get_commits())
+
+    extractor = CommitExtractor([Components(), Types()], [fileref(), url()])
+    expected = extractor.transform(lambda: commits)
+    assert len(expected) == len(commits)
+
+    extractor.set_params(n_jobs=2, chunk_size=3)
+    assert extractor.transform(lambda: commits).equals(expected)
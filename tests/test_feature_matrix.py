@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import pandas as pd
+import pytest
+from sklearn.base import clone
+from sklearn.compose import ColumnTransformer
+from sklearn.feature_extraction import DictVectorizer
+from sklearn.feature_extraction.text import CountVectorizer, TfidfVectorizer
+
+from bugbug import bugzilla, feature_matrix, utils
+from bugbug.models.defect import DefectModel
+
+ROWS = [
+    {
+        "data": {"Severity": "major", "Has STR": True, "a in Keywords": True},
+        "title": "Crash when opening a tab",
+        "files": ["dom/a.cpp", "dom/b.cpp"],
+    },
+    {
+        "data": {"Severity": "normal", "Comments": 3},
+        "title": "Tab is not opened",
+        "files": ["dom/a.cpp"],
+    },
+    {
+        "data": {"Severity": "major", "b in Keywords": True},
+        "title": "Crash when closing a window",
+        "files": ["gfx/c.cpp", "dom/b.cpp"],
+    },
+    {
+        "data": {},
+        "title": "Window crash",
+        "files": [],
+    },
+]
+
+
+def get_union() -> ColumnTransformer:
+    return ColumnTransformer(
+        [
+            ("data", DictVectorizer(), "data"),
+            ("title", TfidfVectorizer(min_df=2), "title"),
+            (
+                "files",
+                CountVectorizer(analyzer=utils.keep_as_is, lowercase=False, max_df=2),
+                "files",
+            ),
+        ]
+    )
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 100])
+def test_build_matrix(chunk_size: int) -> None:
+    expected_union = get_union()
+    expected = expected_union.fit_transform(pd.DataFrame(ROWS))
+
+    union = get_union()
+    assert feature_matrix.supports_incremental_fit(union)
+    X = feature_matrix.build_matrix(iter(ROWS), union, chunk_size=chunk_size)
+
+    assert X.shape == expected.shape
+    assert abs(X - expected).max() < 1e-12
+    assert list(union.get_feature_names_out()) == list(
+        expected_union.get_feature_names_out()
+    )
+
+    # The fitted union transforms new rows like a regularly fitted one.
+    new_rows = pd.DataFrame(ROWS[:2])
+    assert (
+        abs(union.transform(new_rows) - expected_union.transform(new_rows)).max()
+        < 1e-12
+    )
+
+    # It doesn't carry any trace of the incremental fitting.
+    assert [type(t) for _, t, _ in union.transformers_] == [
+        type(t) for _, t, _ in expected_union.transformers_
+    ]
+    clone(union)
+
+
+def test_hash_columns() -> None:
+    union = get_union()
+    feature_matrix.hash_columns(union, ["files"], n_features=16)
+    assert feature_matrix.supports_incremental_fit(union)
+
+    X = feature_matrix.build_matrix(iter(ROWS), union, chunk_size=3)
+    assert X.shape[0] == len(ROWS)
+    assert abs(X - union.transform(pd.DataFrame(ROWS))).max() < 1e-12
+    assert "files__hashed_15" in union.get_feature_names_out()
+
+    # Text can't be hashed as a list of tokens.
+    with pytest.raises(ValueError):
+        feature_matrix.hash_columns(get_union(), ["title"])
+
+
+def test_unsupported() -> None:
+    union = ColumnTransformer([("data", DictVectorizer(), ["data"])])
+    assert not feature_matrix.supports_incremental_fit(union)
+
+    union = ColumnTransformer(
+        [("title", CountVectorizer(vocabulary=["crash"]), "title")]
+    )
+    assert not feature_matrix.supports_incremental_fit(union)
+
+
+def test_build_matrix_fit_rows() -> None:
+    fit_rows = [0, 2]
+    expected_union = get_union()
+    expected_union.fit(pd.DataFrame([ROWS[i] for i in fit_rows]))
+    expected = expected_union.transform(pd.DataFrame(ROWS))
+
+    union = get_union()
+    X = feature_matrix.build_matrix(
+        iter(ROWS), union, chunk_size=3, get_fit_rows=lambda n_rows: fit_rows
+    )
+
+    assert X.shape == expected.shape
+    assert abs(X - expected).max() < 1e-12
+    assert list(union.get_feature_names_out()) == list(
+        expected_union.get_feature_names_out()
+    )
+
+
+class AlternatingDefectModel(DefectModel):
+    def get_labels(self):
+        return {bug["id"]: i % 2 for i, bug in enumerate(bugzilla.get_bugs())}, [0, 1]
+
+
+@pytest.mark.parametrize("streaming", [False, True])
+def test_train_hashed_columns(monkeypatch, streaming) -> None:
+    monkeypatch.setattr(feature_matrix, "HASHED_FEATURES", 64)
+
+    bugs = list(bugzilla.get_bugs())
+
+    model = AlternatingDefectModel()
+    model.feature_cache_enabled = False
+    tracking_metrics = model.train(streaming=streaming, hashed_columns=["data"])
+
+    # The cross validation scores of streaming trainings are labeled, as the
+    # features are fitted on the validation folds too.
+    assert tracking_metrics["test_accuracy"]["streaming"] == streaming
+
+    union = model.clf.named_steps["union"]
+    assert isinstance(union.named_transformers_["data"], feature_matrix.HashedFeatures)
+    feature_names = model.get_human_readable_feature_names()
+    assert "hashed_0" in feature_names
+    assert (
+        len(feature_names)
+        == union.transform(model.extraction_pipeline.transform(lambda: bugs[:2])).shape[
+            1
+        ]
+    )
@@ -3,6 +3,7 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this file,
 # You can obtain one at http://mozilla.org/MPL/2.0/.
 
+import os
 from logging import INFO, basicConfig, getLogger
 
 from bugbug import model
@@ -32,3 +33,28 @@ def test_component_is_bugmodel():
 def test_backout_is_commitmodel():
     model_class = get_model_class("backout")
     assert issubclass(model_class, model.CommitModel)
+
+
+def test_load_for_inference(tmp_path):
+    from bugbug import bugzilla
+    from bugbug.models.defect import DefectModel
+
+    bugs = list(bugzilla.get_bugs())
+    defect_model = DefectModel()
+    X = defect_model.extraction_pipeline.transform(lambda: bugs)
+    y = [i % 2 for i in range(len(bugs))]
+    defect_model.le.fit(y)
+    defect_model.clf.fit(X, y)
+
+    model_directory = str(tmp_path / "defectmodel")
+    os.makedirs(model_directory)
+    defect_model.save_inference(model_directory)
+
+    loaded = model.Model.load_for_inference(model_directory)
+    assert isinstance(loaded, DefectModel)
+    assert not hasattr(loaded, "training_dbs")
+    assert "sampler" not in loaded.clf.named_steps
+    assert (
+        loaded.classify(bugs[:3], probabilities=True)
+        == defect_model.classify(bugs[:3], probabilities=True)
+    ).all()
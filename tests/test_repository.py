@@ -2963,3 +2963,83 @@ new file mode 100644
     assert commits[0].desc == "First commit message"
     assert commits[1].desc == "Second commit message"
     assert commits[2].desc == "Third commit message"
+
+
+def test_open_hg_persistent(fake_hg_repo):
+    hg, local, _ = fake_hg_repo
+
+    with repository.open_hg(local) as hg1:
+        pass
+    with repository.open_hg(local) as hg2:
+        pass
+    assert hg1 is not hg2
+
+    repository.enable_persistent_servers()
+    try:
+        with repository.open_hg(local) as hg1:
+            pass
+        with repository.open_hg(local) as hg2:
+            # The pooled server sees the commits made by other processes.
+            add_file(hg, local, "file1", "1\n")
+            revision = commit(hg)
+            assert hg2.log(revision)[0].node.decode("ascii") == revision
+        assert hg1 is hg2
+
+        # A server used by a failed call isn't reused.
+        with pytest.raises(RuntimeError):
+            with repository.open_hg(local) as hg3:
+                raise RuntimeError
+        assert hg3 is hg2
+        with repository.open_hg(local) as hg4:
+            pass
+        assert hg4 is not hg3
+    finally:
+        repository.close_persistent_servers()
+
+    assert not repository.persistent_servers
+    assert not repository.hg_server_pool
+
+
+def test_get_code_analysis_server_persistent(monkeypatch):
+    class FakeServer:
+        def __init__(self, thread_num=None):
+            self.alive = True
+
+        def ping(self):
+            return self.alive
+
+        def terminate(self):
+            self.alive = False
+
+    monkeypatch.setattr(rust_code_analysis_server, "RustCodeAnalysisServer", FakeServer)
+
+    repository.enable_persistent_servers()
+    try:
+        server = repository.get_code_analysis_server(1)
+        repository.release_code_analysis_server(server)
+        assert server.alive
+        assert repository.get_code_analysis_server(1) is server
+
+        # A forked process reuses the running server of its parent.
+        pid = os.getpid()
+        monkeypatch.setattr(os, "getpid", lambda: pid + 1)
+        assert repository.get_code_analysis_server(1) is server
+
+        # When the server of the parent is not running, the forked process
+        # terminates the one it started once it is done with it.
+        server.terminate()
+        horse_server = repository.get_code_analysis_server(1)
+        assert horse_server is not server
+        repository.release_code_analysis_server(horse_server)
+        assert not horse_server.alive
+
+        monkeypatch.setattr(os, "getpid", lambda: pid)
+        new_server = repository.get_code_analysis_server(1)
+        assert new_server is not horse_server
+        repository.release_code_analysis_server(new_server)
+        assert new_server.alive
+    finally:
+        repository.close_persistent_servers()
+
+    assert not new_server.alive
+    assert not repository.persistent_code_analysis_servers
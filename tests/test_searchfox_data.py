@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import json
+import os
+
+import pytest
+
+from bugbug.code_search import searchfox_data
+
+SYM = "_ZN7mozilla3gfx31CreateDataSourceSurfaceFromDataEv"
+# Mangled template symbols can be longer than the maximum size of LMDB keys.
+LONG_SYM = "_ZN7mozilla6detail" + "5TupleIJNS_6MaybeIiEE" * 40 + "Ev"
+LONG_NAME = "mozilla::detail::" + "Tuple<Maybe<int>>::" * 40 + "Apply"
+
+
+@pytest.fixture
+def searchfox_path(tmp_path):
+    def write(path, objs):
+        full_path = tmp_path / path
+        full_path.parent.mkdir(parents=True, exist_ok=True)
+        full_path.write_text("".join(json.dumps(obj) + "\n" for obj in objs))
+
+    write(
+        "gfx/2d/DataSurfaceHelpers.h",
+        [
+            {
+                "loc": "00010:36-67",
+                "syntax": "decl,function",
+                "pretty": "function mozilla::gfx::CreateDataSourceSurfaceFromData",
+                "sym": SYM,
+            },
+            {
+                "loc": "00020:10-15",
+                "syntax": "def,field",
+                "pretty": "field mozilla::gfx::Surface::mSize",
+                "sym": "F_mSize",
+            },
+        ],
+    )
+    write(
+        "gfx/2d/DataSurfaceHelpers.cpp",
+        [
+            {
+                "loc": "00005:5-10",
+                "syntax": "def,function",
+                "pretty": "function mozilla::gfx::Other",
+                "sym": "_Other",
+                "nestingRange": "5:12-20:0",
+            },
+            {
+                "loc": "00030:10-20",
+                "syntax": "use,function",
+                "pretty": "function mozilla::gfx::Other",
+                "sym": "_Other",
+            },
+            {
+                "loc": "00037:36-67",
+                "source": 1,
+                "nestingRange": "39:25-56:0",
+                "syntax": "def,function",
+                "pretty": "function mozilla::gfx::CreateDataSourceSurfaceFromData",
+                "sym": SYM,
+            },
+        ],
+    )
+    write(
+        "mfbt/Tuple.cpp",
+        [
+            {
+                "loc": "00003:5-10",
+                "syntax": "def,function",
+                "pretty": f"function {LONG_NAME}",
+                "sym": LONG_SYM,
+            },
+        ],
+    )
+    write(
+        "widget/gtk/nsWindow.cpp",
+        [
+            {
+                "loc": "00100:5-10",
+                "syntax": "def,function",
+                "pretty": "method nsWindow::CreateDataSourceSurfaceFromData",
+                "sym": "_nsWindow_Create",
+            },
+        ],
+    )
+    yield str(tmp_path)
+
+    for index in searchfox_data._symbol_indexes.values():
+        index.close()
+    searchfox_data._symbol_indexes.clear()
+
+
+def test_find_symbol_definition(searchfox_path):
+    result = searchfox_data.find_symbol_definition(
+        searchfox_path, [SYM, "missing"], target_sym_type_restriction="function"
+    )
+    assert result == {
+        SYM: [
+            {
+                "name": "function mozilla::gfx::CreateDataSourceSurfaceFromData",
+                "file": os.path.join(searchfox_path, "gfx/2d/DataSurfaceHelpers.cpp"),
+                "target_line": 37,
+                "target_end_line": 56,
+            }
+        ]
+    }
+
+    result = searchfox_data.find_symbol_definition(
+        searchfox_path,
+        ["F_mSize"],
+        headers_first=True,
+        target_sym_type_restriction="field",
+    )
+    assert result["F_mSize"][0]["target_line"] == 20
+    assert result["F_mSize"][0]["target_end_line"] is None
+
+    assert not searchfox_data.find_symbol_definition(
+        searchfox_path, ["F_mSize"], target_sym_type_restriction="function"
+    )
+
+
+def test_find_symbol_definition_pretty(searchfox_path):
+    result = searchfox_data.find_symbol_definition(
+        searchfox_path,
+        ["CreateDataSourceSurfaceFromData", "gfx::CreateDataSourceSurfaceFromData"],
+        target_sym_is_pretty=True,
+        target_sym_type_restriction="function",
+    )
+    assert [
+        (definition["file"], definition["target_line"])
+        for definition in result["CreateDataSourceSurfaceFromData"]
+    ] == [
+        (os.path.join(searchfox_path, "gfx/2d/DataSurfaceHelpers.cpp"), 37),
+        (os.path.join(searchfox_path, "widget/gtk/nsWindow.cpp"), 100),
+    ]
+    assert [
+        definition["target_line"]
+        for definition in result["gfx::CreateDataSourceSurfaceFromData"]
+    ] == [37]
+
+    # Partial components of names don't match.
+    assert not searchfox_data.find_symbol_definition(
+        searchfox_path, ["DataSourceSurface"], target_sym_is_pretty=True
+    )
+
+
+def test_find_long_symbol_definition(searchfox_path):
+    assert len(LONG_SYM) > 511
+
+    result = searchfox_data.find_symbol_definition(searchfox_path, [LONG_SYM])
+    assert result[LONG_SYM][0]["name"] == f"function {LONG_NAME}"
+    assert result[LONG_SYM][0]["target_line"] == 3
+
+    result = searchfox_data.find_symbol_definition(
+        searchfox_path, [LONG_NAME], target_sym_is_pretty=True
+    )
+    assert result[LONG_NAME][0]["target_line"] == 3
+
+
+def test_find_symbol_definition_for_line(searchfox_path):
+    path = "gfx/2d/DataSurfaceHelpers.cpp"
+    assert (
+        searchfox_data.find_symbol_definition_for_line(path, 1, searchfox_path) is None
+    )
+    assert searchfox_data.find_symbol_definition_for_line(path, 5, searchfox_path) == {
+        "name": "function mozilla::gfx::Other",
+        "file": path,
+        "target_line": 5,
+        "target_end_line": 20,
+    }
+    for line in (37, 40, 1000):
+        definition = searchfox_data.find_symbol_definition_for_line(
+            path, line, searchfox_path
+        )
+        assert definition["target_line"] == 37
+
+    assert (
+        searchfox_data.find_symbol_definition_for_line(
+            "gfx/2d/DataSurfaceHelpers.h", 15, searchfox_path
+        )
+        is None
+    )
+    assert (
+        searchfox_data.find_symbol_definition_for_line("missing.cpp", 5, searchfox_path)
+        is None
+    )
+
+
+def test_symbol_index_is_reused(searchfox_path):
+    index = searchfox_data.get_symbol_index(searchfox_path)
+    assert searchfox_data.get_symbol_index(searchfox_path) is index
+    assert os.path.exists(os.path.join(searchfox_path, searchfox_data.SYMBOL_INDEX_DIR))
+
+    # The index built on disk is reused by new processes.
+    index.close()
+    searchfox_data._symbol_indexes.clear()
+    os.remove(os.path.join(searchfox_path, "widget/gtk/nsWindow.cpp"))
+    result = searchfox_data.find_symbol_definition(
+        searchfox_path, ["_nsWindow_Create"], target_sym_type_restriction="function"
+    )
+    assert result["_nsWindow_Create"][0]["target_line"] == 100
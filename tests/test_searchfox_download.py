@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import json
+import os
+import zipfile
+
+import pytest
+
+from bugbug.code_search import searchfox_download
+
+DEFINITION = {
+    "loc": "00037:36-67",
+    "source": 1,
+    "nestingRange": "39:25-56:0",
+    "syntax": "def,function",
+    "type": "void ()",
+    "pretty": "function mozilla::gfx::Create",
+    "sym": "_ZN7mozilla3gfx6CreateEv",
+}
+SOURCE = {"loc": "00001:0-5", "source": 1, "pretty": "namespace mozilla"}
+
+
+@pytest.mark.parametrize("processes", [1, 2])
+def test_extract(tmp_path, monkeypatch, processes):
+    monkeypatch.setattr(searchfox_download, "EXTRACT_BATCH_SIZE", 1)
+
+    zip_path = tmp_path / "searchfox.zip"
+    with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("gfx/2d/", "")
+        zf.writestr(
+            "gfx/2d/Create.cpp",
+            "".join(json.dumps(obj) + "\n" for obj in (SOURCE, DEFINITION)),
+        )
+        zf.writestr("gfx/2d/Empty.h", json.dumps(SOURCE) + "\n")
+        zf.writestr("dom/base/Element.js", json.dumps(DEFINITION) + "\n")
+        zf.writestr("../outside.cpp", json.dumps(DEFINITION) + "\n")
+
+    target_path = tmp_path / "data"
+    searchfox_download.extract(str(zip_path), str(target_path), processes=processes)
+
+    with open(target_path / "gfx/2d/Create.cpp") as f:
+        assert [json.loads(line) for line in f] == [
+            {
+                "loc": "00037:36-67",
+                "syntax": "def,function",
+                "pretty": "function mozilla::gfx::Create",
+                "sym": "_ZN7mozilla3gfx6CreateEv",
+                "nestingRange": "39:25-56:0",
+            }
+        ]
+    assert (target_path / "gfx/2d/Empty.h").read_text() == ""
+    assert not os.path.exists(target_path / "dom/base/Element.js")
+    assert not os.path.exists(tmp_path / "outside.cpp")
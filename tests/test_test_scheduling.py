@@ -3,12 +3,13 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this file,
 # You can obtain one at http://mozilla.org/MPL/2.0/.
 
+import os
 from datetime import datetime
 
 import pytest
 from _pytest.monkeypatch import MonkeyPatch
 
-from bugbug import repository, test_scheduling
+from bugbug import db, repository, test_scheduling
 from bugbug.repository import CommitDict
 from bugbug.test_scheduling import ConfigGroup, Group, Revision, Task
 from bugbug.utils import ExpQueue
@@ -86,6 +87,150 @@ def test_rename_runnables() -> None:
     )
 
 
+def test_filter_runnables() -> None:
+    all_runnables = {
+        "test-linux1804-64/opt-mochitest-1",
+        "test-linux1804-64/opt-talos-g1",
+        "build-linux64/opt",
+        "source-test-python-mozbase",
+    }
+    tasks = (
+        "test-linux1804-64/opt-mochitest-1",
+        "test-linux1804-64/opt-talos-g1",
+        "build-linux64/opt",
+        "source-test-python-mozbase",
+        "test-windows10-64/opt-mochitest-1",
+    )
+
+    # Run twice, to cover both uncached and cached decisions.
+    for _ in range(2):
+        assert test_scheduling.filter_runnables(tasks, all_runnables, "label") == (
+            "test-linux1804-64/opt-mochitest-1",
+            "build-linux64/opt",
+        )
+
+    assert test_scheduling.filter_runnables(
+        (Group("dom/a.ini"), Group("dom/b.ini")), {Group("dom/b.ini")}, "group"
+    ) == (Group("dom/b.ini"),)
+
+
+def test_get_push_data(monkeypatch: MonkeyPatch) -> None:
+    monkeypatch.setattr(db, "download", lambda path: True)
+
+    db.write(
+        test_scheduling.PUSH_DATA_LABEL_DB,
+        [
+            (
+                ["rev1"],
+                None,
+                [
+                    "test-linux64-shippable/opt-mochitest-1",
+                    "test-linux64-shippable/opt-talos-1",
+                    "test-windows10/opt-mochitest-1",
+                ],
+                [],
+                ["test-linux1804-64/opt-mochitest-1"],
+            ),
+            (
+                ["rev2", "rev3"],
+                "rev4",
+                [
+                    "test-linux1804-64/opt-mochitest-1",
+                    "test-windows10/opt-mochitest-1",
+                    "test-windows10/opt-xpcshell-1",
+                ],
+                ["test-windows10/opt-xpcshell-1"],
+                [],
+            ),
+        ],
+    )
+
+    push_data_iter, push_data_count, all_runnables = test_scheduling.get_push_data(
+        "label"
+    )
+
+    assert push_data_count == 2
+    assert set(all_runnables) == {
+        "test-linux1804-64/opt-mochitest-1",
+        "test-windows10/opt-mochitest-1",
+        "test-windows10/opt-xpcshell-1",
+    }
+    expected = [
+        (
+            ("rev1",),
+            None,
+            ("test-linux1804-64/opt-mochitest-1", "test-windows10/opt-mochitest-1"),
+            (),
+            ("test-linux1804-64/opt-mochitest-1",),
+        ),
+        (
+            ("rev2", "rev3"),
+            "rev4",
+            (
+                "test-linux1804-64/opt-mochitest-1",
+                "test-windows10/opt-mochitest-1",
+                "test-windows10/opt-xpcshell-1",
+            ),
+            ("test-windows10/opt-xpcshell-1",),
+            (),
+        ),
+    ]
+    assert list(push_data_iter()) == expected
+    # The iterator can be consumed multiple times.
+    assert list(push_data_iter()) == expected
+
+    # The binary push data is reused when it is up to date.
+    binary_path = test_scheduling.get_push_data_binary_path(
+        test_scheduling.PUSH_DATA_LABEL_DB
+    )
+    mtime = os.path.getmtime(binary_path)
+    push_data_iter, push_data_count, _ = test_scheduling.get_push_data("label")
+    assert os.path.getmtime(binary_path) == mtime
+    assert list(push_data_iter()) == expected
+
+
+def test_get_push_data_config_group(monkeypatch: MonkeyPatch) -> None:
+    monkeypatch.setattr(db, "download", lambda path: True)
+
+    db.write(
+        test_scheduling.PUSH_DATA_CONFIG_GROUP_DB,
+        [
+            (
+                ["rev1"],
+                "",
+                [
+                    ["test-linux64-shippable/opt-*", "dom/mochitest.toml:dom/a.toml"],
+                    ["test-windows10/opt-*", "dom/mochitest.toml"],
+                ],
+                [["test-windows10/opt-*", "dom/mochitest.toml"]],
+                [],
+            ),
+        ],
+    )
+
+    push_data_iter, push_data_count, all_runnables = test_scheduling.get_push_data(
+        "config_group"
+    )
+
+    assert push_data_count == 1
+    assert set(all_runnables) == {
+        ("test-linux1804-64/opt-*", "dom/mochitest.toml"),
+        ("test-windows10/opt-*", "dom/mochitest.toml"),
+    }
+    assert list(push_data_iter()) == [
+        (
+            ("rev1",),
+            "",
+            (
+                ("test-linux1804-64/opt-*", "dom/mochitest.toml"),
+                ("test-windows10/opt-*", "dom/mochitest.toml"),
+            ),
+            (("test-windows10/opt-*", "dom/mochitest.toml"),),
+            (),
+        )
+    ]
+
+
 def test_touched_together(monkeypatch: MonkeyPatch) -> None:
     test_scheduling.touched_together = None
 
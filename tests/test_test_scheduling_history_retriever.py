@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import multiprocessing as mp
+import os
+import pickle
+import shutil
+
+import pytest
+
+from bugbug import db, repository, test_scheduling
+from bugbug.utils import LMDBDict
+from scripts import test_scheduling_history_retriever
+
+RUNNABLES = [
+    "test-linux1804-64/opt-mochitest-1",
+    "test-linux1804-64/debug-mochitest-1",
+    "test-windows10-64/opt-xpcshell-2",
+]
+
+
+def make_commit(i: int) -> repository.CommitDict:
+    sizes = {
+        name.format(kind): 0
+        for kind in ("source_code", "other", "test")
+        for name in (
+            "{}_files_modified_num",
+            "{}_added",
+            "{}_deleted",
+            "total_{}_file_size",
+            "maximum_{}_file_size",
+            "minimum_{}_file_size",
+        )
+    }
+    return repository.CommitDict(
+        {
+            **sizes,
+            "node": f"rev{i}",
+            "desc": f"Bug {i} - Change",
+            "author_email": "author@mozilla.com",
+            "pushdate": "2100-01-01 00:00:00",
+            "types": [".js"] if i % 2 == 0 else [".cpp"],
+            "files": [f"dom/file{i % 3}.cpp"],
+            "directories": ["dom"],
+            "components": ["Core::DOM"],
+            "reviewers": [],
+            "metrics": repository.get_metrics_dict(),
+        }
+    )
+
+
+def get_outputs() -> tuple[list, dict[bytes, bytes]]:
+    history = list(db.read(test_scheduling.TEST_LABEL_SCHEDULING_DB))
+    past_failures = LMDBDict(
+        os.path.join("data", test_scheduling.PAST_FAILURES_LABEL_DB)[
+            : -len(".tar.zst")
+        ],
+        readonly=True,
+    )
+    past_failures_data = {
+        key: bytes(past_failures[key]) for key in past_failures.keys()
+    }
+    past_failures.close()
+    return history, past_failures_data
+
+
+def test_generate_test_scheduling_history_resume(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    push_data = [
+        (
+            [f"rev{i}"],
+            None,
+            RUNNABLES,
+            RUNNABLES[i % 3 : i % 3 + 1] if i % 2 == 0 else [],
+            [],
+        )
+        for i in range(14)
+    ]
+    monkeypatch.setattr(db, "download", lambda path: True)
+    monkeypatch.setattr(
+        repository, "get_commits", lambda: [make_commit(i) for i in range(14)]
+    )
+    monkeypatch.setattr(
+        test_scheduling,
+        "get_push_data",
+        lambda granularity: (lambda: iter(push_data), len(push_data), RUNNABLES),
+    )
+    monkeypatch.setattr(
+        test_scheduling,
+        "generate_failing_together_probabilities",
+        lambda *args: None,
+    )
+    monkeypatch.setattr(
+        test_scheduling_history_retriever, "zstd_compress", lambda path: None
+    )
+    monkeypatch.setattr(
+        test_scheduling_history_retriever, "create_tar_zst", lambda path: None
+    )
+
+    retriever = test_scheduling_history_retriever.Retriever()
+    retriever.generate_test_scheduling_history("label", 1, checkpoint_interval=4)
+    expected_history, expected_past_failures = get_outputs()
+    assert len(expected_history) == 14
+    assert b"checkpoint" not in expected_past_failures
+
+    os.remove(test_scheduling.TEST_LABEL_SCHEDULING_DB)
+    shutil.rmtree(
+        os.path.join("data", test_scheduling.PAST_FAILURES_LABEL_DB)[: -len(".tar.zst")]
+    )
+
+    # Kill the generation at push 10, after the checkpoint at push 8 was
+    # taken, without committing what was generated after it.
+    generate_data = test_scheduling.generate_data
+
+    def interrupted_generate_data(granularity, past_failures, commit, *args):
+        if commit["nodes"] == ["rev10"]:
+            os._exit(1)
+        return generate_data(granularity, past_failures, commit, *args)
+
+    def interrupted_run() -> None:
+        monkeypatch.setattr(test_scheduling, "generate_data", interrupted_generate_data)
+        retriever.generate_test_scheduling_history("label", 1, checkpoint_interval=4)
+
+    process = mp.get_context("fork").Process(target=interrupted_run)
+    process.start()
+    process.join()
+    assert process.exitcode == 1
+
+    history, past_failures_data = get_outputs()
+    assert history[:8] == expected_history[:8]
+    assert pickle.loads(past_failures_data[b"checkpoint"])["index"] == 8
+
+    retriever.generate_test_scheduling_history(
+        "label", 1, resume=True, checkpoint_interval=4
+    )
+    assert get_outputs() == (expected_history, expected_past_failures)
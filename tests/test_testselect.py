@@ -13,7 +13,7 @@ import hypothesis.strategies as st
 import pytest
 from igraph import Graph
 
-from bugbug import test_scheduling
+from bugbug import repository, test_scheduling
 from bugbug.models import testselect
 from bugbug.utils import LMDBDict
 
@@ -557,6 +557,99 @@ def test_reduce14(failing_together: LMDBDict) -> None:
     )
 
 
+def test_reduce_cached(monkeypatch: pytest.MonkeyPatch) -> None:
+    failing_together = test_scheduling.get_failing_together_db("label", False)
+    failing_together[b"windows10/opt-a"] = pickle.dumps(
+        {
+            "windows10/opt-b": (0.1, 1.0),
+        }
+    )
+    test_scheduling.close_failing_together_db("label")
+
+    solve_count = 0
+    solve_optimization = testselect._solve_optimization
+
+    def mock_solve_optimization(solver):
+        nonlocal solve_count
+        solve_count += 1
+        return solve_optimization(solver)
+
+    monkeypatch.setattr(testselect, "_solve_optimization", mock_solve_optimization)
+
+    tasks = ["windows10/opt-a", "windows10/opt-b", "windows10/opt-c"]
+    result = testselect.reduce_configs(tasks, 1.0)
+    assert result == {"windows10/opt-a", "windows10/opt-c"} or result == {
+        "windows10/opt-b",
+        "windows10/opt-c",
+    }
+    assert solve_count == 1
+
+    # The same request, in a different order, is served from the cache.
+    result.add("windows10/opt-z")
+    assert testselect.reduce_configs(list(reversed(tasks)), 1.0) == result - {
+        "windows10/opt-z"
+    }
+    assert solve_count == 1
+
+    # Different thresholds are solved again.
+    assert testselect.reduce_configs(tasks, 0.5) != {}
+    assert solve_count == 2
+
+    # When the DB changes, the cache is not used.
+    test_scheduling.close_failing_together_db("label")
+    test_scheduling.remove_failing_together_db("label")
+    failing_together = test_scheduling.get_failing_together_db("label", False)
+    failing_together[b"windows10/opt-a"] = pickle.dumps({})
+    test_scheduling.close_failing_together_db("label")
+
+    assert testselect.reduce_configs(tasks, 1.0) == set(tasks)
+    assert solve_count == 3
+
+    test_scheduling.close_failing_together_db("label")
+
+
+def test_get_equivalence_sets_cached(monkeypatch: pytest.MonkeyPatch) -> None:
+    version = (1, 1)
+    loads = []
+
+    def load_equivalence_sets(min_redundancy_confidence):
+        loads.append((min_redundancy_confidence, version))
+        return {"group": min_redundancy_confidence}
+
+    monkeypatch.setattr(testselect, "_equivalence_sets", {})
+    monkeypatch.setattr(testselect, "_load_equivalence_sets", load_equivalence_sets)
+    monkeypatch.setattr(
+        test_scheduling, "get_failing_together_version", lambda granularity: version
+    )
+
+    # Alternating confidences don't evict each other.
+    for _ in range(2):
+        assert testselect._get_equivalence_sets(0.9) == {"group": 0.9}
+        assert testselect._get_equivalence_sets(1.0) == {"group": 1.0}
+    assert loads == [(0.9, (1, 1)), (1.0, (1, 1))]
+
+    # The equivalence sets of older versions of the DB are dropped.
+    version = (1, 2)
+    assert testselect._get_equivalence_sets(0.9) == {"group": 0.9}
+    assert loads[-1] == (0.9, (1, 2))
+    assert list(testselect._equivalence_sets) == [(0.9, (1, 2))]
+
+
+def test_greedy_cover() -> None:
+    costs = {"a": 1, "b": 5, "c": 1, "d": 1}
+
+    assert testselect._greedy_cover([], costs.__getitem__) == set()
+    assert testselect._greedy_cover([{"a", "b"}, {"c"}], costs.__getitem__) == {
+        "a",
+        "c",
+    }
+    # "b" covers all sets, with a lower cost per set than the others.
+    costs["b"] = 2
+    assert testselect._greedy_cover(
+        [{"a", "b"}, {"b", "c"}, {"b", "d"}, {"b"}], costs.__getitem__
+    ) == {"b"}
+
+
 @st.composite
 def equivalence_graph(draw) -> Graph:
     NODES = 7
@@ -793,3 +886,127 @@ def test_select_configs(failing_together_config_group: LMDBDict) -> None:
     assert len(result) == 2
     assert set(result["group1"]) == all_configs
     assert set(result["group2"]) == {"linux2404-64/opt", "linux2404-64/debug"}
+
+
+RUNNABLES = [
+    "test-linux1804-64/opt-mochitest-1",
+    "test-linux1804-64/debug-mochitest-1",
+    "test-windows10-64/opt-xpcshell-2",
+    "test-windows10-64/debug-reftest-3",
+]
+
+
+def make_commit(i: int) -> dict:
+    sizes = {
+        name.format(kind): 0
+        for kind in ("source_code", "other", "test")
+        for name in (
+            "{}_files_modified_num",
+            "{}_added",
+            "{}_deleted",
+            "total_{}_file_size",
+            "maximum_{}_file_size",
+            "minimum_{}_file_size",
+        )
+    }
+    return {
+        **sizes,
+        "node": f"rev{i}",
+        "desc": f"Bug {i} - Change",
+        "pushdate": "2019-01-01 00:00:00",
+        "types": [".js"] if i % 2 == 0 else [".cpp"],
+        "files": [f"dom/file{i % 2}.cpp"],
+        "directories": ["dom"],
+        "components": ["Core::DOM"],
+        "reviewers": [],
+        "metrics": repository.get_metrics_dict(),
+    }
+
+
+def test_evaluation_selection(monkeypatch: pytest.MonkeyPatch) -> None:
+    # The runnables with a mochitest fail when .js files are touched.
+    def get_failures(i: int) -> list[str]:
+        return RUNNABLES[:2] if i % 2 == 0 else []
+
+    past_failures = test_scheduling.PastFailures("label", False)
+    items = []
+    labels = []
+    for i in range(40):
+        commit = make_commit(i)
+        for data in test_scheduling.generate_data(
+            "label",
+            past_failures,
+            commit,
+            i * 10,
+            RUNNABLES,
+            get_failures(i),
+            [],
+        ):
+            items.append({**commit, "test_job": data})
+            labels.append(int(data["name"] in get_failures(i)))
+    past_failures.push_num = 400
+    past_failures.all_runnables = RUNNABLES
+    past_failures.commit()
+    past_failures.close()
+
+    model = testselect.TestLabelSelectModel()
+    X = model.extraction_pipeline.fit_transform(lambda: items)
+    model.clf.fit(X, labels)
+
+    pushes = [
+        {
+            "revs": [f"rev{i}"],
+            "failures": get_failures(i),
+            "passes": RUNNABLES[len(get_failures(i)) :],
+        }
+        for i in range(40, 48)
+    ]
+    commit_map = {f"rev{i}": make_commit(i) for i in range(40, 48)}
+    monkeypatch.setattr(model, "get_pushes", lambda apply_filters: (pushes, 0))
+    monkeypatch.setattr(
+        test_scheduling, "get_push_data", lambda granularity: (lambda: [], 0, [])
+    )
+    monkeypatch.setattr(
+        test_scheduling,
+        "generate_failing_together_probabilities",
+        lambda *args: None,
+    )
+    monkeypatch.setattr(testselect, "get_commit_map", lambda revs: dict(commit_map))
+
+    # The workers open the past failures DB read-only and score with one thread.
+    monkeypatch.setattr(testselect, "_select_tests_model", model)
+    testselect._init_select_tests_worker()
+    assert testselect._select_tests_past_failures is not None
+    assert testselect._select_tests_past_failures.readonly
+    assert model.clf.named_steps["estimator"].n_jobs == 1
+    testselect._select_tests_past_failures.close()
+    testselect._select_tests_past_failures = None
+
+    model.evaluation(scenarios=[])
+
+    cache_path = model._get_selection_cache_path(400)
+    with open(cache_path, "rb") as f:
+        selection_cache = pickle.load(f)
+
+    past_failures = test_scheduling.PastFailures("label", True)
+    expected = {
+        push["revs"][0]: model.select_tests(
+            [commit_map[push["revs"][0]]],
+            0.5,
+            400 - (len(pushes) - (i + 1)) - 100,
+            past_failures,
+        )
+        for i, push in enumerate(pushes)
+    }
+    past_failures.close()
+    assert selection_cache == expected
+    assert any(len(selected) > 0 for selected in expected.values())
+
+    # The second run reuses the selections instead of scoring the pushes again.
+    def select_tests(*args, **kwargs):
+        assert False, "The selections should be read from the cache"
+
+    monkeypatch.setattr(model, "select_tests", select_tests)
+    model.evaluation(scenarios=[])
+    with open(cache_path, "rb") as f:
+        assert pickle.load(f) == expected
@@ -390,6 +390,30 @@ def test_extract_db_bad_format(tmp_path):
         utils.extract_file(path)
 
 
+def test_lmdb_dict_commit(tmp_path):
+    path = str(tmp_path / "prova.lmdb")
+
+    lmdb_dict = utils.LMDBDict(path)
+    lmdb_dict[b"committed"] = b"1"
+    lmdb_dict[b"deleted"] = b"1"
+    lmdb_dict.commit()
+
+    del lmdb_dict[b"deleted"]
+    lmdb_dict[b"not_committed"] = b"1"
+    with pytest.raises(KeyError):
+        del lmdb_dict[b"missing"]
+
+    # Simulate an interruption, losing the writes after the last commit.
+    lmdb_dict.txn.abort()
+    lmdb_dict.db.close()
+
+    lmdb_dict = utils.LMDBDict(path, readonly=True)
+    assert lmdb_dict[b"committed"] == b"1"
+    assert b"deleted" in lmdb_dict
+    assert b"not_committed" not in lmdb_dict
+    lmdb_dict.close()
+
+
 def test_extract_metadata() -> None:
     body = """
         <!-- @private_url: https://github.com/webcompat/web-bugs-private/issues/12345 -->\n
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import numpy as np
+
+from bugbug.vectordb import LocalVectorDB, QueryFilter, VectorPoint
+
+
+def make_points(vectors, start_id=1):
+    return [
+        VectorPoint(
+            id=start_id + i,
+            vector=vector.tolist(),
+            payload={
+                "comment": {"is_generated": i % 2 == 0, "date_created": float(i)},
+                "action": "REJECT" if i % 3 == 0 else "APPROVE",
+            },
+        )
+        for i, vector in enumerate(vectors)
+    ]
+
+
+def exact_search(vectors, query, limit):
+    normalized = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    scores = normalized @ (query / np.linalg.norm(query))
+    return [int(i) + 1 for i in np.argsort(-scores)[:limit]]
+
+
+def test_local_vectordb(tmp_path, monkeypatch):
+    rng = np.random.default_rng(42)
+    vectors = rng.normal(size=(50, 8)).astype(np.float32)
+
+    db = LocalVectorDB("test", size=8, path=str(tmp_path / "test"))
+    db.setup()
+    assert list(db.search(vectors[0].tolist())) == []
+    assert db.get_largest_id() == 0
+
+    db.insert(make_points(vectors[:30]))
+    # Inserting doesn't reload the whole collection.
+    with monkeypatch.context() as m:
+        m.setattr(db, "_load", None)
+        db.insert(make_points(vectors[30:], start_id=31))
+
+    assert set(db.get_existing_ids()) == set(range(1, 51))
+    assert db.get_largest_id() == 50
+
+    results = list(db.search(vectors[7].tolist(), limit=5))
+    assert [result.id for result in results] == exact_search(vectors, vectors[7], 5)
+    assert abs(results[0].score - 1) < 1e-5
+    assert results[0].payload["action"] == "APPROVE"
+
+    # Inserting a point with an existing ID replaces it.
+    db.insert(make_points([vectors[7] * -1], start_id=8))
+    assert 8 not in [result.id for result in db.search(vectors[7].tolist(), limit=5)]
+
+    # The collection can be opened again.
+    db.close()
+    db = LocalVectorDB("test", size=8, path=str(tmp_path / "test"))
+    assert len(set(db.get_existing_ids())) == 50
+    vectors[7] *= -1
+    assert [
+        result.id for result in db.search(vectors[7].tolist(), limit=5)
+    ] == exact_search(vectors, vectors[7], 5)
+    db.close()
+
+
+def test_local_vectordb_filter(tmp_path):
+    rng = np.random.default_rng(42)
+    vectors = rng.normal(size=(40, 8)).astype(np.float32)
+
+    db = LocalVectorDB("test", size=8, path=str(tmp_path / "test"))
+    db.setup()
+    db.insert(make_points(vectors))
+
+    results = list(
+        db.search(
+            vectors[0].tolist(),
+            filter=QueryFilter(
+                must_match={"comment.is_generated": True},
+                must_range={"comment.date_created": {"gte": 10, "lt": 30}},
+                must_not_has_id=[13],
+            ),
+            limit=100,
+        )
+    )
+    assert sorted(result.id for result in results) == [
+        i + 1 for i in range(10, 30, 2) if i + 1 != 13
+    ]
+    scores = [result.score for result in results]
+    assert scores == sorted(scores, reverse=True)
+
+    results = list(
+        db.search(
+            vectors[0].tolist(), filter=QueryFilter(must_match={"action": "REJECT"})
+        )
+    )
+    assert all(result.payload["action"] == "REJECT" for result in results)
+    assert len(results) == 10
+
+    # Like with Qdrant, numeric ranges don't match strings.
+    db.insert(
+        [
+            VectorPoint(
+                id=100,
+                vector=vectors[0].tolist(),
+                payload={"comment": {"date_created": "2020-01-01T00:00:00"}},
+            )
+        ]
+    )
+    results = db.search(
+        vectors[0].tolist(),
+        filter=QueryFilter(must_range={"comment.date_created": {"gte": 0}}),
+        limit=100,
+    )
+    assert 100 not in [result.id for result in results]
+    db.close()
+
+
+def test_local_vectordb_index(tmp_path):
+    rng = np.random.default_rng(42)
+    # Clustered vectors, so that the closest clusters hold the nearest neighbors.
+    centers = rng.normal(size=(20, 16))
+    vectors = (
+        centers[rng.integers(0, 20, size=2000)] + rng.normal(size=(2000, 16)) * 0.1
+    ).astype(np.float32)
+
+    db = LocalVectorDB(
+        "test", size=16, path=str(tmp_path / "test"), min_indexed_size=1000
+    )
+    db.setup()
+    db.insert(make_points(vectors[:1500]))
+    assert db.centroids is not None
+    assert db.indexed_rows == 1500
+
+    # New points are added to the existing clusters.
+    db.insert(make_points(vectors[1500:], start_id=1501))
+    assert db.indexed_rows == 1500
+    assert sum(len(rows) for rows in db.cluster_rows) == 2000
+    cluster_rows = db.cluster_rows
+    db.close()
+    db = LocalVectorDB(
+        "test", size=16, path=str(tmp_path / "test"), min_indexed_size=1000
+    )
+    assert all(
+        np.array_equal(np.sort(rows), reloaded_rows)
+        for rows, reloaded_rows in zip(cluster_rows, db.cluster_rows)
+    )
+
+    for i in (0, 1700):
+        results = [result.id for result in db.search(vectors[i].tolist(), limit=10)]
+        assert len(set(results) & set(exact_search(vectors, vectors[i], 10))) >= 9
+
+    # When the probed clusters don't have enough matching points, all the
+    # points are scanned.
+    results = list(
+        db.search(
+            vectors[0].tolist(),
+            filter=QueryFilter(must_match={"action": "REJECT"}),
+            limit=600,
+        )
+    )
+    assert len(results) == 600
+    db.close()
+
+
+def test_local_vectordb_search_many(tmp_path):
+    rng = np.random.default_rng(42)
+    vectors = rng.normal(size=(300, 8)).astype(np.float32)
+    queries = [vector.tolist() for vector in vectors[:20]]
+    query_filter = QueryFilter(must_match={"action": "REJECT"}, must_not_has_id=[4])
+
+    db = LocalVectorDB(
+        "test", size=8, path=str(tmp_path / "test"), min_indexed_size=200
+    )
+    db.setup()
+    db.insert(make_points(vectors[:100]))
+    assert db.search_many([]) == []
+
+    for _ in range(2):
+        for search_filter in (None, query_filter):
+            results = db.search_many(queries, search_filter, limit=5)
+            expected = [
+                list(db.search(query, search_filter, limit=5)) for query in queries
+            ]
+            assert [[result.id for result in r] for r in results] == [
+                [result.id for result in r] for r in expected
+            ]
+            assert np.allclose(
+                [[result.score for result in r] for r in results],
+                [[result.score for result in r] for r in expected],
+                atol=1e-5,
+            )
+
+        # The same results are returned with an index.
+        db.insert(make_points(vectors[100:], start_id=101))
+        assert db.centroids is not None
+
+    db.close()